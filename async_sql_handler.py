@@ -0,0 +1,100 @@
+from db_backends import AsyncMySQLBackend
+from metrics import get_shared_metrics
+from sql_handler import _column_list, _enqueue_chunks, _existing_values_query, _identifier, _new_enqueue_ids, _queue_insert_query
+import dotenv
+
+dotenv.load_dotenv()
+
+
+class AsyncSQLHandler:
+    def __init__(self, pool):
+        """
+        The SQLHandler calls an asyncio crawl pipeline needs, on an aiomysql pool. Create it with
+        await AsyncSQLHandler.create()
+        :param pool: An aiomysql pool
+        """
+        self.pool = pool
+
+    @classmethod
+    async def create(cls, pool_size: int = 10, backend: AsyncMySQLBackend = None) -> "AsyncSQLHandler":
+        """
+        Connect to the database configured in .env
+        :param pool_size: The most connections in the pool
+        :param backend: Defaults to an AsyncMySQLBackend with pool_size connections
+        :raises DatabaseConnectionError: If aiomysql isn't installed or the database can't be reached
+        """
+        backend = backend or AsyncMySQLBackend(maxsize=pool_size)
+        return cls(await backend.create_pool())
+
+    async def execute_query(self, query: str, params: tuple = None):
+        """
+        Run a query and return its rows
+        :param query: The SQL, with %s placeholders for params
+        :param params: The values bound to the placeholders
+        """
+        async with self.pool.acquire() as connection:
+            async with connection.cursor() as cursor:
+                await cursor.execute(query, params or ())
+                return await cursor.fetchall()
+
+    async def check_row_exists(self, table_name: str, column_name: str, value: str) -> bool:
+        rows = await self.execute_query(
+            f"SELECT 1 FROM {_identifier(table_name)} WHERE {_identifier(column_name)} = %s LIMIT 1", (value,))
+        return bool(rows)
+
+    async def insert_row(self, table_name: str, column: str, data: tuple):
+        columns = _column_list(column)
+        placeholders = ', '.join(['%s'] * len(data))
+        async with self.pool.acquire() as connection:
+            async with connection.cursor() as cursor:
+                await cursor.execute(f"INSERT INTO {_identifier(table_name)} ({columns}) VALUES ({placeholders})", tuple(data))
+            await connection.commit()
+
+    async def find_existing_values(self, table_name: str, column_name: str, values: list[str], connection=None) -> set[str]:
+        """
+        Find which of the given values already exist in a column, using a single IN (...) query
+        :param connection: A connection acquired from the pool. One is acquired when not given
+        """
+        if not values:
+            return set()
+        query = _existing_values_query(table_name, column_name, len(values))
+        if connection is None:
+            return {row[0] for row in await self.execute_query(query, tuple(values))}
+        async with connection.cursor() as cursor:
+            await cursor.execute(query, tuple(values))
+            return {row[0] for row in await cursor.fetchall()}
+
+    async def bulk_enqueue(self, video_ids: list[str], prepend_url: str = "https://youtube.com/watch?v=", chunk_size: int = 500,
+                           songs_table: str = "songs", queue_table: str = "archive_queue") -> dict[str, str]:
+        """
+        Same as SQLHandler.bulk_enqueue, without blocking the event loop
+        :return: A dict of video ID to its outcome: "archived", "queued", "enqueued" or "error"
+        """
+        outcomes = {}
+        async with self.pool.acquire() as connection:
+            for chunk in _enqueue_chunks(video_ids, chunk_size):
+                try:
+                    with get_shared_metrics().timer("db_check"):
+                        archived = await self.find_existing_values(songs_table, "video_id", chunk, connection)
+                        queued_urls = await self.find_existing_values(queue_table, "url", [prepend_url + vid for vid in chunk], connection)
+                    new_ids = _new_enqueue_ids(chunk, archived, queued_urls, prepend_url, outcomes)
+                    if new_ids:
+                        with get_shared_metrics().timer("db_insert"):
+                            async with connection.cursor() as cursor:
+                                await cursor.executemany(_queue_insert_query(queue_table), [(prepend_url + vid, 0) for vid in new_ids])
+                            await connection.commit()
+                    for vid in new_ids:
+                        outcomes[vid] = "enqueued"
+                except Exception as err:
+                    # aiomysql raises pymysql errors, and pymysql is only imported with it
+                    print("Error enqueueing data")
+                    print(err)
+                    await connection.rollback()
+                    for vid in chunk:
+                        outcomes.setdefault(vid, "error")
+        return outcomes
+
+    async def close(self):
+        self.pool.close()
+        await self.pool.wait_closed()
+        print("MySQL connection is closed")
@@ -0,0 +1,127 @@
+"""
+Benchmark the music title classifier against the keyword scan it replaced. Also reports how often
+the two disagree, broken down by cause (a legacy keyword only inside another word, outweighed by
+non-music terms, or terms the legacy scan didn't have), with samples, so term list changes can be reviewed.
+
+Titles come from --titles (one per line, e.g. exported from the songs table) or are generated from
+English, Japanese, Korean and Chinese title templates, including full-width and half-width forms.
+
+Usage: python benchmarks/bench_classifier.py [--titles titles.txt] [--count 50000] [--samples 10]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+import unicodedata
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from title_classifier import TitleClassifier
+
+LEGACY_KEYWORDS = ["cover", "original", "mv", "歌ってみた", "covered by", "official", "オリジナル曲"]
+
+SONGS = ["千本桜", "Stellar Stellar", "KING", "アイドル", "Bling-Bang-Bang-Born", "夜に駆ける", "Lemon", "ヒバナ", "シャルル", "Unravel"]
+NAMES = ["星街すいせい", "Mori Calliope", "宝鐘マリン", "IRyS", "湊あくあ", "Ninomae Ina'nis", "さくらみこ", "Kobo Kanaeru"]
+TEMPLATES = [
+    "【歌ってみた】{song} / {name}", "{song} / {name} (Cover)", "{song} covered by {name}", "【オリジナル曲】{song} / {name}",
+    "【MV】{song} - {name}", "{name} - {song} (Official Music Video)", "{song} 弾き語り【{name}】", "【3D LIVE】{name} 歌枠",
+    "【雑談】朝活！おはよう【{name}】", "【Minecraft】建築するぞ！【{name}】", "【APEX】ランクマ 耐久【{name}】",
+    "【同時視聴】アニメ見る！【{name}】", "Reacting to {song} | {name}", "{name} plays Pokemon for the first time",
+    "【ASMR】耳かき【{name}】", "【切り抜き】{name}の神回", "{song} (piano ver.) / {name}", "【翻唱】{song} - {name}",
+    "{song} 커버 by {name}", "【新曲】{song} MV公開！", "Discovering {song} live reaction", "{name} ft. {name2} - {song} remix",
+    "【歌枠】singing {song} and more!! 【{name}】", "{name} 誕生日記念ライブ", "Let's play Elden Ring #{n}",
+]
+
+
+def legacy(title: str) -> bool:
+    title = title.lower()
+    return any(keyword in title for keyword in LEGACY_KEYWORDS)
+
+
+def disagreement_cause(title: str, result) -> str:
+    """
+    Explain why the classifier and the legacy scan disagree on a title
+    :param title: The title
+    :param result: The classifier's TitleScore
+    :return: A short cause, used to group the disagreements
+    """
+    if result.is_music:
+        if legacy(unicodedata.normalize("NFKC", title)):
+            return "full-width or half-width form of a legacy keyword"
+        return "new terms: " + ", ".join(result.matched)
+    lowered = title.lower()
+    whole_words = [keyword for keyword in LEGACY_KEYWORDS
+                   if re.search(r"(?<![a-z0-9])" + re.escape(keyword) + r"(?![a-z0-9])", lowered)]
+    if not whole_words:
+        # "discovering" holds "cover", "mvp" holds "mv"
+        return "legacy keyword inside another word"
+    if result.negatives:
+        return "outweighed by: " + ", ".join(result.negatives)
+    return "legacy keyword below the threshold: " + ", ".join(whole_words)
+
+
+def generate_titles(count: int, rng: random.Random) -> list[str]:
+    titles = []
+    for n in range(count):
+        title = rng.choice(TEMPLATES).format(song=rng.choice(SONGS), name=rng.choice(NAMES), name2=rng.choice(NAMES), n=n)
+        form = rng.random()
+        if form < 0.05:
+            # Full-width Latin, as some uploaders type it
+            title = "".join(chr(ord(char) + 0xFEE0) if "!" <= char <= "~" else char for char in title)
+        elif form < 0.08:
+            # Half-width katakana
+            title = title.replace("オリジナル", "ｵﾘｼﾞﾅﾙ").replace("カバー", "ｶﾊﾞｰ")
+        titles.append(title)
+    return titles
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the music title classifier")
+    parser.add_argument("--titles", help="A file with one title per line. Generated titles are used otherwise")
+    parser.add_argument("--count", type=int, default=50000, help="The number of generated titles")
+    parser.add_argument("--samples", type=int, default=10, help="How many disagreements with the legacy scan to print")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the generated titles")
+    args = parser.parse_args()
+
+    if args.titles:
+        with open(args.titles, "r", encoding="utf-8") as f:
+            titles = [line.strip() for line in f if line.strip()]
+    else:
+        titles = generate_titles(args.count, random.Random(args.seed))
+
+    start = time.perf_counter()
+    classifier = TitleClassifier()
+    compile_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    legacy_flags = [legacy(title) for title in titles]
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    single = [classifier.score(title) for title in titles]
+    single_time = time.perf_counter() - start
+
+    music = sum(1 for result in single if result.is_music)
+    disagreements = [(title, old, new) for title, old, new in zip(titles, legacy_flags, single) if old != new.is_music]
+    print(f"{len(titles)} titles, {len(classifier.terms)} terms (compiled in {compile_time * 1000:.1f}ms)")
+    print(f"legacy scan:    {legacy_time:.3f}s ({len(titles) / legacy_time:,.0f} titles/s), {sum(legacy_flags)} music")
+    print(f"score:          {single_time:.3f}s ({len(titles) / single_time:,.0f} titles/s), {music} music")
+    print(f"disagreements with the legacy scan: {len(disagreements)} ({len(disagreements) / len(titles):.1%})")
+    causes = Counter(disagreement_cause(title, new) for title, _, new in disagreements)
+    for cause, count in causes.most_common():
+        print(f"  {count:>7} {cause}")
+    seen = set()
+    for title, old, new in disagreements:
+        if len(seen) >= args.samples:
+            break
+        if title in seen:
+            continue
+        seen.add(title)
+        print(f"  legacy={old!s:<5} new={new.is_music!s:<5} score={new.score:+.1f} {new.matched} {new.negatives} {title}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+"""
+End-to-end crawler benchmark that needs no network. Every external service is replaced by the
+local stand-ins in standins.py: Holodex search pages, API and JSON search, YouTube channel/playlist
+pages and continuations, and the Patchwork queue API. The DB is a scratch SQLite file behind
+SQLHandler (DB_ENGINE=sqlite), and the browser is replaced by a plain HTTP fetcher against the stand-in.
+
+Each crawl mode runs through crawler.run_crawl in its own process, so peak memory is per mode.
+The report shows videos per second, how many videos were enqueued, peak RSS, and latency
+percentiles per stage (page fetches, parsing, validation, duration lookups, enqueueing and
+each kind of HTTP call).
+
+Usage: python benchmarks/bench_crawl.py [--modes holodex,channel-http] [--pages 10] [--channels 8]
+                                        [--latency 0.02] [--crawl-args "--validate-workers 4"] [--json out.json]
+
+To record a run and replay it without the stand-in answering:
+  HTTP_CACHE_PATH=bench_cache.db python benchmarks/bench_crawl.py --port 18777 --crawl-args "--http-cache record"
+  HTTP_CACHE_PATH=bench_cache.db python benchmarks/bench_crawl.py --port 18777 --crawl-args "--http-cache replay"
+"""
+import argparse
+import contextlib
+import functools
+import json
+import os
+import resource
+import shlex
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from standins import Fixtures, StandInServer, channel_id, holodex_video_id
+
+PLAYLIST_ID = "PLbenchmarkplaylist000000000000000"
+
+MODES = {
+    "holodex": lambda opts: ["--start-page", "1", "--end-page", str(opts.pages), "--db"],
+    "holodex-api": lambda opts: ["--start-page", "1", "--end-page", str(opts.pages)],
+    "holodex-json": lambda opts: ["--start-page", "1", "--end-page", str(opts.pages), "--holodex-backend", "api",
+                                  "--holodex-page-size", str(opts.holodex_per_page), "--db"],
+    "channel-http": lambda opts: ["--channel", channel_id(0), "--listing-backend", "http", "--db"],
+    "channel-browser": lambda opts: ["--channel", channel_id(0), "--db"],
+    "playlist-http": lambda opts: ["--playlist", PLAYLIST_ID, "--listing-backend", "http"],
+    "channel-list": lambda opts: ["--youtube", "--channel_id_source", "channels.txt", "--listing-backend", "http", "--db"],
+}
+
+
+class StageTimes:
+    def __init__(self):
+        """
+        Latencies and the number of videos processed while a mode runs
+        """
+        self.latencies = {}
+        self.videos = 0
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self.latencies.setdefault(stage, []).append(seconds)
+
+    def count(self, videos: int):
+        with self._lock:
+            self.videos += videos
+
+    def wrap(self, owner, name: str, stage: str, on_result=None):
+        """
+        Replace owner.name with a version that records its latency under stage
+        :param on_result: Optional callback (args, result) run after every call, used for counting
+        """
+        func = getattr(owner, name)
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+            if on_result is not None:
+                on_result(args, result)
+            return result
+
+        setattr(owner, name, timed)
+
+    def summary(self) -> dict:
+        stages = {}
+        for stage, values in sorted(self.latencies.items()):
+            ordered = sorted(values)
+            pick = lambda q: ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+            stages[stage] = {"calls": len(ordered), "total": sum(ordered), "p50": pick(0.5), "p95": pick(0.95),
+                             "p99": pick(0.99), "max": ordered[-1]}
+        return stages
+
+
+class HttpScraper:
+    def __init__(self, base_url: str, times: StageTimes):
+        """
+        Stands in for SiteScraper: fetches pages from the stand-in server instead of rendering them
+        """
+        import requests
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.times = times
+        self.load_times = []
+        self.timeouts = 0
+
+    def get_page_source(self, url, ready_selector: str = None) -> str:
+        parsed = urlparse(url)
+        start = time.perf_counter()
+        source = self.session.get(self.base_url + parsed.path + ("?" + parsed.query if parsed.query else "")).text
+        elapsed = time.perf_counter() - start
+        self.load_times.append(elapsed)
+        self.times.record("browser_fetch", elapsed)
+        return source
+
+    def close(self):
+        self.session.close()
+
+
+class HttpScraperPool:
+    def __init__(self, base_url: str, times: StageTimes):
+        """
+        Stands in for ScraperPool with HttpScrapers
+        """
+        self.base_url = base_url
+        self.times = times
+        self.scrapers = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def acquire(self):
+        scraper = getattr(self._local, "scraper", None)
+        if scraper is None:
+            scraper = self._local.scraper = HttpScraper(self.base_url, self.times)
+            with self._lock:
+                self.scrapers.append(scraper)
+        yield scraper
+
+    def load_stats(self) -> dict:
+        from site_scraper import summarize_load_times
+        return summarize_load_times([load for scraper in self.scrapers for load in scraper.load_times])
+
+    def close(self):
+        for scraper in self.scrapers:
+            scraper.close()
+
+
+def http_stage(url: str) -> str:
+    path = urlparse(url).path
+    if path.startswith("/api/v2"):
+        return "http_holodex_api"
+    if path.startswith("/youtubei"):
+        return "http_continuation"
+    if path == "/watch":
+        return "http_watch_page"
+    if path.startswith("/queue"):
+        return "http_queue_api"
+    return "http_listing_page"
+
+
+def api_queue_length(base_url: str) -> int:
+    import requests
+    return requests.get(base_url + "/queue").json()["queued"]
+
+
+def prepare_workdir(workdir: str, opts):
+    """
+    Create the scratch SQLite DB (with some videos already archived) and the channel list
+    """
+    import sqlite3
+    connection = sqlite3.connect(os.path.join(workdir, "bench.db"))
+    connection.execute("CREATE TABLE songs (id INTEGER PRIMARY KEY AUTOINCREMENT, video_id TEXT)")
+    connection.execute("CREATE TABLE archive_queue (id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT, mode INT)")
+    connection.execute("CREATE INDEX songs_video_id ON songs (video_id)")
+    connection.execute("CREATE INDEX archive_queue_url ON archive_queue (url)")
+    archived = [(holodex_video_id(page, i),) for page in range(1, opts.pages + 1) for i in range(0, opts.holodex_per_page, 10)]
+    connection.executemany("INSERT INTO songs (video_id) VALUES (?)", archived)
+    connection.commit()
+    connection.close()
+    with open(os.path.join(workdir, "channels.txt"), "w") as f:
+        for i in range(opts.channels):
+            f.write(channel_id(i) + "\n")
+
+
+def run_mode(mode: str, opts) -> dict:
+    """
+    Run one crawl mode in this process against the stand-in at opts.base_url
+    """
+    workdir = tempfile.mkdtemp(prefix=f"bench_{mode}_")
+    prepare_workdir(workdir, opts)
+    os.environ.update({
+        "HOLODEX_API_KEY": "bench",
+        "HOLODEX_API_URL": opts.base_url + "/api/v2",
+        "HOLODEX_SEARCH_PAGE": opts.base_url + "/search?q=bench&page=",
+        "YOUTUBE_BASE_URL": opts.base_url,
+        "PATCHWORK_API": opts.base_url + "/queue",
+        "PATCHWORK_BULK_API": opts.base_url + "/queue/bulk" if opts.bulk_queue else "",
+        "WORKER_AUTH": "bench",
+        "DB_ENGINE": "sqlite",
+        "DB_DATABASE": os.path.join(workdir, "bench.db"),
+        "CRAWL_STATE_PATH": os.path.join(workdir, "crawl_state.db"),
+        "RATE_LIMITS": "127.0.0.1=100000/100000",
+    })
+    os.chdir(workdir)
+
+    import crawler
+    import holodex
+    import rate_limit
+    import source_parse
+    import youtube
+
+    times = StageTimes()
+    times.wrap(source_parse, "find_all_yt_video_ids_hldex", "extract")
+    times.wrap(youtube, "find_all_yt_videos_yt", "extract")
+    times.wrap(youtube, "find_all_videos_yt_playlist", "extract")
+    times.wrap(holodex, "check_videos_valid", "validate", lambda args, result: times.count(len(result)))
+    # The JSON search validates inline, so its videos are counted as they are listed
+    times.wrap(holodex, "search_videos", "search", lambda args, result: times.count(len(result[0])))
+    times.wrap(youtube, "resolve_video_duration", "duration")
+    times.wrap(youtube, "get_content_youtube_channel", "channel",
+               lambda args, result: result and times.count(len(result[0]) + len(result[1])))
+    times.wrap(youtube, "get_videos_in_playlist", "listing", lambda args, result: times.count(len(result)))
+    times.wrap(crawler, "enqueue_videos", "enqueue")
+    times.wrap(crawler, "enqueue_batch_to_db", "enqueue_db")
+    limiter_request = rate_limit.RateLimiter.request
+
+    def timed_request(self, method, url, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return limiter_request(self, method, url, *args, **kwargs)
+        finally:
+            times.record(http_stage(url), time.perf_counter() - start)
+
+    rate_limit.RateLimiter.request = timed_request
+
+    args = crawler.build_arg_parser().parse_args(MODES[mode](opts) + shlex.split(opts.crawl_args))
+    # run_crawl skips main(), so --http-cache from --crawl-args is applied here. Recorded requests are
+    # keyed by URL, so replaying in a later run needs the same HTTP_CACHE_PATH and --port
+    crawler.configure_http_cache(args)
+    pool = HttpScraperPool(opts.base_url, times)
+    queued_before = api_queue_length(opts.base_url)
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    try:
+        crawler.run_crawl(args, pool, None)
+    finally:
+        pool.close()
+    elapsed = time.perf_counter() - start
+    db_queue = crawler.get_shared_handler().get_query_result("SELECT COUNT(*) FROM archive_queue")[0][0]
+    return {
+        "mode": mode,
+        "seconds": elapsed,
+        "videos": times.videos,
+        "enqueued": db_queue + api_queue_length(opts.base_url) - queued_before,
+        "videos_per_second": times.videos / elapsed if elapsed else 0.0,
+        "baseline_rss_mb": baseline_rss / 1024,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "stages": times.summary(),
+    }
+
+
+def print_report(results: list[dict]):
+    print(f"{'mode':<16} {'videos':>7} {'enqueued':>9} {'seconds':>8} {'videos/s':>9} {'peak RSS':>10}")
+    for result in results:
+        print(f"{result['mode']:<16} {result['videos']:>7} {result['enqueued']:>9} {result['seconds']:>8.2f} "
+              f"{result['videos_per_second']:>9.1f} {result['peak_rss_mb']:>8.1f}MB")
+    for result in results:
+        print(f"\n{result['mode']} stage latencies (ms)")
+        print(f"  {'stage':<20} {'calls':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+        for stage, stats in result["stages"].items():
+            print(f"  {stage:<20} {stats['calls']:>6} {stats['p50'] * 1000:>8.1f} {stats['p95'] * 1000:>8.1f} "
+                  f"{stats['p99'] * 1000:>8.1f} {stats['max'] * 1000:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end crawler benchmark")
+    parser.add_argument("--modes", default=",".join(MODES), help=f"Comma separated crawl modes to run ({', '.join(MODES)})")
+    parser.add_argument("--pages", type=int, default=10, help="Holodex search pages to crawl")
+    parser.add_argument("--holodex-per-page", type=int, default=40, help="Videos per Holodex search page")
+    parser.add_argument("--channels", type=int, default=8, help="Channels in the channel list mode")
+    parser.add_argument("--channel-videos", type=int, default=120, help="Uploads per channel")
+    parser.add_argument("--playlist-videos", type=int, default=120, help="Items in the playlist")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds the stand-in adds to every response")
+    parser.add_argument("--bulk-queue", action="store_true", help="Serve and use the bulk queue endpoint")
+    parser.add_argument("--seed", type=int, default=1, help="Fixture seed")
+    parser.add_argument("--port", type=int, default=0, help="Port of the stand-in server (default: a free one)")
+    parser.add_argument("--crawl-args", default="", help="Extra crawler.py arguments for every mode, e.g. \"--validate-workers 4\"")
+    parser.add_argument("--json", help="Also write the results to this file, to compare runs")
+    parser.add_argument("--verbose", action="store_true", help="Show the crawler's output")
+    # Internal: run a single mode in this process
+    parser.add_argument("--run-mode", help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    opts = parser.parse_args()
+
+    if opts.run_mode:
+        result = run_mode(opts.run_mode, opts)
+        with open(opts.result, "w") as f:
+            json.dump(result, f)
+        return
+
+    fixtures = Fixtures(seed=opts.seed, holodex_per_page=opts.holodex_per_page, channel_videos=opts.channel_videos,
+                        playlist_videos=opts.playlist_videos)
+    server = StandInServer(fixtures, latency=opts.latency, bulk_queue=opts.bulk_queue, port=opts.port).start()
+    results = []
+    try:
+        for mode in opts.modes.split(","):
+            with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+                result_path = f.name
+            command = [sys.executable, os.path.abspath(__file__), "--run-mode", mode, "--base-url", server.base_url,
+                       "--result", result_path] + [arg for arg in sys.argv[1:] if arg not in ("--verbose",)]
+            output = None if opts.verbose else subprocess.DEVNULL
+            completed = subprocess.run(command, stdout=output, stderr=output)
+            if completed.returncode != 0:
+                print(f"{mode} failed with exit code {completed.returncode}. Rerun with --verbose to see why")
+                continue
+            with open(result_path) as f:
+                results.append(json.load(f))
+            os.remove(result_path)
+    finally:
+        server.stop()
+    print_report(results)
+    if opts.json:
+        with open(opts.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Compare the old serial enqueue path (a fresh requests.post per video) with QueueClient, against a
+local stand-in for the Patchwork queue API. The stand-in adds a fixed latency per post, can fail a
+fraction of posts, and optionally serves a bulk endpoint.
+
+Usage: python benchmarks/bench_enqueue_api.py [--videos 500] [--latency 0.02] [--fail-rate 0.05] [--in-flight 8] [--bulk]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from enqueue_client import QueueClient
+from rate_limit import RateLimiter
+import rate_limit
+
+
+def make_handler(latency: float, fail_rate: float, received: list):
+    class QueueHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(latency)
+            if random.random() < fail_rate:
+                status = 503
+            elif self.path == "/bulk":
+                received.extend(json.loads(body)["urls"])
+                status = 200
+            else:
+                received.append(body.decode())
+                status = 200
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    return QueueHandler
+
+
+def serial(api_url: str, video_ids: list[str]) -> int:
+    ok = 0
+    for vid in video_ids:
+        response = requests.post(api_url, data={"url": "https://youtube.com/watch?v=" + vid, "mode": 0})
+        ok += response.status_code == 200
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark serial vs pooled/concurrent API enqueueing")
+    parser.add_argument("--videos", type=int, default=500, help="The number of videos to enqueue")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds the stand-in takes per post")
+    parser.add_argument("--fail-rate", type=float, default=0.05, help="The fraction of posts the stand-in rejects with a 503")
+    parser.add_argument("--in-flight", type=int, default=8, help="QueueClient's in-flight window")
+    parser.add_argument("--bulk", action="store_true", help="Also serve and use the bulk endpoint")
+    args = parser.parse_args()
+
+    received = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(args.latency, args.fail_rate, received))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    # No retries, so both paths see the same failures, and no budget limiting the stand-in
+    rate_limit._shared_limiter = RateLimiter({"127.0.0.1": (1e6, 1000000)}, max_retries=0, failure_threshold=1000000)
+    video_ids = [f"bench{i:06d}" for i in range(args.videos)]
+
+    start = time.perf_counter()
+    serial_ok = serial(base + "/queue", video_ids)
+    serial_time = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmp:
+        spool = os.path.join(tmp, "spool.jsonl")
+        client = QueueClient(api_url=base + "/queue", auth="bench", bulk_url=base + "/bulk" if args.bulk else None,
+                             max_in_flight=args.in_flight, spool_path=spool)
+        statuses = client.submit(video_ids)
+        stats = client.stats()
+        spooled = stats["failed"]
+        retried = client.retry_spool()
+        client.close()
+    server.shutdown()
+
+    client_ok = sum(1 for status in statuses.values() if status == 200)
+    print(f"serial: {serial_time:.2f}s ({len(video_ids) / serial_time:.0f} videos/s), {serial_ok} ok")
+    print(f"client: {stats['seconds']:.2f}s ({stats['per_second']:.0f} videos/s), {client_ok} ok, {spooled} spooled")
+    print(f"retry:  {sum(1 for status in retried.values() if status == 200)}/{len(retried)} spooled videos enqueued")
+    print(f"speedup: {serial_time / stats['seconds']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
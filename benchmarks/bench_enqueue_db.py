@@ -0,0 +1,69 @@
+"""
+Compare the per-row DB enqueue path (check_row_exists + insert_row per video) with
+SQLHandler.bulk_enqueue. Runs against the DB configured in .env using scratch tables
+that are dropped afterwards.
+
+Usage: python benchmarks/bench_enqueue_db.py [--videos 1000] [--archived 0.3]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sql_handler import SQLHandler
+
+PREPEND_URL = "https://youtube.com/watch?v="
+SONGS_TABLE = "bench_songs"
+QUEUE_TABLE = "bench_archive_queue"
+
+
+def reset_tables(server: SQLHandler, archived_ids: list[str]):
+    for table in (SONGS_TABLE, QUEUE_TABLE):
+        server.drop_table(table)
+    server.create_table(SONGS_TABLE, "id INT AUTO_INCREMENT PRIMARY KEY, video_id VARCHAR(16), INDEX (video_id)")
+    server.create_table(QUEUE_TABLE, "id INT AUTO_INCREMENT PRIMARY KEY, url VARCHAR(64), mode INT, INDEX (url)")
+    cursor = server.connection.cursor()
+    cursor.executemany(f"INSERT INTO {SONGS_TABLE} (video_id) VALUES (%s)", [(vid,) for vid in archived_ids])
+    server.connection.commit()
+
+
+def per_row(server: SQLHandler, video_ids: list[str]):
+    for vid in video_ids:
+        if not server.check_row_exists(SONGS_TABLE, "video_id", vid):
+            server.insert_row(QUEUE_TABLE, "url, mode", (PREPEND_URL + vid, 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-row vs bulk DB enqueueing")
+    parser.add_argument("--videos", type=int, default=1000, help="The number of videos to enqueue")
+    parser.add_argument("--archived", type=float, default=0.3, help="The fraction of videos that are already archived")
+    args = parser.parse_args()
+
+    video_ids = [f"bench{i:06d}" for i in range(args.videos)]
+    archived_ids = video_ids[:int(len(video_ids) * args.archived)]
+    server = SQLHandler(pool_size=2)
+
+    reset_tables(server, archived_ids)
+    start = time.perf_counter()
+    per_row(server, video_ids)
+    per_row_time = time.perf_counter() - start
+
+    reset_tables(server, archived_ids)
+    start = time.perf_counter()
+    outcomes = server.bulk_enqueue(video_ids, PREPEND_URL, songs_table=SONGS_TABLE, queue_table=QUEUE_TABLE)
+    bulk_time = time.perf_counter() - start
+
+    for table in (SONGS_TABLE, QUEUE_TABLE):
+        server.drop_table(table)
+    server.close_connection()
+
+    enqueued = sum(1 for outcome in outcomes.values() if outcome == "enqueued")
+    print(f"per-row: {per_row_time:.2f}s ({len(video_ids) / per_row_time:.0f} videos/s)")
+    print(f"bulk:    {bulk_time:.2f}s ({len(video_ids) / bulk_time:.0f} videos/s), {enqueued} enqueued")
+    print(f"speedup: {per_row_time / bulk_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Benchmark the page parsers in source_parse against the BeautifulSoup implementation they
+replaced, over channel, playlist and Holodex fixture pages of several sizes. Every run first
+checks that both implementations return the same videos, and exits with status 1 on a mismatch
+or when the speedup falls below --min-speedup, so it doubles as a regression check.
+
+Fixture pages are generated (a rendered channel grid, a playlist and a Holodex search page with
+the markup the parsers look for, padded with script blobs like a real page), which is useful to
+see how the parsers scale with page size. Saved pages can be added with --channel-page /
+--playlist-page / --holodex-page. The regression check over the saved pages in tests/fixtures/pages
+runs under pytest-benchmark in tests/test_parsers.py, which also imports the reference parsers below.
+
+Usage: python benchmarks/bench_parsers.py [--sizes 50,500,3000] [--repeat 3] [--min-speedup 1.5]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import re
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import source_parse
+
+
+def reference_overlay_duration(tag, renderer_name: str) -> int:
+    renderer = tag.find_parent(renderer_name)
+    if renderer is None:
+        return None
+    overlay = renderer.find("ytd-thumbnail-overlay-time-status-renderer")
+    if overlay is None:
+        return None
+    return source_parse.parse_yt_duration(overlay.get_text(strip=True))
+
+
+def reference_channel(source: str, known_ids=None) -> list[tuple[str, str, int]]:
+    soup = BeautifulSoup(source, "html.parser")
+    videos = {}
+    for h3_tag in soup.find_all('h3', class_='style-scope ytd-rich-grid-media'):
+        a_tag = h3_tag.find('a', id='video-title-link')
+        if a_tag:
+            href = a_tag.get('href')
+            title = a_tag.get('title')
+            if href and title:
+                video_id = re.search(r'/watch\?v=([\w-]+)', href)
+                if video_id and (known_ids is None or video_id.group(1) not in known_ids):
+                    videos.setdefault((video_id.group(1), title, reference_overlay_duration(h3_tag, "ytd-rich-grid-media")))
+    return list(videos)
+
+
+def reference_playlist(source: str, known_ids=None) -> list[tuple[str, str, int]]:
+    soup = BeautifulSoup(source, "html.parser")
+    videos = {}
+    for h3_tag in soup.find_all('h3', class_='style-scope ytd-playlist-video-renderer'):
+        a_tag = h3_tag.find('a', id='video-title')
+        if a_tag:
+            href = a_tag.get('href')
+            title = a_tag.get('title')
+            if href and title:
+                video_id = href.split('&')[0].replace("/watch?v=", "")
+                if known_ids is not None and video_id in known_ids:
+                    continue
+                videos.setdefault((video_id, title, reference_overlay_duration(h3_tag, "ytd-playlist-video-renderer")))
+    return list(videos)
+
+
+def reference_holodex(source: str, known_ids=None) -> list[str]:
+    video_ids = set(re.findall(r'href="/watch/([\w-]+)"', source))
+    if known_ids is not None:
+        video_ids = {vid for vid in video_ids if vid not in known_ids}
+    return list(video_ids)
+
+
+def video_id(rng: random.Random) -> str:
+    return "".join(rng.choice("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_") for _ in range(11))
+
+
+def title(rng: random.Random, i: int) -> str:
+    return rng.choice(["【歌ってみた】", "[MV] ", "Original Song ", "cover & remix ", "&quot;Live&quot; "]) + f"Song {i} &lt;3"
+
+
+def page(body: str, rng: random.Random) -> str:
+    # Real pages carry megabytes of inline script next to the markup
+    blob = "".join(f'{{"k{i}":"{video_id(rng)}","n":{i}}},' for i in range(len(body) // 40))
+    return f"<html><head><script>var ytInitialPlayerResponse = [{blob}];</script></head><body>{body}</body></html>"
+
+
+def channel_page(videos: int, rng: random.Random) -> str:
+    items = []
+    for i in range(videos):
+        vid = video_id(rng)
+        overlay = "" if i % 17 == 0 else (
+            f'<ytd-thumbnail-overlay-time-status-renderer class="style-scope ytd-thumbnail">'
+            f'<span id="text" class="style-scope">\n  {rng.randint(0, 9)}:{rng.randint(0, 59):02d}\n</span>'
+            f'</ytd-thumbnail-overlay-time-status-renderer>')
+        items.append(
+            f'<ytd-rich-item-renderer class="style-scope ytd-rich-grid-renderer"><div id="content">'
+            f'<ytd-rich-grid-media class="style-scope ytd-rich-item-renderer"><div id="dismissible">'
+            f'<ytd-thumbnail><a id="thumbnail" href="/watch?v={vid}"><img src="x.jpg"></a>{overlay}</ytd-thumbnail>'
+            f'<div id="details"><div id="meta"><h3 class="style-scope ytd-rich-grid-media">'
+            f'<a id="video-title-link" class="yt-simple-endpoint" href="/watch?v={vid}" title="{title(rng, i)}">'
+            f'<yt-formatted-string id="video-title">{title(rng, i)}</yt-formatted-string></a></h3>'
+            f'<span class="inline-metadata-item">{i} views</span></div></div></div></ytd-rich-grid-media>'
+            f'</div></ytd-rich-item-renderer>')
+    return page("<ytd-rich-grid-renderer>" + "".join(items) + "</ytd-rich-grid-renderer>", rng)
+
+
+def playlist_page(videos: int, rng: random.Random) -> str:
+    items = []
+    for i in range(videos):
+        vid = video_id(rng)
+        overlay = "" if i % 13 == 0 else (
+            f'<ytd-thumbnail-overlay-time-status-renderer><span id="text">{rng.randint(1, 9)}:{rng.randint(0, 59):02d}</span>'
+            f'</ytd-thumbnail-overlay-time-status-renderer>')
+        items.append(
+            f'<ytd-playlist-video-renderer class="style-scope ytd-playlist-video-list-renderer">'
+            f'<div id="content"><ytd-thumbnail>{overlay}</ytd-thumbnail><div id="meta">'
+            f'<h3 class="style-scope ytd-playlist-video-renderer">'
+            f'<a id="video-title" href="/watch?v={vid}&amp;list=PLbench&amp;index={i + 1}" title="{title(rng, i)}">{title(rng, i)}</a>'
+            f'</h3></div></div></ytd-playlist-video-renderer>')
+    return page("<ytd-playlist-video-list-renderer>" + "".join(items) + "</ytd-playlist-video-list-renderer>", rng)
+
+
+def holodex_page(videos: int, rng: random.Random) -> str:
+    items = "".join(f'<div class="video-card"><a href="/watch/{video_id(rng)}" class="video-link">'
+                    f'<div class="title">{title(rng, i)}</div></a></div>' for i in range(videos))
+    return page(items, rng)
+
+
+def best_time(func, source: str, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        # The playlist parser prints every video it finds
+        with contextlib.redirect_stdout(io.StringIO()):
+            func(source)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark source_parse against the BeautifulSoup parsers")
+    parser.add_argument("--sizes", default="50,500,3000", help="Comma separated numbers of videos per fixture page")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement, the best one counts")
+    parser.add_argument("--min-speedup", type=float, default=1.5, help="Fail when a YouTube parser is slower than this many times the reference")
+    parser.add_argument("--channel-page", action="append", default=[], help="A saved rendered channel page to include")
+    parser.add_argument("--playlist-page", action="append", default=[], help="A saved rendered playlist page to include")
+    parser.add_argument("--holodex-page", action="append", default=[], help="A saved Holodex search page to include")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    parsers = {
+        "channel": (source_parse.find_all_yt_videos_yt, reference_channel, channel_page, args.channel_page),
+        "playlist": (source_parse.find_all_videos_yt_playlist, reference_playlist, playlist_page, args.playlist_page),
+        "holodex": (source_parse.find_all_yt_video_ids_hldex, reference_holodex, holodex_page, args.holodex_page),
+    }
+    ok = True
+    print(f"{'parser':<9} {'fixture':<18} {'size':>9} {'videos':>7} {'reference':>10} {'new':>9} {'speedup':>8}")
+    for name, (func, reference, generate, saved) in parsers.items():
+        fixtures = [(f"{size} videos", generate(size, rng)) for size in (int(size) for size in args.sizes.split(","))]
+        for path in saved:
+            with open(path, "r", encoding="utf-8") as f:
+                fixtures.append((os.path.basename(path)[:18], f.read()))
+        for label, source in fixtures:
+            with contextlib.redirect_stdout(io.StringIO()):
+                expected = reference(source)
+                actual = func(source)
+            if sorted(actual) != sorted(expected) or (name != "holodex" and actual != expected):
+                print(f"{name} {label}: output differs from the reference ({len(actual)} vs {len(expected)} videos)")
+                ok = False
+                continue
+            reference_time = best_time(reference, source, args.repeat)
+            new_time = best_time(func, source, args.repeat)
+            speedup = reference_time / new_time
+            print(f"{name:<9} {label:<18} {len(source) / 1e6:>7.2f}MB {len(actual):>7} {reference_time * 1000:>8.1f}ms "
+                  f"{new_time * 1000:>7.1f}ms {speedup:>7.1f}x")
+            if name != "holodex" and speedup < args.min_speedup:
+                print(f"{name} {label}: speedup {speedup:.1f}x is below {args.min_speedup}x")
+                ok = False
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Compare ORDER BY RAND() LIMIT n with SQLHandler.get_random_row (random key draws) on scratch tables
+of 10k, 100k and 1M rows. A fraction of the rows is deleted so the keys have gaps. Runs against the
+DB configured in .env (DB_ENGINE=sqlite with a scratch DB_DATABASE file works without a server);
+the scratch table is dropped afterwards.
+
+Usage: python benchmarks/bench_random_rows.py [--sizes 10000 100000 1000000] [--rows 10] [--calls 20] [--gaps 0.2]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sql_handler import SQLHandler
+
+TABLE = "bench_random_songs"
+
+
+def fill_table(server: SQLHandler, size: int, gaps: float):
+    server.drop_table(TABLE)
+    if server.engine == "sqlite":
+        server.create_table(TABLE, "id INTEGER PRIMARY KEY AUTOINCREMENT, video_id VARCHAR(16), title VARCHAR(100)")
+    else:
+        server.create_table(TABLE, "id INT AUTO_INCREMENT PRIMARY KEY, video_id VARCHAR(16), title VARCHAR(100)")
+    cursor = server.connection.cursor()
+    for start in range(0, size, 50000):
+        cursor.executemany(f"INSERT INTO {TABLE} (video_id, title) VALUES (%s, %s)",
+                           [(f"bench{i:07d}", f"Bench song {i}") for i in range(start, min(size, start + 50000))])
+    # Deleted rows leave gaps in the auto-increment keys
+    deleted = random.Random(size).sample(range(1, size + 1), int(size * gaps))
+    for start in range(0, len(deleted), 50000):
+        cursor.executemany(f"DELETE FROM {TABLE} WHERE id = %s", [(key,) for key in deleted[start:start + 50000]])
+    server.connection.commit()
+
+
+def order_by_rand(server: SQLHandler, rows: int) -> list:
+    random_function = "RANDOM()" if server.engine == "sqlite" else "RAND()"
+    return server.get_query_result(f"SELECT * FROM {TABLE} ORDER BY {random_function} LIMIT {int(rows)}")
+
+
+def timed(function, calls: int) -> tuple[float, list]:
+    results = []
+    start = time.perf_counter()
+    for _ in range(calls):
+        results.append(function())
+    return (time.perf_counter() - start) / calls, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ORDER BY RAND() vs random key sampling")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000], help="Table sizes to test")
+    parser.add_argument("--rows", type=int, default=10, help="Rows picked per call")
+    parser.add_argument("--calls", type=int, default=20, help="Calls timed per method and size")
+    parser.add_argument("--gaps", type=float, default=0.2, help="The fraction of rows deleted before sampling")
+    args = parser.parse_args()
+
+    server = SQLHandler()
+    print(f"{'rows':>9} {'ORDER BY RAND()':>16} {'get_random_row':>15} {'speedup':>8}")
+    for size in args.sizes:
+        fill_table(server, size, args.gaps)
+        rand_time, _ = timed(lambda: order_by_rand(server, args.rows), args.calls)
+        sample_time, samples = timed(lambda: server.get_random_row(TABLE, args.rows), args.calls)
+        if any(len(sample) != args.rows or len({row[0] for row in sample}) != args.rows for sample in samples):
+            print("get_random_row returned duplicate or missing rows")
+            sys.exit(1)
+        print(f"{size:>9} {rand_time * 1000:>14.2f}ms {sample_time * 1000:>13.2f}ms {rand_time / sample_time:>7.1f}x")
+    server.drop_table(TABLE)
+    server.close_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+Local stand-ins for the services the crawler talks to, served from one HTTP server:
+
+- Holodex search pages (/search?...&page=N), the video API (/api/v2/videos) and the JSON video
+  search (/api/v2/search/videoSearch, offset paginated)
+- YouTube channel and playlist pages with embedded ytInitialData and rendered markup,
+  InnerTube continuations (/youtubei/v1/browse) and watch pages (/watch?v=)
+- The Patchwork queue API (/queue and /queue/bulk). GET /queue reports how many URLs were queued
+
+Fixtures are generated from a seed, so every run serves the same videos. Used by bench_crawl.py
+"""
+import json
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+TITLES = ["【歌ってみた】{} / cover", "{} (Original Song)", "[MV] {}", "{} - Official Music Video", "Minecraft stream #{}",
+          "{} covered by a vtuber", "Zatsudan {}", "オリジナル曲「{}」"]
+
+
+def seeded(seed: int, key: str) -> int:
+    return zlib.crc32(f"{seed}:{key}".encode())
+
+
+def holodex_video_id(page: int, index: int) -> str:
+    return f"hx{page:04d}{index:05d}"
+
+
+def youtube_video_id(listing: str, index: int) -> str:
+    return f"yt{zlib.crc32(listing.encode()) % 10000:04d}{index:05d}"
+
+
+def channel_id(index: int) -> str:
+    return f"UCbench{index:017d}"
+
+
+class Fixtures:
+    def __init__(self, seed: int = 1, holodex_per_page: int = 40, channel_videos: int = 120, playlist_videos: int = 120,
+                 batch_size: int = 30, holodex_total: int = 100000):
+        """
+        The deterministic content of the stand-in services
+        :param seed: Changes which videos are valid, their titles and durations
+        :param holodex_per_page: The number of videos per Holodex search page
+        :param channel_videos: The number of uploads of every channel
+        :param playlist_videos: The number of items of every playlist
+        :param batch_size: The number of videos per YouTube listing batch (the first page and every continuation)
+        :param holodex_total: The number of results of the JSON video search. They are the videos of the
+                              search pages in page order
+        """
+        self.seed = seed
+        self.holodex_per_page = holodex_per_page
+        self.channel_videos = channel_videos
+        self.playlist_videos = playlist_videos
+        self.batch_size = batch_size
+        self.holodex_total = holodex_total
+        # Video IDs the multi-ID endpoint leaves out, as the real API does for some videos
+        self.batch_missing = set()
+        # Video IDs whose search records come without status and duration
+        self.search_without_details = set()
+
+    def duration(self, video_id: str) -> int:
+        return 30 + seeded(self.seed, video_id) % 600
+
+    def status(self, video_id: str) -> str:
+        return "upcoming" if seeded(self.seed, "status" + video_id) % 20 == 0 else "past"
+
+    def title(self, video_id: str) -> str:
+        return TITLES[seeded(self.seed, "title" + video_id) % len(TITLES)].format(video_id)
+
+    def holodex_video(self, video_id: str) -> dict:
+        return {"id": video_id, "title": self.title(video_id), "type": "stream", "topic_id": "Music_Cover",
+                "status": self.status(video_id), "duration": self.duration(video_id)}
+
+    def holodex_search_page(self, page: int) -> str:
+        cards = "".join(f'<div class="video-card"><a href="/watch/{holodex_video_id(page, i)}" class="video-card-link">'
+                        f'<div class="video-title">{self.title(holodex_video_id(page, i))}</div></a></div>'
+                        for i in range(self.holodex_per_page))
+        return f"<html><head><script>window.__NUXT__={{}}</script></head><body><main>{cards}</main></body></html>"
+
+    def holodex_search(self, offset: int, limit: int, topics: list[str]) -> dict:
+        ids = [holodex_video_id(i // self.holodex_per_page + 1, i % self.holodex_per_page)
+               for i in range(offset, min(offset + limit, self.holodex_total))]
+        items = [self.holodex_video(vid) for vid in ids]
+        for item in items:
+            if item["id"] in self.search_without_details:
+                del item["status"], item["duration"]
+        return {"total": self.holodex_total, "items": [item for item in items if not topics or item["topic_id"] in topics]}
+
+    def listing_ids(self, listing: str) -> list[str]:
+        count = self.playlist_videos if listing.startswith("PL") else self.channel_videos
+        return [youtube_video_id(listing, i) for i in range(count)]
+
+    def _renderer(self, listing: str, video_id: str) -> dict:
+        renderer = {"videoId": video_id, "title": {"runs": [{"text": self.title(video_id)}]}}
+        # Some listings carry no length label, so the watch page has to be read
+        if seeded(self.seed, "label" + video_id) % 10:
+            seconds = self.duration(video_id)
+            renderer["lengthText"] = {"simpleText": f"{seconds // 60}:{seconds % 60:02d}"}
+        if listing.startswith("PL"):
+            return {"playlistVideoRenderer": renderer}
+        return {"richItemRenderer": {"content": {"videoRenderer": renderer}}}
+
+    def listing_batch(self, listing: str, offset: int) -> list[dict]:
+        ids = self.listing_ids(listing)
+        items = [self._renderer(listing, video_id) for video_id in ids[offset:offset + self.batch_size]]
+        if offset + self.batch_size < len(ids):
+            token = f"{listing}:{offset + self.batch_size}"
+            items.append({"continuationItemRenderer": {"continuationEndpoint": {"continuationCommand": {"token": token}}}})
+        return items
+
+    def _rendered_markup(self, listing: str) -> str:
+        # What the browser shows once the first batch has rendered
+        playlist = listing.startswith("PL")
+        item_tag = "ytd-playlist-video-renderer" if playlist else "ytd-rich-grid-media"
+        items = []
+        for video_id in self.listing_ids(listing)[:self.batch_size]:
+            seconds = self.duration(video_id)
+            title = self.title(video_id).replace('"', "&quot;")
+            href = f"/watch?v={video_id}&amp;list={listing}" if playlist else f"/watch?v={video_id}"
+            link_id = "video-title" if playlist else "video-title-link"
+            items.append(f'<{item_tag} class="style-scope"><ytd-thumbnail><ytd-thumbnail-overlay-time-status-renderer>'
+                         f'<span id="text">{seconds // 60}:{seconds % 60:02d}</span></ytd-thumbnail-overlay-time-status-renderer>'
+                         f'</ytd-thumbnail><h3 class="style-scope {item_tag}"><a id="{link_id}" href="{href}" title="{title}">'
+                         f'{title}</a></h3></{item_tag}>')
+        return "".join(items)
+
+    def listing_name(self, listing: str) -> str:
+        return f"Bench channel {listing[-4:]}" if listing.startswith("UC") else f"Bench playlist {listing[-4:]}"
+
+    def listing_page(self, listing: str) -> str:
+        data = {"contents": {"twoColumnBrowseResultsRenderer": {"tabs": [{"tabRenderer": {"content": {
+            "richGridRenderer": {"contents": self.listing_batch(listing, 0)}}}}]}}}
+        config = {"INNERTUBE_API_KEY": "bench", "INNERTUBE_CONTEXT": {"client": {"clientName": "WEB", "clientVersion": "2.20241201.00.00"}}}
+        return (f'<html><head><meta property="og:title" content="{self.listing_name(listing)}">'
+                f"<script>ytcfg.set({json.dumps(config)});</script>"
+                f"<script>var ytInitialData = {json.dumps(data)};</script></head>"
+                f"<body>{self._rendered_markup(listing)}</body></html>")
+
+    def continuation(self, token: str) -> dict:
+        listing, offset = token.rsplit(":", 1)
+        return {"onResponseReceivedActions": [{"appendContinuationItemsAction": {
+            "continuationItems": self.listing_batch(listing, int(offset))}}]}
+
+    def watch_page(self, video_id: str) -> str:
+        player = {"videoDetails": {"videoId": video_id, "lengthSeconds": str(self.duration(video_id))}}
+        return (f"<html><head><title>{self.title(video_id)} - YouTube</title></head>"
+                f"<body><script>var ytInitialPlayerResponse = {json.dumps(player)};</script></body></html>")
+
+
+class StandInServer:
+    def __init__(self, fixtures: Fixtures, latency: float = 0.0, bulk_queue: bool = False, port: int = 0):
+        """
+        Serve the fixtures on a free local port
+        :param fixtures: The content to serve
+        :param latency: Seconds added to every response, to model network round trips
+        :param bulk_queue: Serve the bulk queue endpoint (otherwise it answers 404)
+        :param port: The port to listen on. 0 picks a free one
+        """
+        self.fixtures = fixtures
+        self.latency = latency
+        self.bulk_queue = bulk_queue
+        self.queued = []
+        self.requests = 0
+        # The next queue posts answered 429 (with Retry-After: 0), and URLs the queue rejects with 400.
+        # A bulk post containing a rejected URL is rejected whole
+        self.queue_throttled = 0
+        self.queue_rejected = set()
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self) -> "StandInServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out as separate writes; without this every response waits on a delayed ACK
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, body, content_type: str = "text/html; charset=utf-8", headers: dict = None):
+                if not isinstance(body, (str, bytes)):
+                    body, content_type = json.dumps(body), "application/json"
+                if isinstance(body, str):
+                    body = body.encode("utf-8")
+                if standin.latency:
+                    time.sleep(standin.latency)
+                with standin._lock:
+                    standin.requests += 1
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                fixtures = standin.fixtures
+                if url.path == "/search":
+                    return self._send(200, fixtures.holodex_search_page(int(query.get("page", ["1"])[0])))
+                if url.path == "/api/v2/videos":
+                    ids = query.get("id", [""])[0].split(",")
+                    return self._send(200, [fixtures.holodex_video(vid) for vid in ids if vid and vid not in fixtures.batch_missing])
+                if url.path.startswith("/api/v2/videos/"):
+                    return self._send(200, fixtures.holodex_video(url.path.rsplit("/", 1)[1]))
+                if url.path.startswith("/channel/"):
+                    return self._send(200, fixtures.listing_page(url.path.split("/")[2]))
+                if url.path == "/playlist":
+                    return self._send(200, fixtures.listing_page(query["list"][0]))
+                if url.path == "/watch":
+                    return self._send(200, fixtures.watch_page(query["v"][0]))
+                if url.path == "/queue":
+                    with standin._lock:
+                        queued = len(standin.queued)
+                    return self._send(200, {"queued": queued})
+                self._send(404, "Not found")
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                url = urlparse(self.path)
+                if url.path == "/api/v2/search/videoSearch":
+                    search = json.loads(body)
+                    return self._send(200, standin.fixtures.holodex_search(search.get("offset", 0), search.get("limit", 30),
+                                                                           search.get("topic")))
+                if url.path == "/youtubei/v1/browse":
+                    return self._send(200, standin.fixtures.continuation(json.loads(body)["continuation"]))
+                if url.path == "/queue" or (url.path == "/queue/bulk" and standin.bulk_queue):
+                    urls = parse_qs(body.decode())["url"] if url.path == "/queue" else json.loads(body)["urls"]
+                    with standin._lock:
+                        throttled = standin.queue_throttled > 0
+                        rejected = not throttled and any(queued_url in standin.queue_rejected for queued_url in urls)
+                        if throttled:
+                            standin.queue_throttled -= 1
+                        elif not rejected:
+                            standin.queued.extend(urls)
+                    if throttled:
+                        return self._send(429, "", headers={"Retry-After": "0"})
+                    return self._send(400 if rejected else 200, "")
+                self._send(404, "Not found")
+
+        return Handler
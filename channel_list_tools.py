@@ -1,87 +1,498 @@
-# A simple script to deduplicate a list of Channel IDs
-# and also other various tools for managing the channel list
-import requests
+# Tools for maintaining the channel list: pulling it, cleaning and deduplicating it, shuffling it
+# and resolving channel names. Every step streams the list, so memory stays flat however long it is
+import rate_limit
+from http_cache import MODES as HTTP_CACHE_MODES, CacheMissError, get_shared_cache
 from tqdm import tqdm
+from contextlib import contextmanager
+import argparse
+import codecs
 import concurrent.futures
+import dotenv
+import html
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+REMOTE_CHANNELS_URL = "https://raw.githubusercontent.com/Patchwork-Archive/Patchwork-Data/main/channels.txt"
+DEFAULT_CHANNEL_CACHE_PATH = "cache/channel_names.db"
+
+_OG_TITLE = b'<meta property="og:title" content="'
+# og:title sits in the page head. Stop reading a page after this many bytes if it hasn't shown up
+MAX_PAGE_BYTES = 2 * 1024 * 1024
+# Lines per bucket when shuffling, so only one bucket is held in memory at a time
+SHUFFLE_BUCKET_LINES = 200000
+
+
+def channel_page_url(channel_id: str) -> str:
+    # Read when called, so a .env loaded by main() (or a test's stand-in server) is picked up
+    return (os.getenv("YOUTUBE_BASE_URL") or "https://www.youtube.com") + "/channel/" + channel_id
+
+
+def channel_cache_path() -> str:
+    """
+    The channel name cache file: the CHANNEL_CACHE_PATH env variable or cache/channel_names.db
+    """
+    return os.getenv("CHANNEL_CACHE_PATH") or DEFAULT_CHANNEL_CACHE_PATH
+
+
+def iter_lines(file_path: str):
+    """
+    Stream the non-empty lines of a file, without their line endings
+    """
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+
+
+@contextmanager
+def rewrite(file_path: str):
+    """
+    Open a temporary file that replaces file_path once the with block completes, so the input can be
+    streamed while the output is written, and an interrupted run leaves the old file in place
+    """
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".channels_")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            yield f
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class OnDiskSet:
+    def __init__(self, directory: str = None):
+        """
+        A set of strings kept in a temporary SQLite file, for deduplicating lists that shouldn't be
+        held in memory. The file is removed on close
+        :param directory: Where to put the file. Defaults to the system temp directory
+        """
+        fd, self.path = tempfile.mkstemp(dir=directory, prefix="channel_set_", suffix=".db")
+        os.close(fd)
+        self.connection = sqlite3.connect(self.path)
+        # Scratch data: no journal or fsync needed
+        self.connection.execute("PRAGMA journal_mode = OFF")
+        self.connection.execute("PRAGMA synchronous = OFF")
+        self.connection.execute("CREATE TABLE members (value TEXT PRIMARY KEY) WITHOUT ROWID")
+
+    def add(self, value: str) -> bool:
+        """
+        Add a value
+        :return: True if it wasn't in the set yet
+        """
+        return self.connection.execute("INSERT OR IGNORE INTO members (value) VALUES (?)", (value,)).rowcount == 1
+
+    def close(self):
+        self.connection.close()
+        os.remove(self.path)
+
+    def __enter__(self) -> "OnDiskSet":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _channel_id(line: str) -> str:
+    # Lines of appended_channels.txt are "<channel ID> - <channel name>"
+    return line.split(" - ")[0].strip()
+
+
+def clean_channel_list(source_path: str = "appended_channels.txt", dest_path: str = "channels.txt") -> int:
+    """
+    Turn an appended channel list into a plain one in a single pass: drop Topic channels and channels
+    whose name couldn't be resolved, strip the names and drop duplicates (first occurrence wins)
+    :param source_path: The list of "<channel ID> - <channel name>" lines
+    :param dest_path: The channel ID list to write. May be the same file as source_path
+    :return: The number of channel IDs written
+    """
+    written = 0
+    with OnDiskSet(os.path.dirname(os.path.abspath(dest_path))) as seen, rewrite(dest_path) as out:
+        for line in iter_lines(source_path):
+            if "Topic" in line or "[Error]" in line:
+                continue
+            channel_id = _channel_id(line)
+            if channel_id and seen.add(channel_id):
+                out.write(channel_id + "\n")
+                written += 1
+    print(f"Cleaned channel list: {written} channels")
+    return written
 
 
 def deduplicate_channel_ids(file_path: str = ""):
     """
-    Deduplicate a list of channel IDs
+    Deduplicate a list of channel IDs, keeping the first occurrence of each
     :param file_path: The path to the file containing the channel IDs
     """
-    with open(file_path, "r") as f:
-        channel_ids = f.readlines()
-    channel_ids = [channel_id.strip() for channel_id in channel_ids]
-    channel_ids = list(set(channel_ids))
-    with open(file_path, "w") as f:
-        for channel_id in channel_ids:
-            f.write(f"{channel_id}\n")
+    with OnDiskSet(os.path.dirname(os.path.abspath(file_path))) as seen, rewrite(file_path) as out:
+        for line in iter_lines(file_path):
+            if seen.add(line):
+                out.write(line + "\n")
     print("Deduplication complete")
 
-def shuffle_file(file_path: str = ""):
-    import random
+
+def shuffle_file(file_path: str = "", bucket_lines: int = SHUFFLE_BUCKET_LINES):
     """
-    Shuffle the lines in a file
+    Shuffle the lines in a file. Lines are dealt into random bucket files, then every bucket is
+    shuffled in memory on its own, so memory is bounded by the bucket size
     :param file_path: The path to the file to shuffle
+    :param bucket_lines: The average number of lines per bucket
+    """
+    with open(file_path, "rb") as f:
+        total = sum(1 for _ in f)
+    bucket_count = max(1, -(-total // bucket_lines))
+    directory = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(file_path)), prefix=".shuffle_")
+    bucket_paths = [os.path.join(directory, f"{i}.txt") for i in range(bucket_count)]
+    try:
+        buckets = [open(path, "w", encoding="utf-8") for path in bucket_paths]
+        try:
+            for line in iter_lines(file_path):
+                random.choice(buckets).write(line + "\n")
+        finally:
+            for bucket in buckets:
+                bucket.close()
+        with rewrite(file_path) as out:
+            for path in bucket_paths:
+                with open(path, "r", encoding="utf-8") as bucket:
+                    lines = bucket.readlines()
+                random.shuffle(lines)
+                out.writelines(lines)
+    finally:
+        for path in bucket_paths:
+            if os.path.exists(path):
+                os.remove(path)
+        os.rmdir(directory)
+
+
+def pull_channel_file(remote_url: str = REMOTE_CHANNELS_URL, local_path: str = "appended_channels.txt") -> bool:
     """
-    with open(file_path, "r") as f:
-        lines = f.readlines()
-    random.shuffle(lines)
-    with open(file_path, "w") as f:
-        for line in lines:
-            f.write(line)
-
-def pull_channel_file():
-    remote_url = "https://raw.githubusercontent.com/Patchwork-Archive/Patchwork-Data/main/channels.txt"
-    local_path = "appended_channels.txt"
-    response = requests.get(remote_url)
-    if response.status_code == 200:
-        with open(local_path, "w") as f:
-            f.write(response.text)
-        print("File downloaded successfully")
-    else:
-        print("Failed to download file")
-
-def remove_topic_channels():
-    with open("appended_channels.txt", "r") as f:
-        lines = f.readlines()
-    with open("appended_channels.txt", "w") as f:
-        for line in lines:
+    Download the shared channel list, streamed to disk. The ETag and Last-Modified of the last
+    download are kept next to the file, so an unchanged list isn't downloaded again. The streamed
+    response isn't in the HTTP cache, so in record mode the list is stored as a value under the
+    channel_list source, and replay mode serves it from there
+    :param remote_url: The URL of the list
+    :param local_path: Where to save it
+    :return: True if the local file is up to date (downloaded or unchanged)
+    """
+    http_cache = get_shared_cache()
+    if http_cache.mode == "replay":
+        try:
+            content = http_cache.get_value("channel_list", remote_url)
+        except CacheMissError as e:
+            print(f"Failed to download file: {e}")
+            return False
+        with rewrite(local_path) as out:
+            out.write(content)
+        print("File restored from the HTTP cache")
+        return True
+    meta_path = local_path + ".meta.json"
+    meta = {}
+    # Recording needs the whole list, not a 304
+    if os.path.exists(local_path) and os.path.exists(meta_path) and http_cache.mode != "record":
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+    headers = {}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+    response = rate_limit.request("GET", remote_url, cache="channel_list", headers=headers, stream=True, timeout=60)
+    try:
+        if response.status_code == 304:
+            print("File is up to date")
+            return True
+        if response.status_code != 200:
+            print("Failed to download file")
+            return False
+        # Chunks can end inside a multi-byte character
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        with rewrite(local_path) as out:
+            for chunk in response.iter_content(chunk_size=65536):
+                out.write(decoder.decode(chunk))
+            out.write(decoder.decode(b"", final=True))
+    finally:
+        response.close()
+    with open(meta_path, "w") as f:
+        json.dump({"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}, f)
+    if http_cache.mode == "record":
+        with open(local_path, "r", encoding="utf-8") as f:
+            http_cache.put_value("channel_list", remote_url, f.read())
+    print("File downloaded successfully")
+    return True
+
+
+def remove_topic_channels(file_path: str = "appended_channels.txt"):
+    with rewrite(file_path) as out:
+        for line in iter_lines(file_path):
             if "Topic" not in line and "[Error]" not in line:
-                f.write(line)
+                out.write(line + "\n")
 
-def deappend_channels():
-    with open("appended_channels.txt", "r") as f:
-        lines = f.readlines()
-    with open("channels.txt", "w") as f:
-        for line in lines:
-            f.write(line.split(" - ")[0].strip() + "\n")
 
-def process_channel(channel_id):
-    response = requests.get(f"https://www.youtube.com/channel/{channel_id}")
-    if response.status_code == 200:
+def deappend_channels(source_path: str = "appended_channels.txt", dest_path: str = "channels.txt"):
+    with rewrite(dest_path) as out:
+        for line in iter_lines(source_path):
+            out.write(_channel_id(line) + "\n")
+
+
+class ChannelNameCache:
+    def __init__(self, path: str = None):
+        """
+        Resolved channel names with the validators needed to revalidate them cheaply
+        :param path: The path of the SQLite file. Defaults to channel_cache_path()
+        """
+        path = path or channel_cache_path()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS channel_names (
+            channel_id TEXT PRIMARY KEY,
+            name TEXT,
+            status TEXT NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            fetched_at REAL NOT NULL)""")
+        self.connection.commit()
+
+    def get(self, channel_id: str):
+        """
+        :return: (name, status, etag, last_modified, fetched_at), or None if the channel was never resolved
+        """
+        with self._lock:
+            return self.connection.execute("SELECT name, status, etag, last_modified, fetched_at FROM channel_names "
+                                           "WHERE channel_id = ?", (channel_id,)).fetchone()
+
+    def put(self, channel_id: str, name: str, status: str, etag: str = None, last_modified: str = None):
+        with self._lock:
+            self.connection.execute("INSERT OR REPLACE INTO channel_names (channel_id, name, status, etag, last_modified, fetched_at) "
+                                    "VALUES (?, ?, ?, ?, ?, ?)", (channel_id, name, status, etag, last_modified, time.time()))
+
+    def commit(self):
+        with self._lock:
+            self.connection.commit()
+
+    def close(self):
+        with self._lock:
+            self.connection.commit()
+            self.connection.close()
+
+
+def fetch_channel_name(channel_id: str, cached=None) -> tuple:
+    """
+    Resolve a channel's name from the og:title of its page. Only the page head is read, and a
+    cached entry is revalidated with If-None-Match / If-Modified-Since when it has validators.
+    With the HTTP cache on, the resolved name (not the page) is cached under the channel_page source
+    :param channel_id: The channel ID
+    :param cached: The channel's ChannelNameCache entry, if any
+    :return: (name, status, etag, last_modified). status is "ok", "not_found" or "error"
+    """
+    http_cache = get_shared_cache()
+    if http_cache.enabled:
         try:
-            channel_name = response.text.split('<meta property="og:title" content="')[1].split('">')[0]
-        except:
-            channel_name = "[Error] Channel name not found"
-        return f"{channel_id} - {channel_name}\n"
-    else:
-        return f"{channel_id} - [Error] Channel not found\n"
-
-def process_helper():
-    with open("appended_channels.txt", "w") as f:
-        with open("channels.txt", "r") as c:
-            total_lines = sum(1 for _ in c)  # Count the total number of lines in the file
-            c.seek(0)  # Reset the file pointer to the beginning
-
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                channel_ids = [line.strip() for line in c]
-                results = list(tqdm(executor.map(process_channel, channel_ids), total=total_lines, desc="Processing channels"))
-                f.writelines(results)
-
-pull_channel_file()
-remove_topic_channels()
-deduplicate_channel_ids("appended_channels.txt")
-deappend_channels()
-shuffle_file("channels.txt")
\ No newline at end of file
+            value = http_cache.get_value("channel_page", channel_id)
+        except CacheMissError as e:
+            return f"[Error] {e}", "error", None, None
+        if value is not None:
+            return tuple(value)
+    result = _fetch_channel_name(channel_id, cached)
+    if http_cache.enabled and result[1] != "error":
+        http_cache.put_value("channel_page", channel_id, list(result))
+    return result
+
+
+def _fetch_channel_name(channel_id: str, cached=None) -> tuple:
+    headers = {}
+    if cached is not None and cached[1] == "ok":
+        if cached[2]:
+            headers["If-None-Match"] = cached[2]
+        if cached[3]:
+            headers["If-Modified-Since"] = cached[3]
+    try:
+        response = rate_limit.request("GET", channel_page_url(channel_id), cache="channel_page", headers=headers, stream=True, timeout=30)
+    except Exception as e:
+        return f"[Error] {e}", "error", None, None
+    try:
+        etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+        if response.status_code == 304:
+            return cached[0], "ok", etag or cached[2], last_modified or cached[3]
+        if response.status_code != 200:
+            return "[Error] Channel not found", "not_found", None, None
+        head = b""
+        for chunk in response.iter_content(chunk_size=16384):
+            head += chunk
+            start = head.find(_OG_TITLE)
+            if start != -1:
+                end = head.find(b'"', start + len(_OG_TITLE))
+                if end != -1:
+                    name = html.unescape(head[start + len(_OG_TITLE):end].decode("utf-8", errors="replace"))
+                    return name, "ok", etag, last_modified
+            if len(head) > MAX_PAGE_BYTES:
+                break
+        return "[Error] Channel name not found", "error", None, None
+    except Exception as e:
+        return f"[Error] {e}", "error", None, None
+    finally:
+        # Drops the rest of the page instead of downloading it
+        response.close()
+
+
+def process_channel(channel_id):
+    name, _, _, _ = fetch_channel_name(channel_id)
+    return f"{channel_id} - {name}\n"
+
+
+def resolve_channel_names(source_path: str = "channels.txt", dest_path: str = "appended_channels.txt", max_workers: int = 8,
+                          max_age_days: float = 30.0, retry_errors: bool = True, cache_path: str = None) -> dict:
+    """
+    Write "<channel ID> - <channel name>" for every channel in a list. Names come from a local cache;
+    only new channels, entries older than max_age_days and (optionally) failed lookups are fetched,
+    with at most max_workers requests in flight. Results are committed to the cache as they arrive,
+    so an interrupted run picks up where it stopped
+    :param source_path: The channel ID list
+    :param dest_path: The appended list to write
+    :param max_workers: The number of concurrent fetches
+    :param max_age_days: How long a resolved name is trusted before it is revalidated
+    :param retry_errors: Fetch channels whose last lookup failed again
+    :param cache_path: The channel name cache. Defaults to channel_cache_path()
+    :return: Counts of cached and fetched channels
+    """
+    cache = ChannelNameCache(cache_path)
+    max_age = max_age_days * 86400
+    counts = {"cached": 0, "fetched": 0, "revalidated": 0, "errors": 0}
+
+    def stale_channels(seen: OnDiskSet):
+        now = time.time()
+        for line in iter_lines(source_path):
+            channel_id = _channel_id(line)
+            if not seen.add(channel_id):
+                continue
+            cached = cache.get(channel_id)
+            if cached is not None and now - cached[4] < max_age and (cached[1] == "ok" or not retry_errors):
+                counts["cached"] += 1
+                continue
+            yield channel_id, cached
+
+    def fetch(item):
+        channel_id, cached = item
+        return channel_id, cached, fetch_channel_name(channel_id, cached)
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor, \
+                tqdm(desc="Resolving channels", unit="ch") as progress, OnDiskSet(os.path.dirname(os.path.abspath(dest_path))) as seen:
+            pending = set()
+            for item in stale_channels(seen):
+                pending.add(executor.submit(fetch, item))
+                # A bounded window of requests, so the list is never fully materialized
+                if len(pending) >= max_workers * 4:
+                    done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    _store_results(done, cache, counts, progress)
+            while pending:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                _store_results(done, cache, counts, progress)
+        cache.commit()
+        with rewrite(dest_path) as out:
+            for line in iter_lines(source_path):
+                channel_id = _channel_id(line)
+                cached = cache.get(channel_id)
+                out.write(f"{channel_id} - {cached[0] if cached else '[Error] Channel not resolved'}\n")
+    finally:
+        cache.close()
+    print(f"Resolved channel names: {counts}")
+    return counts
+
+
+def _store_results(done, cache: ChannelNameCache, counts: dict, progress):
+    for future in done:
+        channel_id, cached, (name, status, etag, last_modified) = future.result()
+        cache.put(channel_id, name, status, etag, last_modified)
+        if status != "ok":
+            counts["errors"] += 1
+        elif cached is not None and cached[1] == "ok" and name == cached[0]:
+            counts["revalidated"] += 1
+        else:
+            counts["fetched"] += 1
+        progress.update(1)
+    cache.commit()
+
+
+def process_helper(max_workers: int = 8):
+    resolve_channel_names("channels.txt", "appended_channels.txt", max_workers=max_workers)
+
+
+def update_channel_list(remote_url: str = REMOTE_CHANNELS_URL, appended_path: str = "appended_channels.txt",
+                        dest_path: str = "channels.txt", shuffle: bool = True) -> bool:
+    """
+    Pull the shared list, clean it into dest_path and shuffle it
+    """
+    if not pull_channel_file(remote_url, appended_path):
+        return False
+    clean_channel_list(appended_path, dest_path)
+    if shuffle:
+        shuffle_file(dest_path)
+    return True
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Maintain the channel list")
+    parser.add_argument("--http-cache", choices=HTTP_CACHE_MODES, help="Cache the downloaded list and channel pages on disk (HTTP_CACHE)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    update = commands.add_parser("update", help="Pull the shared list, clean it and shuffle it")
+    update.add_argument("--url", default=REMOTE_CHANNELS_URL, help="The URL of the shared list")
+    update.add_argument("--appended", default="appended_channels.txt", help="Where the downloaded list is kept")
+    update.add_argument("--output", default="channels.txt", help="The channel ID list to write")
+    update.add_argument("--no-shuffle", action="store_true", help="Keep the list order")
+
+    pull = commands.add_parser("pull", help="Download the shared list if it changed")
+    pull.add_argument("--url", default=REMOTE_CHANNELS_URL, help="The URL of the shared list")
+    pull.add_argument("--output", default="appended_channels.txt", help="Where to save it")
+
+    clean = commands.add_parser("clean", help="Drop Topic and unresolved channels, strip names and deduplicate")
+    clean.add_argument("--input", default="appended_channels.txt", help="The appended list")
+    clean.add_argument("--output", default="channels.txt", help="The channel ID list to write")
+
+    dedup = commands.add_parser("dedup", help="Deduplicate a list in place")
+    dedup.add_argument("file", nargs="?", default="channels.txt", help="The list")
+
+    shuffle = commands.add_parser("shuffle", help="Shuffle a list in place")
+    shuffle.add_argument("file", nargs="?", default="channels.txt", help="The list")
+
+    names = commands.add_parser("names", help="Resolve channel names, fetching only new and stale channels")
+    names.add_argument("--input", default="channels.txt", help="The channel ID list")
+    names.add_argument("--output", default="appended_channels.txt", help="The appended list to write")
+    names.add_argument("--workers", type=int, default=8, help="Concurrent requests")
+    names.add_argument("--max-age-days", type=float, default=30.0, help="Revalidate names older than this")
+    names.add_argument("--no-retry-errors", action="store_true", help="Don't fetch channels whose last lookup failed")
+    names.add_argument("--cache", help=f"The channel name cache (CHANNEL_CACHE_PATH, default {DEFAULT_CHANNEL_CACHE_PATH})")
+    return parser
+
+
+def main(argv: list[str] = None):
+    # Before anything reads the env: YOUTUBE_BASE_URL, CHANNEL_CACHE_PATH, RATE_LIMITS, HTTP_CACHE
+    dotenv.load_dotenv()
+    args = build_arg_parser().parse_args(argv)
+    if args.http_cache:
+        os.environ["HTTP_CACHE"] = args.http_cache
+    if args.command == "update":
+        update_channel_list(args.url, args.appended, args.output, shuffle=not args.no_shuffle)
+    elif args.command == "pull":
+        pull_channel_file(args.url, args.output)
+    elif args.command == "clean":
+        clean_channel_list(args.input, args.output)
+    elif args.command == "dedup":
+        deduplicate_channel_ids(args.file)
+    elif args.command == "shuffle":
+        shuffle_file(args.file)
+    elif args.command == "names":
+        resolve_channel_names(args.input, args.output, args.workers, args.max_age_days, not args.no_retry_errors,
+                              args.cache or channel_cache_path())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import glob
+import json
+import os
+import threading
+import time
+
+
+class CheckpointJournal:
+    def __init__(self, path: str, mode: str = None):
+        """
+        An append-only JSONL journal of crawl progress: completed pages and channels, each
+        video's verdict and what was enqueued. Opening an existing journal replays it, so a
+        crashed or interrupted run can continue where it stopped
+        :param path: The path of the journal
+        :param mode: The crawl mode, recorded when the journal is created
+        """
+        self.path = path
+        self.completed_pages = set()
+        self.completed_channels = set()
+        self.verdicts = {}
+        self.enqueued = set()
+        self.mode = mode
+        # Every event is a single appended line, so processes can share the file
+        self._lock = threading.Lock()
+        resumed = os.path.exists(path)
+        if resumed:
+            self._replay()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        if not resumed:
+            self._write({"type": "run", "mode": mode, "started_at": time.time()}, sync=True)
+
+    def _replay(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # A torn last line from a crash
+                    continue
+                kind = event.get("type")
+                if kind == "run":
+                    self.mode = event.get("mode")
+                elif kind == "page_done":
+                    self.completed_pages.add(event["page"])
+                elif kind == "channel_done":
+                    self.completed_channels.add(event["channel_id"])
+                elif kind == "verdict":
+                    self.verdicts[event["video_id"]] = (event["valid"], event["reason"])
+                elif kind == "enqueued":
+                    self.enqueued.update(event["video_ids"])
+
+    def _write(self, event: dict, sync: bool = False):
+        with self._lock:
+            self._file.write(json.dumps(event, ensure_ascii=False) + "\n")
+            self._file.flush()
+            if sync:
+                os.fsync(self._file.fileno())
+
+    def record_verdicts(self, verdicts: dict[str, tuple[bool, str]], write: bool = True):
+        """
+        Record the validation verdicts of videos
+        :param verdicts: A dict of video ID to (valid, reason)
+        :param write: Append them to the journal file. False when another process (e.g. a channel
+                      worker with the same journal open) already did
+        """
+        for video_id, (valid, reason) in verdicts.items():
+            self.verdicts[video_id] = (valid, reason)
+            if write:
+                self._write({"type": "verdict", "video_id": video_id, "valid": valid, "reason": reason})
+
+    def record_enqueued(self, video_ids: list[str]):
+        """
+        Record videos that were handed to the archive queue
+        :param video_ids: The video IDs
+        """
+        if not video_ids:
+            return
+        self.enqueued.update(video_ids)
+        self._write({"type": "enqueued", "video_ids": list(video_ids)}, sync=True)
+
+    def record_page_done(self, page: int):
+        """
+        Record that a search page was fully validated and enqueued
+        :param page: The page number
+        """
+        self.completed_pages.add(page)
+        self._write({"type": "page_done", "page": page}, sync=True)
+
+    def record_channel_done(self, channel_id: str):
+        """
+        Record that a channel was fully validated and enqueued
+        :param channel_id: The channel ID
+        """
+        self.completed_channels.add(channel_id)
+        self._write({"type": "channel_done", "channel_id": channel_id}, sync=True)
+
+    def pending_enqueues(self) -> list[str]:
+        """
+        Videos that were validated as valid but never enqueued (e.g. the run stopped in between)
+        """
+        return [video_id for video_id, (valid, _) in self.verdicts.items() if valid and video_id not in self.enqueued]
+
+    def results(self) -> tuple[list[str], list[tuple[str, str]]]:
+        """
+        Every verdict in the journal
+        :return: The valid video IDs and the (video ID, reason) pairs of the invalid ones
+        """
+        succeeded = [video_id for video_id, (valid, _) in self.verdicts.items() if valid]
+        failed = [(video_id, reason) for video_id, (valid, reason) in self.verdicts.items() if not valid]
+        return succeeded, failed
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def new_checkpoint_path(mode: str, directory: str = "checkpoints") -> str:
+    """
+    A fresh journal path for a run
+    :param mode: The crawl mode, part of the file name
+    :param directory: The directory journals are kept in
+    """
+    return os.path.join(directory, f"{mode}_{time.strftime('%Y-%m-%d %H-%M-%S')}.jsonl")
+
+
+def latest_checkpoint_path(mode: str, directory: str = "checkpoints") -> str:
+    """
+    The most recent journal of a crawl mode
+    :param mode: The crawl mode
+    :param directory: The directory journals are kept in
+    :return: The path, or None if there is no journal
+    """
+    paths = glob.glob(os.path.join(directory, f"{mode}_*.jsonl"))
+    if not paths:
+        return None
+    return max(paths, key=os.path.getmtime)
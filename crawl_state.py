@@ -0,0 +1,194 @@
+import os
+import sqlite3
+import threading
+import time
+
+# How many of a channel's newest video IDs are remembered. More than one, so that a deleted
+# or privated newest video doesn't make the next run rescan the whole channel
+HIGH_WATER_IDS = 5
+
+# Weight of the latest crawl in the smoothed upload and yield rates
+RATE_SMOOTHING = 0.3
+# Shortest gap between crawls used when turning a crawl's new videos into a rate, so two crawls
+# seconds apart don't produce huge rates
+MIN_RATE_WINDOW = 3600.0
+
+
+class ChannelProgress:
+    def __init__(self, channel_id: str):
+        """
+        What one crawl of a channel found. It is committed to the CrawlState by the caller once the
+        channel's valid videos are enqueued, so a crawl that fails or is interrupted before that is
+        simply repeated
+        :param channel_id: The channel ID
+        """
+        self.channel_id = channel_id
+        # The high-water IDs the crawl started from, and when they were processed
+        self.seen_ids = []
+        self.since = None
+        # Whether the listing reached one of seen_ids. Only then are new_ids exactly the uploads since then
+        self.stopped_at_seen = False
+        # Every new video listed, newest first, and the ones that have to be looked at again
+        self.new_ids = []
+        self.retry_ids = set()
+        self.valid = 0
+        self.duration = 0.0
+
+    def high_water(self) -> list[str]:
+        """
+        The IDs the next crawl stops at: the newest processed videos older than every video to retry
+        """
+        start = 0
+        for index, video_id in enumerate(self.new_ids):
+            if video_id in self.retry_ids:
+                start = index + 1
+        return (self.new_ids[start:] + list(self.seen_ids))[:HIGH_WATER_IDS]
+
+
+class CrawlState:
+    def __init__(self, path: str = "cache/crawl_state.db"):
+        """
+        Local store of per-channel crawl progress. For every channel it keeps the newest video IDs
+        that were already processed and when that happened
+        :param path: The path of the SQLite file
+        """
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS channel_high_water (
+            channel_id TEXT PRIMARY KEY,
+            video_ids TEXT NOT NULL,
+            processed_at REAL NOT NULL)""")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS channel_activity (
+            channel_id TEXT PRIMARY KEY,
+            upload_rate REAL,
+            yield_rate REAL,
+            last_crawled REAL NOT NULL,
+            last_yield REAL,
+            avg_duration REAL NOT NULL,
+            crawls INTEGER NOT NULL)""")
+        self.connection.commit()
+
+    def get_high_water(self, channel_id: str) -> tuple[list[str], float]:
+        """
+        Get the newest video IDs already processed for a channel
+        :param channel_id: The channel ID
+        :return: The video IDs (newest first) and the time they were processed, or ([], None)
+        """
+        with self._lock:
+            row = self.connection.execute("SELECT video_ids, processed_at FROM channel_high_water WHERE channel_id = ?",
+                                          (channel_id,)).fetchone()
+        if row is None:
+            return [], None
+        return row[0].split(","), row[1]
+
+    def set_high_water(self, channel_id: str, video_ids: list[str]):
+        """
+        Record the newest video IDs of a channel after it was processed
+        :param channel_id: The channel ID
+        :param video_ids: The channel's newest video IDs, newest first
+        """
+        video_ids = [vid for vid in video_ids if vid][:HIGH_WATER_IDS]
+        if not video_ids:
+            return
+        with self._lock:
+            self.connection.execute("INSERT OR REPLACE INTO channel_high_water (channel_id, video_ids, processed_at) VALUES (?, ?, ?)",
+                                    (channel_id, ",".join(video_ids), time.time()))
+            self.connection.commit()
+
+    def record_crawl(self, channel_id: str, new_videos: int, new_valid: int, duration: float, since: float = None):
+        """
+        Update a channel's activity after a crawl. The upload and yield rates (videos per day) are
+        smoothed over crawls, and only updated when the crawl stopped at the previous high-water mark,
+        because only then are the new videos exactly the ones uploaded since the last crawl
+        :param channel_id: The channel ID
+        :param new_videos: The videos listed by the crawl
+        :param new_valid: How many of them were valid
+        :param duration: How long the crawl took in seconds
+        :param since: When the channel was last processed, if the crawl was incremental. None otherwise
+        """
+        now = time.time()
+        with self._lock:
+            row = self.connection.execute("SELECT upload_rate, yield_rate, last_crawled, last_yield, avg_duration, crawls "
+                                          "FROM channel_activity WHERE channel_id = ?", (channel_id,)).fetchone()
+            upload_rate, yield_rate, last_crawled, last_yield, avg_duration, crawls = row or (None, None, None, None, duration, 0)
+            if since is not None:
+                days = max(now - since, MIN_RATE_WINDOW) / 86400
+                upload_rate = _smooth(upload_rate, new_videos / days)
+                yield_rate = _smooth(yield_rate, new_valid / days)
+            if new_valid:
+                last_yield = now
+            avg_duration = _smooth(avg_duration, duration)
+            self.connection.execute("INSERT OR REPLACE INTO channel_activity "
+                                    "(channel_id, upload_rate, yield_rate, last_crawled, last_yield, avg_duration, crawls) "
+                                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                    (channel_id, upload_rate, yield_rate, now, last_yield, avg_duration, crawls + 1))
+            self.connection.commit()
+
+    def commit(self, progress: ChannelProgress):
+        """
+        Store a finished crawl: move the channel's high-water mark and update its activity. The upload
+        and yield rates are only measured when the listing stopped at the previous high-water mark
+        :param progress: The crawl's progress, with the videos that still need a retry in retry_ids
+        """
+        self.set_high_water(progress.channel_id, progress.high_water())
+        self.record_crawl(progress.channel_id, len(progress.new_ids), progress.valid, progress.duration,
+                          since=progress.since if progress.stopped_at_seen else None)
+
+    def get_activity(self) -> dict[str, tuple]:
+        """
+        The activity of every crawled channel
+        :return: A dict of channel ID to (upload rate, yield rate, last crawled, last yield, average duration, crawls).
+                 Rates are None until an incremental crawl has measured them
+        """
+        with self._lock:
+            rows = self.connection.execute("SELECT channel_id, upload_rate, yield_rate, last_crawled, last_yield, avg_duration, crawls "
+                                           "FROM channel_activity").fetchall()
+        return {row[0]: row[1:] for row in rows}
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+
+def _smooth(previous: float, observed: float) -> float:
+    if previous is None:
+        return observed
+    return previous + RATE_SMOOTHING * (observed - previous)
+
+
+def iter_until_seen(listing, progress: ChannelProgress):
+    """
+    Yield listing items until one of the already processed videos comes up. Because channel
+    listings are newest first, nothing after that point is new and the rest of the listing is
+    never requested. The listing must not be filtered by archived IDs, or the high-water videos
+    never come up
+    :param listing: An iterable of (video ID, title, duration) tuples, newest first
+    :param progress: The crawl's progress. Its seen_ids are the stop marks, and it receives the new video IDs
+                     and whether a stop mark came up (stopped_at_seen)
+    :return: A generator of the new (video ID, title, duration) tuples
+    """
+    seen_ids = set(progress.seen_ids)
+    for video_id, title, duration in listing:
+        if video_id in seen_ids:
+            progress.stopped_at_seen = True
+            return
+        progress.new_ids.append(video_id)
+        yield video_id, title, duration
+
+
+_shared_state = None
+_shared_state_lock = threading.Lock()
+
+
+def get_shared_state(path: str = None) -> CrawlState:
+    """
+    Get the process wide crawl state store, opening it on first use
+    :param path: The store path. Defaults to the CRAWL_STATE_PATH env variable or cache/crawl_state.db
+    """
+    global _shared_state
+    with _shared_state_lock:
+        if _shared_state is None:
+            _shared_state = CrawlState(path or os.getenv("CRAWL_STATE_PATH") or "cache/crawl_state.db")
+        return _shared_state
@@ -1,16 +1,47 @@
 from dotenv import load_dotenv
-from site_scraper import SiteScraper
-from sql_handler import SQLHandler
+from site_scraper import PageLoadError, ScraperPool
+from sql_handler import get_shared_handler
+from db_backends import DatabaseConnectionError
+from pipeline import Pipeline, Stage
+from id_index import ArchivedIdIndex, get_shared_index
+from crawl_state import ChannelProgress, get_shared_state
+from scheduler import CrawlScheduler
+from daemon import CrawlDaemon
+from http_cache import MODES as HTTP_CACHE_MODES
+from enqueue_client import get_shared_client
+from metrics import get_shared_metrics
+from checkpoint import CheckpointJournal, new_checkpoint_path, latest_checkpoint_path
+from typing import Callable
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 import source_parse
 import holodex
 import youtube
 import os
 import time
-import requests
+import rate_limit
 import argparse
+import itertools
+import signal
+import atexit
+import multiprocessing.util
+import threading
+import zlib
 
 # Constant value for a search page to find covers and songs
-HOLODEX_SEARCH_PAGE = "https://holodex.net/search?q=type,value,text%0Atopic,Music_Cover,Music_Cover%0Atopic,Original_Song,Original_Song&page="
+HOLODEX_SEARCH_PAGE = os.getenv("HOLODEX_SEARCH_PAGE") or "https://holodex.net/search?q=type,value,text%0Atopic,Music_Cover,Music_Cover%0Atopic,Original_Song,Original_Song&page="
+# Matches the video links once the search results have rendered
+HOLODEX_RESULT_SELECTOR = 'a[href^="/watch/"]'
+
+# The crawl modes a daemon job can ask for
+JOB_MODES = ("holodex", "channels", "channel", "playlist")
+# Options that belong to the daemon process and its warm resources, so a job can't override them
+DAEMON_OPTIONS = {"daemon", "control_host", "control_port", "job_dir", "job_poll_interval", "fetch_workers", "id_index",
+                  "report_dir", "metrics_textfile", "metrics_interval", "youtube", "http_cache"}
+
+# Serializes appends to stub.txt from concurrent enqueue workers
+_stub_lock = threading.Lock()
 
 def log_message(message: str):
     """
@@ -39,146 +70,805 @@ def generate_report(succeeded: list[str], failed: list[tuple[str, str]]) -> str:
             f.write(f"{vid}: {reason}\n")
     return f"logs/report_{current_time_str}.txt"
 
-def get_content_holodex(api_key: str, start_page: int = 1, end_page: int = 1, min_time: int = 65, max_time: int = 480, wait_time: int =5) -> tuple[list[str], list[tuple[str, str]]]:
-    chrome_driver_path = os.getenv("CHROME_DRIVER_PATH")
-    if chrome_driver_path is None:
-        chrome_driver_path = "/usr/bin/chromedriver"
-    scraper = SiteScraper(chrome_driver_path=chrome_driver_path, wait_time=wait_time)
+def get_content_holodex(api_key: str, start_page: int = 1, end_page: int = 1, min_time: int = 65, max_time: int = 480, wait_time: int =5,
+                        enqueue: Callable[[list[str]], list[str]] = None, known_ids=None, pool: ScraperPool = None, fetch_workers: int = 1, extract_workers: int = 1,
+                        validate_workers: int = 2, validate_requests: int = 8, enqueue_workers: int = 2,
+                        queue_size: int = 8, journal: CheckpointJournal = None, backend: str = "browser",
+                        page_size: int = holodex.SEARCH_PAGE_SIZE) -> tuple[list[str], list[tuple[str, str]]]:
+    """
+    Crawl Holodex search pages through a staged pipeline: page fetch -> ID extraction -> validation -> enqueue.
+    Stages overlap, so valid videos are enqueued while later pages are still loading.
+    The browser backend renders the search page and validates the IDs on it with the video API. The
+    api backend reads the same search as JSON, and the status and duration in its records decide
+    validity inline, so a page takes a single request
+    :param api_key: The Holodex API key
+    :param start_page: The first search page to crawl
+    :param end_page: The last search page to crawl
+    :param min_time: The minimum length of a video in seconds
+    :param max_time: The maximum length of a video in seconds
+    :param wait_time: The time to wait for the search page JS to load
+    :param enqueue: Called with the list of valid video IDs of each page, returns the IDs that were enqueued. Nothing is enqueued if None
+    :param known_ids: Optional container of already archived video IDs, which are skipped before validation
+    :param pool: A shared pool of browsers. One with fetch_workers browsers is started (and closed) when None
+    :param fetch_workers: The number of search pages fetched concurrently
+    :param extract_workers: The number of threads extracting video IDs from page sources
+    :param validate_workers: The number of pages validated concurrently
+    :param validate_requests: The maximum number of concurrent Holodex requests per page being validated
+    :param enqueue_workers: The number of threads enqueueing valid videos
+    :param queue_size: The maximum number of items waiting between two stages
+    :param journal: Optional checkpoint journal. Pages it lists as done are skipped and videos it has a verdict for are not validated again
+    :param backend: "browser" or "api"
+    :param page_size: The number of videos per page with the api backend
+    :returns: The valid video IDs and the (video ID, reason) pairs of the invalid ones
+    """
+    own_pool = pool is None and backend == "browser"
+    if own_pool:
+        pool = ScraperPool(size=fetch_workers, wait_time=wait_time)
+    session = rate_limit.create_session(validate_workers * validate_requests)
+    metrics = get_shared_metrics()
     succeeded = []
     failed = []
-    for page in range(start_page, end_page + 1):
+    seen = set()
+    seen_lock = threading.Lock()
+
+    def fetch_page(page: int):
         log_message(f"Getting content via Holodex page {page} of {end_page}")
-        data = scraper.get_page_source(f"{HOLODEX_SEARCH_PAGE}{page}")
-        video_ids = source_parse.find_all_yt_video_ids_hldex(data)
-        log_message(f"Found {len(video_ids)} videos. Checking validity...")
-        for vid in video_ids:
-            try:
-                valid, reason = holodex.check_if_video_valid(api_key, vid, min_time, max_time)
-            except:
-                log_message(f"An error occurred while trying to check the video {vid}")
-                valid = False
-                reason = "An error occurred while trying to check the video"
+        with pool.acquire() as scraper, metrics.timer("page_fetch"):
+            source, ready = scraper.load_page(f"{HOLODEX_SEARCH_PAGE}{page}", ready_selector=HOLODEX_RESULT_SELECTOR)
+        # An empty or half-rendered page would be journaled as done with its videos missing. Failing
+        # the page leaves it out of the journal, so a resumed run fetches it again
+        if not source or not ready:
+            raise PageLoadError(f"Holodex page {page} didn't render")
+        metrics.incr("pages_fetched")
+        return [(page, source)]
+
+    def fetch_page_api(page: int):
+        log_message(f"Getting content via the Holodex search API, page {page} of {end_page}")
+        with metrics.timer("page_fetch"):
+            records, total = holodex.search_videos(api_key, (page - 1) * page_size, page_size, session=session)
+        metrics.incr("pages_fetched")
+        if not records and (page - 1) * page_size >= total:
+            log_message(f"Page {page} is past the {total} search results")
+        return [(page, records)]
+
+    def extract_ids(item: tuple[int, str]):
+        page, data = item
+        with metrics.timer("parse"):
+            video_ids = source_parse.find_all_yt_video_ids_hldex(data, known_ids)
+        metrics.incr("videos_found", len(video_ids))
+        log_message(f"Found {len(video_ids)} videos on page {page}. Checking validity...")
+        return [(page, video_ids, {})]
+
+    def extract_records(item: tuple[int, list[dict]]):
+        page, records = item
+        with metrics.timer("parse"):
+            with seen_lock:
+                # Offsets shift when videos are published mid-crawl, so a video can come up on two pages
+                records = [record for record in records if record["id"] not in seen and not seen.add(record["id"])]
+            if known_ids is not None:
+                records = [record for record in records if record["id"] not in known_ids]
+            inline = {record["id"]: holodex.evaluate_video(record, min_time, max_time) for record in records
+                      if "status" in record and "duration" in record}
+        metrics.incr("videos_found", len(records))
+        log_message(f"Found {len(records)} videos on page {page}, {len(inline)} judged from the search results")
+        return [(page, [record["id"] for record in records], inline)]
+
+    def validate(item: tuple[int, list[str], dict]):
+        page, video_ids, inline = item
+        verdicts = {}
+        if journal is not None:
+            verdicts = {vid: journal.verdicts[vid] for vid in video_ids if vid in journal.verdicts}
+        # Verdicts from the search results are free, only the remaining IDs cost API requests
+        new_verdicts = {vid: inline[vid] for vid in video_ids if vid in inline and vid not in verdicts}
+        missing = [vid for vid in video_ids if vid not in verdicts and vid not in new_verdicts]
+        if missing:
+            with metrics.timer("validation"):
+                new_verdicts.update(holodex.check_videos_valid(api_key, missing, min_time, max_time,
+                                                               max_workers=validate_requests, session=session))
+        # API failures are transient: they aren't journaled, and neither is the page as done, so a
+        # resumed run checks those videos again
+        complete = all(reason != holodex.ERROR_REASON for _, reason in new_verdicts.values())
+        if journal is not None:
+            journal.record_verdicts({vid: verdict for vid, verdict in new_verdicts.items() if verdict[1] != holodex.ERROR_REASON})
+        verdicts.update(new_verdicts)
+        valid_ids = []
+        for vid, (valid, reason) in verdicts.items():
+            metrics.record_verdict(vid, valid, reason, source=f"page {page}")
             if valid:
                 log_message(f"Video {vid} is valid")
                 succeeded.append(vid)
+                valid_ids.append(vid)
             else:
                 log_message(f"Video {vid} is not valid: {reason}")
                 failed.append((vid, reason))
-    scraper.close()
+        if journal is not None:
+            valid_ids = [vid for vid in valid_ids if vid not in journal.enqueued]
+        if enqueue is None:
+            if journal is not None and complete:
+                journal.record_page_done(page)
+            return None
+        return [(page, valid_ids, complete)]
+
+    def enqueue_page(item: tuple[int, list[str], bool]):
+        page, video_ids, complete = item
+        enqueued = enqueue(video_ids) if video_ids else []
+        if journal is not None:
+            journal.record_enqueued(enqueued)
+            if complete:
+                journal.record_page_done(page)
+
+    def on_error(stage: str, item, err: Exception):
+        log_message(f"Stage {stage} failed: {err}")
+        metrics.incr(f"{stage}_errors")
+        if stage == "validate":
+            for vid in item[1]:
+                failed.append((vid, holodex.ERROR_REASON))
+                metrics.record_verdict(vid, False, holodex.ERROR_REASON, source=f"page {item[0]}")
+
+    crawl = Pipeline([
+        Stage("fetch", fetch_page_api if backend == "api" else fetch_page, fetch_workers),
+        Stage("extract", extract_records if backend == "api" else extract_ids, extract_workers),
+        Stage("validate", validate, validate_workers),
+        Stage("enqueue", enqueue_page, enqueue_workers),
+    ], queue_size=queue_size, on_error=on_error)
+    try:
+        pages = range(start_page, end_page + 1)
+        if journal is not None:
+            pages = [page for page in pages if page not in journal.completed_pages]
+            if len(pages) < end_page - start_page + 1:
+                log_message(f"Resuming: {end_page - start_page + 1 - len(pages)} pages already done")
+        crawl.run(pages)
+    finally:
+        session.close()
+        if own_pool:
+            pool.close()
     return succeeded, failed
 
 def enqueue_content_to_api(videoId: str, prepend_url="https://youtube.com/watch?v=") -> int:
-    log_message("Enqueuing content to the API...")
-    queue_api = os.getenv("PATCHWORK_API")
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)',
-        'X-AUTHENTICATION': os.getenv("WORKER_AUTH")
-    }
-    data = {
-        'url': prepend_url+videoId,
-        'mode': 0
-    }
-    response = requests.post(queue_api, headers=headers, data=data)
-    if response.status_code == 200:
-        log_message(f"Successfully enqueued video {videoId}")
-    return response.status_code
+    return enqueue_batch_to_api([videoId], prepend_url)[videoId]
+
+def enqueue_batch_to_api(video_ids: list[str], prepend_url="https://youtube.com/watch?v=") -> dict[str, int]:
+    """
+    Enqueue videos to the Patchwork queue API through the shared queue client. Failed posts are
+    kept in the client's retry spool
+    :param video_ids: The video IDs to enqueue
+    :param prepend_url: The URL prefix sent to the queue
+    :returns: A dict of video ID to HTTP status code (0 if the request failed)
+    """
+    with get_shared_metrics().timer("enqueue"):
+        statuses = get_shared_client().submit(video_ids, prepend_url=prepend_url)
+    get_shared_metrics().record_enqueue("api", statuses)
+    for vid, status in statuses.items():
+        if status == 200:
+            log_message(f"Successfully enqueued video {vid}")
+        else:
+            log_message(f"Failed to enqueue video {vid} (status {status}), spooled for retry")
+    return statuses
 
 def enqueue_content_to_db(videoId: str, prepend_url="https://youtube.com/watch?v=") -> bool:
-    server = SQLHandler()
-    if server.check_row_exists("songs", "video_id", videoId):
-        log_message(f"Video {videoId} already exists in the DB")
-        return False
-    log_message("Enqueuing content to the DB...")
-    server.insert_row("archive_queue", "url, mode", (prepend_url+videoId, 0))
-    return True
+    return enqueue_batch_to_db([videoId], prepend_url)[videoId] == "enqueued"
+
+def enqueue_batch_to_db(video_ids: list[str], prepend_url="https://youtube.com/watch?v=") -> dict[str, str]:
+    """
+    Enqueue videos to the DB archive queue through the shared connection pool
+    :param video_ids: The video IDs to enqueue
+    :param prepend_url: The URL prefix stored in the queue
+    :returns: A dict of video ID to its outcome ("archived", "queued", "enqueued" or "error")
+    """
+    with get_shared_metrics().timer("enqueue"):
+        outcomes = get_shared_handler().bulk_enqueue(video_ids, prepend_url)
+    get_shared_metrics().record_enqueue("db", outcomes)
+    for vid, outcome in outcomes.items():
+        if outcome == "archived":
+            log_message(f"Video {vid} already exists in the DB")
+        elif outcome == "queued":
+            log_message(f"Video {vid} is already in the archive queue")
+        elif outcome == "enqueued":
+            log_message(f"Enqueued video {vid} to the DB")
+        else:
+            log_message(f"Failed to enqueue video {vid} to the DB")
+    return outcomes
+
+def load_id_index() -> ArchivedIdIndex:
+    """
+    Open the local archived-ID index and bring it up to date with the DB if one is configured.
+    The index is saved again when the process exits
+    """
+    index = get_shared_index()
+    if os.getenv("DB_HOST"):
+        index.sync(get_shared_handler())
+    atexit.register(index.save)
+    return index
+
+def enqueue_videos(video_ids: list[str], args) -> list[str]:
+    """
+    Enqueue videos to the destination selected on the command line (DB, stub file or API)
+    :param video_ids: The video IDs to enqueue
+    :param args: The parsed command line arguments
+    :returns: The video IDs that are now archived or queued
+    """
+    if args.db:
+        outcomes = enqueue_batch_to_db(video_ids)
+        known = [vid for vid, outcome in outcomes.items() if outcome != "error"]
+    elif args.stub:
+        with _stub_lock:
+            with open("stub.txt", "a") as f:
+                for vid_id in video_ids:
+                    f.write(f"{vid_id}\n")
+        known = list(video_ids)
+        get_shared_metrics().record_enqueue("stub", {vid_id: "written" for vid_id in known})
+    else:
+        statuses = enqueue_batch_to_api(video_ids)
+        known = [vid for vid, status in statuses.items() if status == 200]
+    if args.id_index:
+        get_shared_index().add(known)
+    return known
 
 
 def main(args):
     """
     main function logic
     """
+    configure_http_cache(args)
+    report_path = start_run_report(args)
+    known_ids = load_id_index() if args.id_index else None
+    # Browsers are shared by every page and channel of the run
+    pool = ScraperPool(size=args.fetch_workers, wait_time=args.wait_time)
+    use_api = not args.db and not args.stub
+    if use_api:
+        retried = get_shared_client().retry_spool()
+        if retried:
+            log_message(f"Retried {len(retried)} spooled enqueues, {sum(1 for status in retried.values() if status == 200)} succeeded")
+    try:
+        if args.daemon:
+            run_daemon(args, pool, known_ids)
+        else:
+            run_crawl(args, pool, known_ids)
+    finally:
+        close_channel_executor()
+        stats = pool.load_stats()
+        if stats["pages"]:
+            log_message(f"Loaded {stats['pages']} pages: mean {stats['mean']:.2f}s, p50 {stats['p50']:.2f}s, "
+                        f"p95 {stats['p95']:.2f}s, max {stats['max']:.2f}s, {stats['timeouts']} timed out")
+        lookups = youtube.duration_lookups
+        if lookups:
+            avoided = lookups["from_listing"] + lookups["watch_page"]
+            log_message(f"Video durations: {lookups['from_listing']} from listings, {lookups['watch_page']} from watch pages, "
+                        f"{lookups['full_extraction']} full yt_dlp extractions ({avoided} avoided)")
+        if use_api:
+            enqueue_stats = get_shared_client().stats()
+            if enqueue_stats["sent"]:
+                log_message(f"Enqueued {enqueue_stats['succeeded']}/{enqueue_stats['sent']} videos to the API in "
+                            f"{enqueue_stats['seconds']:.2f}s ({enqueue_stats['per_second']:.1f} videos/s), "
+                            f"{enqueue_stats['failed']} spooled for retry")
+            get_shared_client().close()
+        pool.close()
+        finish_run_report(args, report_path)
 
+def configure_http_cache(args):
+    """
+    Apply --http-cache. It goes through the environment so channel worker processes use it too
+    """
+    if args.http_cache:
+        os.environ["HTTP_CACHE"] = args.http_cache
+        log_message(f"HTTP cache: {args.http_cache} ({os.getenv('HTTP_CACHE_PATH') or 'cache/http_cache.db'})")
+
+def crawl_mode(args) -> str:
+    """
+    The crawl mode selected on the command line: "daemon", "playlist", "channel", "holodex" or "channels"
+    """
+    if getattr(args, "daemon", False):
+        return "daemon"
+    if args.playlist:
+        return "playlist"
+    if args.channel:
+        return "channel"
+    return "channels" if args.youtube else "holodex"
+
+def start_run_report(args) -> str:
+    """
+    Start streaming the run's verdicts and enqueues to a JSONL report. With --metrics-textfile the
+    Prometheus metrics are also rewritten every --metrics-interval seconds while the run goes on
+    :param args: The parsed command line arguments
+    :returns: The path of the report
+    """
+    mode = crawl_mode(args)
+    metrics = get_shared_metrics()
+    report_path = os.path.join(args.report_dir, f"run_{mode}_{time.strftime('%Y-%m-%d %H-%M-%S')}.jsonl")
+    metrics.open_report(report_path, mode)
+    log_message(f"Streaming the run report to {report_path}")
+    if args.metrics_textfile:
+        def export_periodically():
+            while True:
+                time.sleep(args.metrics_interval)
+                metrics.write_prometheus(args.metrics_textfile)
+        threading.Thread(target=export_periodically, name="metrics-export", daemon=True).start()
+    return report_path
+
+def finish_run_report(args, report_path: str):
+    """
+    Close the run report, write its JSON summary (and the Prometheus textfile) and log where the time went
+    :param args: The parsed command line arguments
+    :param report_path: The path returned by start_run_report
+    """
+    metrics = get_shared_metrics()
+    summary = metrics.summary()
+    for stage, stats in summary["stages"].items():
+        log_message(f"Stage {stage}: {stats['calls']} calls, {stats['total']:.2f}s total, "
+                    f"p50 {stats['p50']:.3f}s, p95 {stats['p95']:.3f}s, max {stats['max']:.3f}s")
+    for reason, count in summary["rejections"].items():
+        log_message(f"Rejected {count} videos: {reason}")
+    summary_path = report_path[:-len(".jsonl")] + "_summary.json"
+    metrics.write_json(summary_path)
+    if args.metrics_textfile:
+        metrics.write_prometheus(args.metrics_textfile)
+    metrics.close()
+    log_message(f"Run summary written to {summary_path}")
+
+def run_crawl(args, pool: ScraperPool, known_ids=None):
+    """
+    Run the crawl mode selected on the command line
+    :param args: The parsed command line arguments
+    :param pool: The browsers to scrape pages with
+    :param known_ids: Optional container of already archived video IDs to skip
+    """
     if args.playlist:
-        videos = youtube.get_videos_in_playlist(args.playlist)
+        with get_shared_metrics().timer("playlist_listing"):
+            videos = youtube.get_videos_in_playlist(args.playlist, known_ids=known_ids, pool=pool, backend=args.listing_backend)
+        get_shared_metrics().incr("videos_listed", len(videos))
         print(f"Scraping playlist complete. Total of {len(videos)} videos were found")
-        for video_id, video_title in videos:
+        for video_id, video_title, _ in videos:
             print(f"Enqueueing {video_title} - {video_id}")
-            enqueue_content_to_db(video_id)
-        exit()
+        enqueue_batch_to_db([video_id for video_id, _, _ in videos])
+        return
 
     if args.channel:
-        succeeded, failed = youtube.get_content_youtube_channel(args.channel.strip(), args.min_time, args.max_time, args.wait_time)
+        state = None if args.no_incremental else get_shared_state()
+        progress = ChannelProgress(args.channel.strip())
+        with get_shared_metrics().timer("channel_crawl"):
+            result = youtube.get_content_youtube_channel(args.channel.strip(), args.min_time, args.max_time, args.wait_time, known_ids=known_ids, pool=pool,
+                                                         backend=args.listing_backend, state=state, full_rescan=args.full_rescan,
+                                                         progress=progress)
+        if result is None:
+            return
+        record_channel_verdicts(args.channel.strip(), *result)
+        succeeded, failed = result
         succeeded = list(set(succeeded))
         failed = list(set(failed))
         for vid_id, title in succeeded:
             print(f"Validated {vid_id} - {title} to API")
-            if args.db:
-                enqueue_content_to_db(vid_id)
-            elif args.stub:
-                with open("stub.txt", "a") as f:
-                    f.write(f"{vid_id}\n")
-            else:
-                enqueue_content_to_api(vid_id)
-        exit()
+        video_ids = [vid_id for vid_id, _ in succeeded]
+        enqueued = enqueue_videos(video_ids, args)
+        if state is not None:
+            progress.retry_ids.update(set(video_ids) - set(enqueued))
+            state.commit(progress)
+        return
 
     if not args.youtube:
         # Default Holodex mode
-        valid_video_ids, invalid_video_ids = get_content_holodex(os.getenv("HOLODEX_API_KEY"),
+        journal = open_journal(args, "holodex")
+        get_content_holodex(os.getenv("HOLODEX_API_KEY"),
                                                                 args.start_page,
                                                                 args.end_page,
                                                                 args.min_time,
                                                                 args.max_time,
-                                                                args.wait_time
+                                                                args.wait_time,
+                                                                enqueue=lambda video_ids: enqueue_videos(video_ids, args),
+                                                                known_ids=known_ids,
+                                                                pool=pool,
+                                                                fetch_workers=args.fetch_workers,
+                                                                extract_workers=args.extract_workers,
+                                                                validate_workers=args.validate_workers,
+                                                                validate_requests=args.validate_requests,
+                                                                enqueue_workers=args.enqueue_workers,
+                                                                queue_size=args.queue_size,
+                                                                journal=journal,
+                                                                backend=args.holodex_backend,
+                                                                page_size=args.holodex_page_size
                                                                 )
-        for vid_id in valid_video_ids:
-            if args.db:
-                enqueue_content_to_db(vid_id)
-            elif args.stub:
-                with open("stub.txt", "a") as f:
-                    f.write(f"{vid_id}\n")
-            else:
-                enqueue_content_to_api(vid_id)
-        generate_report(valid_video_ids, invalid_video_ids)
+        generate_report(*journal.results())
+        journal.close()
         return
     # YouTube mode
     if args.channel_id_source == "DB":
         pass # TODO: Read from DB in the future
     else:
-        file = open(args.channel_id_source, "r")
-        if not os.path.exists("logs"):
-            os.makedirs("logs")
+        journal = open_journal(args, "channels")
+        channel_ids = (channel_id for channel_id in read_channel_ids(args.channel_id_source, args.shard)
+                       if channel_id not in journal.completed_channels)
+        if args.schedule:
+            if args.no_incremental:
+                log_message("--schedule needs the crawl state, ignored with --no-incremental")
+            else:
+                channel_ids = CrawlScheduler(get_shared_state()).plan(channel_ids, args.time_budget, args.max_channels, args.workers,
+                                                                        args.include_not_due)
+        elif args.max_channels is not None:
+            channel_ids = itertools.islice(channel_ids, args.max_channels)
+        if args.time_budget is not None:
+            channel_ids = until_deadline(channel_ids, time.monotonic() + args.time_budget)
+        succeeded, failed = crawl_channels(channel_ids, args, pool, known_ids, journal)
+        log_message(f"Crawled channels: {len(succeeded)} valid and {len(failed)} invalid videos")
+        generate_report(*journal.results())
+        journal.close()
+
+def build_job_args(args, spec: dict):
+    """
+    The arguments of one daemon job: the daemon's command line with the job's options applied
+    :param args: The parsed command line arguments of the daemon
+    :param spec: The job, e.g. {"mode": "channel", "channel": "UC...", "max_time": 600}. Options are named
+                 like the command line flags, and string values are converted like on the command line
+    :raises ValueError: If the mode or an option is unknown or invalid
+    """
+    spec = dict(spec)
+    mode = spec.pop("mode", "holodex")
+    if mode not in JOB_MODES:
+        raise ValueError(f"Unknown job mode {mode!r}, expected one of {', '.join(JOB_MODES)}")
+    actions = {action.dest: action for action in build_arg_parser()._actions}
+    job_args = argparse.Namespace(**vars(args))
+    job_args.daemon = False
+    job_args.youtube = mode != "holodex"
+    job_args.channel = None
+    job_args.playlist = None
+    # The daemon's --resume would make every job continue the latest journal. A job asks for it itself
+    job_args.resume = None
+    for key, value in spec.items():
+        name = key.replace("-", "_")
+        if name not in actions or name in DAEMON_OPTIONS or name == "help":
+            raise ValueError(f"Unknown or daemon-wide job option {key!r}")
+        action = actions[name]
+        if action.nargs == 0:
+            value = bool(value)
+        elif isinstance(value, str) and action.type is not None:
+            try:
+                value = action.type(value)
+            except (TypeError, ValueError, argparse.ArgumentTypeError) as e:
+                raise ValueError(f"Invalid value for {key!r}: {e}")
+        if action.choices is not None and value not in action.choices:
+            raise ValueError(f"Invalid value for {key!r}, expected one of {', '.join(map(str, action.choices))}")
+        setattr(job_args, name, value)
+    if mode in ("channel", "playlist") and not getattr(job_args, mode):
+        raise ValueError(f"A {mode} job needs the {mode} option")
+    return job_args
+
+def run_daemon(args, pool: ScraperPool, known_ids=None):
+    """
+    Serve crawl jobs until SIGTERM, Ctrl+C or POST /shutdown. The browser pool, ID index, DB pool and
+    HTTP sessions are set up once and reused by every job, and so are the channel worker processes
+    of channels jobs with --workers (see get_channel_executor)
+    :param args: The parsed command line arguments
+    :param pool: The browsers shared by every job
+    :param known_ids: Optional container of already archived video IDs to skip
+    """
+    def run_job(spec: dict):
+        job_args = build_job_args(args, spec)
+        if args.id_index and os.getenv("DB_HOST"):
+            known_ids.sync(get_shared_handler())
+        try:
+            run_crawl(job_args, pool, known_ids)
+        finally:
+            if args.id_index:
+                known_ids.save()
+
+    def resource_stats() -> dict:
+        stats = {"browsers": len(pool.scrapers), "page_loads": pool.load_stats(), "duration_lookups": dict(youtube.duration_lookups)}
+        if not args.db and not args.stub:
+            stats["enqueue_api"] = get_shared_client().stats()
+        return stats
+
+    daemon = CrawlDaemon(run_job, validate_job=lambda spec: build_job_args(args, spec), host=args.control_host,
+                         port=args.control_port, job_dir=args.job_dir, poll_interval=args.job_poll_interval,
+                         token=os.getenv("DAEMON_TOKEN") or None, resource_stats=resource_stats)
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    daemon.start()
+    log_message("Crawler daemon started")
+    while True:
+        try:
+            daemon.wait()
+            break
+        except KeyboardInterrupt:
+            daemon.stop()
+    log_message("Crawler daemon stopped")
+
+def open_journal(args, mode: str) -> CheckpointJournal:
+    """
+    Open the checkpoint journal of this run. With --resume the previous journal is continued
+    and videos it validated but never enqueued are enqueued first
+    :param args: The parsed command line arguments
+    :param mode: The crawl mode, "holodex" or "channels"
+    """
+    path = None
+    if args.resume:
+        path = latest_checkpoint_path(mode) if args.resume == "latest" else args.resume
+        if path is None or not os.path.exists(path):
+            log_message(f"No checkpoint to resume for {mode}. Starting a new run")
+            path = None
+    journal = CheckpointJournal(path or new_checkpoint_path(mode), mode)
+    log_message(f"Checkpointing to {journal.path}")
+    pending = journal.pending_enqueues()
+    if pending:
+        log_message(f"Enqueueing {len(pending)} videos validated before the interruption")
+        journal.record_enqueued(enqueue_videos(pending, args))
+    return journal
+
+def until_deadline(items, deadline: float):
+    """
+    Yield items until the monotonic clock passes the deadline
+    """
+    for item in items:
+        if time.monotonic() >= deadline:
+            log_message("Time budget used up, stopping before the remaining channels")
+            return
+        yield item
+
+def parse_shard(shard: str) -> tuple[int, int]:
+    """
+    Parse a shard spec such as "0/4" (the first of four shards)
+    :param shard: The shard spec
+    :returns: The shard index and the total number of shards
+    """
+    index, total = (int(part) for part in shard.split("/"))
+    if total < 1 or not 0 <= index < total:
+        raise argparse.ArgumentTypeError(f"Invalid shard {shard}. Expected i/N with 0 <= i < N")
+    return index, total
+
+def channel_shard(channel_id: str, total: int) -> int:
+    """
+    The shard a channel belongs to. Stable across machines and runs, so shards never overlap
+    :param channel_id: The channel ID
+    :param total: The total number of shards
+    """
+    return zlib.crc32(channel_id.encode()) % total
+
+def read_channel_ids(path: str, shard: tuple[int, int] = None):
+    """
+    Read channel IDs from a file, one per line
+    :param path: The path of the channel list
+    :param shard: Optional (index, total) to only read the channels of one shard
+    :returns: A generator of channel IDs, without duplicates
+    """
+    seen = set()
+    with open(path, "r") as file:
         for line in file:
             channel_id = line.strip()
-            succeeded, failed = youtube.get_content_youtube_channel(channel_id, args.min_time, args.max_time, args.wait_time)
-            succeeded = list(set(succeeded))
-            failed = list(set(failed))
-            for vid_id, title in succeeded:
-                print(f"Validated {vid_id} - {title} to API")
-                if args.db:
-                    enqueue_content_to_db(vid_id)
-                elif args.stub:
-                    with open("stub.txt", "a") as f:
-                        f.write(f"{vid_id}\n")
-                else:
-                    enqueue_content_to_api(vid_id)
+            if not channel_id or channel_id in seen:
+                continue
+            seen.add(channel_id)
+            if shard is None or channel_shard(channel_id, shard[1]) == shard[0]:
+                yield channel_id
 
+# Per-process resources of the channel worker pool
+_worker_pool = None
+_worker_known_ids = None
+_worker_state = None
+_worker_journal = None
 
+def _init_channel_worker(wait_time: int, use_id_index: bool, incremental: bool, workers: int):
+    """
+    Set up the browser pool (and ID index) that a channel worker process keeps for its lifetime.
+    The workers split the per-host rate limits, so together they stay within them
+    """
+    global _worker_pool, _worker_known_ids, _worker_state
+    rate_limit.share_budgets(workers)
+    _worker_pool = ScraperPool(wait_time=wait_time)
+    _worker_state = get_shared_state() if incremental else None
+    multiprocessing.util.Finalize(None, _worker_pool.close, exitpriority=10)
+    # Drop anything inherited from the parent when forked; only the worker's own counts are sent back
+    get_shared_metrics().snapshot(reset=True)
+    if use_id_index:
+        _worker_known_ids = get_shared_index()
 
+def _open_worker_journal(path: str) -> CheckpointJournal:
+    """
+    The worker's handle on the run's checkpoint journal, reopened when a new run uses another one.
+    Workers append their verdicts to the same file as the parent
+    """
+    global _worker_journal
+    if path is None:
+        return None
+    if _worker_journal is None or _worker_journal.path != path:
+        if _worker_journal is not None:
+            _worker_journal.close()
+        _worker_journal = CheckpointJournal(path)
+        multiprocessing.util.Finalize(_worker_journal, _worker_journal.close, exitpriority=10)
+    return _worker_journal
 
-if __name__ == '__main__':
+_channel_executor = None
+_channel_executor_key = None
+_channel_executor_lock = threading.Lock()
+
+def get_channel_executor(args) -> ProcessPoolExecutor:
+    """
+    Get the channel worker processes, starting them on first use. They are kept between crawls,
+    so daemon jobs reuse their browsers, and only replaced when a crawl needs other worker settings
+    :param args: The parsed command line arguments of the crawl
+    """
+    global _channel_executor, _channel_executor_key
+    # The initializer arguments: the workers are set up for them
+    key = (args.wait_time, args.id_index, not args.no_incremental, args.workers)
+    with _channel_executor_lock:
+        if _channel_executor is not None and _channel_executor_key != key:
+            _channel_executor.shutdown()
+            _channel_executor = None
+        if _channel_executor is None:
+            _channel_executor = ProcessPoolExecutor(max_workers=args.workers, initializer=_init_channel_worker, initargs=key)
+            _channel_executor_key = key
+        return _channel_executor
+
+def close_channel_executor():
+    """
+    Stop the channel worker processes, if they were started
+    """
+    global _channel_executor
+    with _channel_executor_lock:
+        if _channel_executor is not None:
+            _channel_executor.shutdown()
+            _channel_executor = None
+
+def _crawl_channel_in_worker(channel_id: str, min_time: int, max_time: int, wait_time: int, backend: str, full_rescan: bool,
+                             journal_path: str = None):
+    """
+    Crawl one channel in a worker process
+    :param journal_path: The run's checkpoint journal, if any
+    :returns: The channel ID, its results, its crawl progress (committed by the parent once the results
+              are enqueued), the duration lookups it made and its stage metrics
+    """
+    before = Counter(youtube.duration_lookups)
+    progress = ChannelProgress(channel_id) if _worker_state is not None else None
+    with get_shared_metrics().timer("channel_crawl"):
+        result = youtube.get_content_youtube_channel(channel_id, min_time, max_time, wait_time, known_ids=_worker_known_ids,
+                                                     pool=_worker_pool, backend=backend, state=_worker_state, full_rescan=full_rescan,
+                                                     progress=progress, journal=_open_worker_journal(journal_path))
+    return channel_id, result, progress, youtube.duration_lookups - before, get_shared_metrics().snapshot(reset=True)
+
+def record_channel_verdicts(channel_id: str, succeeded: list[tuple[str, str]], failed: list[tuple[str, str]]):
+    """
+    Add the verdicts of one channel to the run metrics and report
+    :param channel_id: The channel ID
+    :param succeeded: The (video ID, title) pairs of the valid videos
+    :param failed: The (video ID, reason) pairs of the invalid videos
+    """
+    metrics = get_shared_metrics()
+    metrics.incr("channels_crawled")
+    for vid_id, _ in succeeded:
+        metrics.record_verdict(vid_id, True, "Success", source=channel_id)
+    for vid_id, reason in failed:
+        metrics.record_verdict(vid_id, False, reason, source=channel_id)
+
+def crawl_channels(channel_ids, args, pool: ScraperPool, known_ids=None, journal: CheckpointJournal = None) -> tuple[list[str], list[tuple[str, str]]]:
+    """
+    Crawl YouTube channels, in this process or spread over --workers processes. Results of every
+    channel are merged into one deduplicated enqueue stream as soon as the channel finishes
+    :param channel_ids: The channel IDs to crawl
+    :param args: The parsed command line arguments
+    :param pool: The browsers to use when crawling in this process
+    :param known_ids: Optional container of already archived video IDs to skip
+    :param journal: Optional checkpoint journal. It records every verdict as it is made and every finished channel, and videos it has a verdict for are not judged again
+    :returns: The valid video IDs and the (video ID, reason) pairs of the invalid ones
+    """
+    succeeded = {}
+    failed = {}
+    state = None if args.no_incremental else get_shared_state()
+
+    def handle_result(channel_id: str, result, progress: ChannelProgress = None):
+        if result is None:
+            if journal is not None:
+                journal.record_channel_done(channel_id)
+            return
+        channel_succeeded, channel_failed = result
+        record_channel_verdicts(channel_id, channel_succeeded, channel_failed)
+        new_ids = []
+        for vid_id, title in channel_succeeded:
+            if vid_id not in succeeded:
+                print(f"Validated {vid_id} - {title} to API")
+                succeeded[vid_id] = title
+                new_ids.append(vid_id)
+        for vid_id, reason in channel_failed:
+            failed.setdefault(vid_id, reason)
+        if journal is not None:
+            new_ids = [vid_id for vid_id in new_ids if vid_id not in journal.enqueued]
+        enqueued = enqueue_videos(new_ids, args) if new_ids else []
+        if journal is not None:
+            journal.record_enqueued(enqueued)
+            journal.record_channel_done(channel_id)
+        # The high-water mark only moves past videos that are safely enqueued
+        if state is not None and progress is not None:
+            progress.retry_ids.update(set(new_ids) - set(enqueued))
+            state.commit(progress)
+
+    if args.workers > 1:
+        executor = get_channel_executor(args)
+        try:
+            # A few channels per worker in flight, so channels are taken from the list (and its deadline) as workers free up
+            channel_ids = iter(channel_ids)
+            pending = set()
+            while True:
+                for channel_id in itertools.islice(channel_ids, args.workers * 2 - len(pending)):
+                    pending.add(executor.submit(_crawl_channel_in_worker, channel_id, args.min_time, args.max_time, args.wait_time,
+                                                args.listing_backend, args.full_rescan, journal.path if journal is not None else None))
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        channel_id, result, progress, lookups, worker_metrics = future.result()
+                    except Exception as e:
+                        log_message(f"A channel worker failed: {e}")
+                        get_shared_metrics().incr("channel_errors")
+                        continue
+                    youtube.duration_lookups.update(lookups)
+                    get_shared_metrics().merge(worker_metrics)
+                    if journal is not None and result is not None:
+                        # The worker journaled these verdicts already, only this process's view is updated
+                        journal.record_verdicts({vid_id: (True, "Success") for vid_id, _ in result[0]}, write=False)
+                        journal.record_verdicts({vid_id: (False, reason) for vid_id, reason in result[1]}, write=False)
+                    handle_result(channel_id, result, progress)
+        except BrokenProcessPool:
+            # A worker died. The next crawl starts new ones
+            close_channel_executor()
+            raise
+    else:
+        for channel_id in channel_ids:
+            progress = ChannelProgress(channel_id) if state is not None else None
+            with get_shared_metrics().timer("channel_crawl"):
+                result = youtube.get_content_youtube_channel(channel_id, args.min_time, args.max_time, args.wait_time,
+                                                             known_ids=known_ids, pool=pool, backend=args.listing_backend,
+                                                             state=state, full_rescan=args.full_rescan, progress=progress,
+                                                             journal=journal)
+            handle_result(channel_id, result, progress)
+    return list(succeeded), [(vid_id, reason) for vid_id, reason in failed.items() if vid_id not in succeeded]
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    """
+    The command line interface of crawler.py
+    """
     parser = argparse.ArgumentParser(prog="crawler.py", description="A script to crawl for content. Designed for Patchwork Archive")
     parser.add_argument("--start-page", type=int, default=1, help="The page to start scraping from")
     parser.add_argument("--end-page", type=int, default=1, help="The page to stop scraping at")
     parser.add_argument("--min-time", type=int, default=65, help="The minimum length of a video in seconds")
     parser.add_argument("--max-time", type=int, default=480, help="The maximum length of a video in seconds")
-    parser.add_argument("--wait_time", type=int, default=5, help="The amount of time to wait for JS to load in sec (default=5)")
+    parser.add_argument("--wait_time", type=int, default=5, help="The maximum amount of time to wait for JS to render a page in sec (default=5)")
+    parser.add_argument("--fetch-workers", type=int, default=1, help="The number of headless browsers kept open for the run (Holodex pages are fetched concurrently with them)")
+    parser.add_argument("--extract-workers", type=int, default=1, help="The number of threads extracting video IDs from Holodex pages")
+    parser.add_argument("--validate-workers", type=int, default=2, help="The number of Holodex pages validated concurrently")
+    parser.add_argument("--validate-requests", type=int, default=8, help="The maximum number of concurrent Holodex API requests per page being validated")
+    parser.add_argument("--enqueue-workers", type=int, default=2, help="The number of threads enqueueing valid videos")
+    parser.add_argument("--queue-size", type=int, default=8, help="The maximum number of items buffered between two crawl stages")
+    parser.add_argument("--holodex-backend", choices=["browser", "api"], default="browser", help="How to discover Holodex videos. api reads the search as JSON and validates from its records, without a browser")
+    parser.add_argument("--holodex-page-size", type=int, default=holodex.SEARCH_PAGE_SIZE, help="Videos per page with --holodex-backend api")
     parser.add_argument("--youtube", action="store_true", help="Scrape YouTube channels instead of Holodex")
     parser.add_argument("--playlist", type=str, help="Scrape a playlist instead of a channel by the YT playlist ID. Can only specify one playlist per run")
     parser.add_argument("--channel", type=str, help="Channel ID of YouTube Channel. Scrapes a singular channel for its contents")
+    parser.add_argument("--listing-backend", choices=["browser", "http"], default="browser", help="How to list channel and playlist videos. http reads the page JSON without a browser and falls back to it on failure")
     parser.add_argument("--db", action="store_true", help="Enqueue content to the DB instead of the API")
     parser.add_argument("--stub", action="store_true", help="Enqueue to a stub file instead of the API or DB")
     parser.add_argument("--channel_id_source", type=str, default="channels.txt", help="The file containing the channel IDs. Specify DB to use MySQL DB via env variables")
+    parser.add_argument("--id-index", action="store_true", help="Skip videos already archived or queued using the local ID index (synced from the DB when configured)")
+    parser.add_argument("--workers", type=int, default=1, help="The number of processes crawling channels in parallel in YouTube mode")
+    parser.add_argument("--shard", type=parse_shard, help="Only crawl shard i of N of the channel list (e.g. 0/4), so several machines can split it")
+    parser.add_argument("--full-rescan", action="store_true", help="List every channel completely instead of stopping at the videos processed by the last run")
+    parser.add_argument("--no-incremental", action="store_true", help="Don't read or update the per-channel high-water marks")
+    parser.add_argument("--schedule", action="store_true", help="Only crawl channels that are due by their upload activity, most productive first (YouTube mode)")
+    parser.add_argument("--time-budget", type=float, help="Stop starting new channels after this many seconds (YouTube mode). With --schedule the queue is also planned to fit it")
+    parser.add_argument("--max-channels", type=int, help="Crawl at most this many channels (YouTube mode)")
+    parser.add_argument("--include-not-due", action="store_true", help="With --schedule, queue channels that aren't due yet after the due ones")
+    parser.add_argument("--resume", nargs="?", const="latest", help="Continue an interrupted Holodex or channel list run from its checkpoint journal (the latest one if no path is given)")
+    parser.add_argument("--report-dir", default="logs", help="Where the streaming JSONL run report and its JSON summary are written")
+    parser.add_argument("--metrics-textfile", help="Also export the run metrics in the Prometheus text format to this file (e.g. for the node_exporter textfile collector)")
+    parser.add_argument("--metrics-interval", type=int, default=30, help="How often the Prometheus textfile is rewritten during the run, in seconds")
+    parser.add_argument("--http-cache", choices=HTTP_CACHE_MODES, help="Cache Holodex, YouTube, browser and yt_dlp responses on disk (HTTP_CACHE). "
+                        "record stores every response and replay serves only from the cache, to run offline")
+    parser.add_argument("--daemon", action="store_true", help="Run as a long-lived service taking crawl jobs from the control endpoint and --job-dir, keeping browsers, DB and HTTP sessions warm between them")
+    parser.add_argument("--control-host", default="127.0.0.1", help="The address the daemon control endpoint binds to")
+    parser.add_argument("--control-port", type=int, default=8765, help="The port of the daemon control endpoint (0 disables it)")
+    parser.add_argument("--job-dir", help="A directory the daemon polls for *.json job files")
+    parser.add_argument("--job-poll-interval", type=float, default=5.0, help="Seconds between two scans of --job-dir")
     parser.add_argument("--detailed", action="store_true", help="Visits each video and checks for validity with more detail")
+    return parser
+
+
+if __name__ == '__main__':
+    parser = build_arg_parser()
     if parser.parse_args().stub:
         if not os.path.exists("stub.txt"):
             with open("stub.txt", "w") as f:
@@ -186,4 +876,9 @@ if __name__ == '__main__':
     if not load_dotenv():
         print("No .env file found. Please create one and try again. (Use the template)")
         quit()
-    main(args=parser.parse_args())
+    try:
+        main(args=parser.parse_args())
+    except DatabaseConnectionError as err:
+        print(f"Error: '{err}'")
+        print("Connection failed")
+        exit(1)
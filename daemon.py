@@ -0,0 +1,321 @@
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from metrics import get_shared_metrics
+from typing import Callable
+import glob
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+# Finished jobs kept for GET /jobs, oldest dropped first
+MAX_JOB_HISTORY = 200
+# Suffix of a job file the daemon has taken. It is removed when the job finishes, so files still
+# carrying it after a crash are queued again on the next start
+TAKEN_SUFFIX = ".taken"
+# Largest accepted POST /jobs body, in bytes
+MAX_REQUEST_BODY = 1 << 20
+
+
+class CrawlJob:
+    def __init__(self, spec: dict, source: str = "http", path: str = None):
+        """
+        One crawl submitted to the daemon
+        :param spec: The job, e.g. {"mode": "holodex", "start_page": 1, "end_page": 5}
+        :param source: Where it came from, "http" or "file"
+        :param path: The job file it was read from, if any
+        """
+        self.id = uuid.uuid4().hex[:12]
+        self.spec = spec
+        self.source = source
+        self.path = path
+        self.status = "queued"
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.counters = {}
+
+    def to_dict(self) -> dict:
+        duration = None
+        if self.started_at is not None:
+            duration = (self.finished_at or time.time()) - self.started_at
+        return {"id": self.id, "spec": self.spec, "source": self.source, "status": self.status, "submitted_at": self.submitted_at,
+                "started_at": self.started_at, "finished_at": self.finished_at, "duration": duration, "error": self.error,
+                "counters": self.counters}
+
+
+class CrawlDaemon:
+    def __init__(self, run_job: Callable[[dict], None], validate_job: Callable[[dict], None] = None, host: str = "127.0.0.1",
+                 port: int = 8765, job_dir: str = None, poll_interval: float = 5.0, token: str = None,
+                 resource_stats: Callable[[], dict] = None):
+        """
+        Runs crawl jobs one after another in a long-lived process, so browsers, DB connections and
+        HTTP sessions stay warm between them. Jobs are submitted with POST /jobs on the control
+        endpoint or dropped as JSON files into job_dir. GET /health, /stats, /metrics and /jobs report
+        on the daemon
+        :param run_job: Runs one job spec
+        :param validate_job: Checks a spec when it is submitted. Raises ValueError for a spec that can't be run
+        :param host: The address the control endpoint binds to
+        :param port: The port of the control endpoint. 0 disables it
+        :param job_dir: A directory polled for *.json job files (an object or a list of them). None disables it
+        :param poll_interval: Seconds between two scans of job_dir
+        :param token: When set, requests other than GET /health need an "Authorization: Bearer <token>" header
+        :param resource_stats: Returns extra stats for GET /stats, e.g. about the warm browsers
+        """
+        self.run_job = run_job
+        self.validate_job = validate_job
+        self.host = host
+        self.port = port
+        self.job_dir = job_dir
+        self.poll_interval = poll_interval
+        self.token = token
+        self.resource_stats = resource_stats
+        self.started_at = time.time()
+        self.jobs = OrderedDict()
+        self.current = None
+        self.totals = {"done": 0, "failed": 0}
+        self.busy_seconds = 0.0
+        self.server = None
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._worker = None
+
+    def submit(self, spec, source: str = "http", path: str = None) -> list[CrawlJob]:
+        """
+        Queue one job spec or a list of them
+        :param source: Where the specs came from, "http" or "file"
+        :param path: The job file they were read from. It is removed once the last of them has run
+        :raises ValueError: If a spec is invalid. Nothing is queued then
+        """
+        specs = spec if isinstance(spec, list) else [spec]
+        if not specs or not all(isinstance(item, dict) for item in specs):
+            raise ValueError("A job must be a JSON object or a list of them")
+        if self.validate_job is not None:
+            for item in specs:
+                self.validate_job(item)
+        jobs = [CrawlJob(item, source) for item in specs]
+        jobs[-1].path = path
+        with self._lock:
+            for job in jobs:
+                self.jobs[job.id] = job
+        for job in jobs:
+            self._queue.put(job)
+            print(f"[Daemon] Queued job {job.id} from {source}: {json.dumps(job.spec)}")
+        return jobs
+
+    def get_job(self, job_id: str) -> CrawlJob:
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def _run(self, job: CrawlJob):
+        metrics = get_shared_metrics()
+        before = metrics.summary()["counters"]
+        with self._lock:
+            self.current = job
+            job.status = "running"
+            job.started_at = time.time()
+        print(f"[Daemon] Running job {job.id}")
+        try:
+            self.run_job(job.spec)
+            job.status = "done"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e) or type(e).__name__
+            metrics.incr("daemon_job_errors")
+            print(f"[Daemon] Job {job.id} failed: {job.error}")
+        after = metrics.summary()["counters"]
+        with self._lock:
+            job.finished_at = time.time()
+            job.counters = {name: value - before.get(name, 0) for name, value in after.items() if value != before.get(name, 0)}
+            self.totals[job.status] += 1
+            self.busy_seconds += job.finished_at - job.started_at
+            self.current = None
+            finished = [job_id for job_id, item in self.jobs.items() if item.finished_at is not None]
+            for job_id in finished[:max(0, len(finished) - MAX_JOB_HISTORY)]:
+                del self.jobs[job_id]
+        metrics.incr(f"daemon_jobs_{job.status}")
+        metrics.record_job(job.to_dict())
+        if job.path is not None:
+            try:
+                os.remove(job.path)
+            except FileNotFoundError:
+                # Removed by hand while the job ran
+                pass
+        print(f"[Daemon] Job {job.id} {job.status} in {job.finished_at - job.started_at:.1f}s")
+
+    def _work(self):
+        while not self._stopping.is_set():
+            try:
+                job = self._queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            self._run(job)
+
+    def _poll_job_dir(self):
+        os.makedirs(self.job_dir, exist_ok=True)
+        # Jobs taken before a crash or shutdown are run again
+        for path in sorted(glob.glob(os.path.join(self.job_dir, "*.json" + TAKEN_SUFFIX))):
+            self._submit_file(path)
+        while not self._stopping.is_set():
+            for path in sorted(glob.glob(os.path.join(self.job_dir, "*.json"))):
+                taken = path + TAKEN_SUFFIX
+                try:
+                    os.replace(path, taken)
+                except OSError:
+                    continue
+                self._submit_file(taken)
+            self._stopping.wait(self.poll_interval)
+
+    def _submit_file(self, path: str):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                spec = json.load(f)
+            self.submit(spec, "file", path)
+        except (OSError, ValueError) as e:
+            print(f"[Daemon] Skipping job file {path}: {e}")
+            os.replace(path, path[:-len(TAKEN_SUFFIX)] + ".invalid")
+
+    def stats(self) -> dict:
+        """
+        Uptime, job counts and throughput since the daemon started, plus the run metrics
+        """
+        summary = get_shared_metrics().summary()
+        uptime = time.time() - self.started_at
+        with self._lock:
+            queued = sum(1 for job in self.jobs.values() if job.status == "queued")
+            stats = {
+                "uptime": uptime,
+                "current_job": self.current.to_dict() if self.current else None,
+                "jobs": {"queued": queued, **self.totals},
+                "utilization": self.busy_seconds / uptime if uptime else 0.0,
+            }
+        hours = uptime / 3600 or 1
+        counters = summary["counters"]
+        stats["throughput"] = {"jobs_per_hour": (stats["jobs"]["done"] + stats["jobs"]["failed"]) / hours,
+                               "valid_videos_per_hour": counters.get("videos_valid", 0) / hours,
+                               "videos_checked_per_hour": (counters.get("videos_valid", 0) + counters.get("videos_invalid", 0)) / hours}
+        if self.resource_stats is not None:
+            stats["resources"] = self.resource_stats()
+        stats["metrics"] = summary
+        return stats
+
+    def healthy(self) -> bool:
+        return self._worker is not None and self._worker.is_alive() and not self._stopping.is_set()
+
+    def start(self):
+        """
+        Start the job worker, the control endpoint and the job directory poller
+        """
+        self._worker = threading.Thread(target=self._work, name="daemon-worker")
+        self._worker.start()
+        if self.port:
+            self.server = ThreadingHTTPServer((self.host, self.port), _ControlHandler)
+            self.server.daemon_threads = True
+            self.server.crawl_daemon = self
+            threading.Thread(target=self.server.serve_forever, name="daemon-control", daemon=True).start()
+            print(f"[Daemon] Control endpoint listening on http://{self.host}:{self.server.server_address[1]}")
+        if self.job_dir:
+            threading.Thread(target=self._poll_job_dir, name="daemon-job-dir", daemon=True).start()
+            print(f"[Daemon] Watching {self.job_dir} for job files")
+
+    def stop(self):
+        """
+        Stop taking jobs. The running job is finished first
+        """
+        if self._stopping.is_set():
+            return
+        print("[Daemon] Stopping after the current job")
+        self._stopping.set()
+
+    def wait(self):
+        """
+        Block until the daemon is stopped and its running job finished
+        """
+        while self._worker.is_alive():
+            self._worker.join(timeout=1)
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        dropped = self._queue.qsize()
+        if dropped:
+            print(f"[Daemon] {dropped} queued jobs were not run (job files are picked up again on the next start)")
+
+
+class _ControlHandler(BaseHTTPRequestHandler):
+    server_version = "PatchworkCrawler"
+
+    def _send_json(self, status: int, body):
+        self._send(status, json.dumps(body, ensure_ascii=False, default=str), "application/json")
+
+    def _send(self, status: int, body: str, content_type: str):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _authorized(self) -> bool:
+        token = self.server.crawl_daemon.token
+        if not token or self.headers.get("Authorization") == f"Bearer {token}":
+            return True
+        self._send_json(401, {"error": "unauthorized"})
+        return False
+
+    def do_GET(self):
+        daemon = self.server.crawl_daemon
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if path == "/health":
+            healthy = daemon.healthy()
+            self._send_json(200 if healthy else 503, {"status": "ok" if healthy else "stopping",
+                                                      "uptime": time.time() - daemon.started_at})
+            return
+        if not self._authorized():
+            return
+        if path == "/stats":
+            self._send_json(200, daemon.stats())
+        elif path == "/metrics":
+            self._send(200, get_shared_metrics().prometheus_text(), "text/plain; version=0.0.4")
+        elif path == "/jobs":
+            with daemon._lock:
+                jobs = [job.to_dict() for job in daemon.jobs.values()]
+            self._send_json(200, jobs)
+        elif path.startswith("/jobs/"):
+            job = daemon.get_job(path[len("/jobs/"):])
+            if job is None:
+                self._send_json(404, {"error": "no such job"})
+            else:
+                self._send_json(200, job.to_dict())
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        daemon = self.server.crawl_daemon
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if not self._authorized():
+            return
+        if path == "/shutdown":
+            daemon.stop()
+            self._send_json(202, {"status": "stopping"})
+            return
+        if path != "/jobs":
+            self._send_json(404, {"error": "not found"})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_REQUEST_BODY:
+            self._send_json(413, {"error": "request too large"})
+            return
+        try:
+            jobs = daemon.submit(json.loads(self.rfile.read(length) or b"null"))
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        self._send_json(202, {"ids": [job.id for job in jobs]})
+
+    def log_message(self, format, *args):
+        # Job submissions are logged by the daemon itself
+        pass
@@ -0,0 +1,189 @@
+import mysql.connector
+import mysql.connector.pooling
+from mysql.connector import Error
+import os
+import sqlite3
+
+# The tables the crawler reads and writes, created in a fresh SQLite file so single-node and offline
+# runs work without a MySQL server
+SQLITE_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS songs (id INTEGER PRIMARY KEY AUTOINCREMENT, video_id TEXT, title TEXT)",
+    "CREATE INDEX IF NOT EXISTS songs_video_id ON songs (video_id)",
+    "CREATE TABLE IF NOT EXISTS archive_queue (id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT, mode INT)",
+    "CREATE INDEX IF NOT EXISTS archive_queue_url ON archive_queue (url)",
+    "CREATE TABLE IF NOT EXISTS romanized (id INTEGER PRIMARY KEY AUTOINCREMENT, video_id TEXT, romanized_title TEXT)",
+    "CREATE INDEX IF NOT EXISTS romanized_video_id ON romanized (video_id)",
+]
+
+
+class DatabaseConnectionError(Error):
+    """
+    Raised when the database can't be reached or loaded. A mysql.connector Error, so callers that
+    already catch Error keep working
+    """
+
+
+def _connection_params() -> dict:
+    return {
+        "host": os.environ.get("DB_HOST"),
+        "database": os.environ.get("DB_DATABASE"),
+        "user": os.environ.get("DB_USERNAME"),
+        "password": os.environ.get("DB_PASSWORD"),
+    }
+
+
+class _SQLiteCursor:
+    """
+    A sqlite3 cursor that accepts the %s placeholders and raises the mysql.connector Error used
+    throughout SQLHandler
+    """
+    def __init__(self, cursor: sqlite3.Cursor):
+        self.cursor = cursor
+
+    def execute(self, query: str, params=()):
+        try:
+            self.cursor.execute(query.replace("%s", "?"), tuple(params or ()))
+        except sqlite3.Error as err:
+            raise Error(msg=str(err))
+
+    def executemany(self, query: str, seq_params):
+        try:
+            self.cursor.executemany(query.replace("%s", "?"), [tuple(params) for params in seq_params])
+        except sqlite3.Error as err:
+            raise Error(msg=str(err))
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    def close(self):
+        self.cursor.close()
+
+
+class _SQLiteConnection:
+    """
+    The subset of the mysql.connector connection interface SQLHandler uses, backed by a SQLite file
+    """
+    def __init__(self, path: str):
+        self.database = path
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._connected = True
+
+    def cursor(self, buffered: bool = False, prepared: bool = False):
+        # sqlite3 keeps its own cache of prepared statements, so prepared needs nothing extra
+        return _SQLiteCursor(self.connection.cursor())
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def is_connected(self) -> bool:
+        return self._connected
+
+    def close(self):
+        self.connection.close()
+        self._connected = False
+
+
+class MySQLBackend:
+    name = "mysql"
+    random_function = "RAND()"
+    supports_fulltext = True
+    # Each thread can borrow its own connection from the pool
+    shared_connection = False
+
+    def __init__(self, use_pure: bool = False):
+        """
+        MySQL through mysql.connector. Uses the C extension unless use_pure is set (mysql.connector
+        falls back to the pure Python protocol by itself when the extension isn't installed)
+        :param use_pure: Force the pure Python protocol
+        """
+        self.use_pure = use_pure
+
+    def connect(self):
+        return mysql.connector.connect(use_pure=self.use_pure, **_connection_params())
+
+    def create_pool(self, pool_size: int, pool_name: str) -> mysql.connector.pooling.MySQLConnectionPool:
+        return mysql.connector.pooling.MySQLConnectionPool(pool_name=pool_name, pool_size=pool_size,
+                                                           use_pure=self.use_pure, **_connection_params())
+
+
+class SQLiteBackend:
+    name = "sqlite"
+    random_function = "RANDOM()"
+    supports_fulltext = False
+    # One connection, so callers take turns on it
+    shared_connection = True
+
+    def __init__(self, path: str = None):
+        """
+        An embedded SQLite file with the crawler's tables, for single-node and offline runs
+        :param path: The database file. Defaults to DB_DATABASE
+        """
+        self.path = path or (os.environ.get("DB_DATABASE") or "patchwork.db").strip()
+
+    def connect(self) -> _SQLiteConnection:
+        try:
+            connection = _SQLiteConnection(self.path)
+            for statement in SQLITE_SCHEMA:
+                connection.connection.execute(statement)
+            connection.commit()
+        except sqlite3.Error as err:
+            raise DatabaseConnectionError(msg=f"Can't open SQLite database {self.path}: {err}")
+        return connection
+
+    def create_pool(self, pool_size: int, pool_name: str):
+        return None
+
+
+class AsyncMySQLBackend:
+    name = "aiomysql"
+
+    def __init__(self, minsize: int = 1, maxsize: int = 10):
+        """
+        MySQL through aiomysql, for asyncio pipelines. See AsyncSQLHandler
+        :param minsize: Connections opened up front
+        :param maxsize: The most connections in the pool
+        """
+        self.minsize = minsize
+        self.maxsize = maxsize
+
+    async def create_pool(self):
+        try:
+            import aiomysql
+        except ImportError:
+            raise DatabaseConnectionError(msg="The asyncio backend needs aiomysql (pip install aiomysql)")
+        params = _connection_params()
+        try:
+            return await aiomysql.create_pool(host=params["host"], user=params["user"], password=params["password"] or "",
+                                              db=params["database"], minsize=self.minsize, maxsize=self.maxsize,
+                                              autocommit=False, charset="utf8mb4")
+        except Exception as err:
+            raise DatabaseConnectionError(msg=f"Can't connect to MySQL: {err}")
+
+
+def get_backend(engine: str = None):
+    """
+    The backend selected by DB_ENGINE: "mysql" (C extension, the default), "mysql-pure" or "sqlite"
+    :param engine: Overrides DB_ENGINE
+    """
+    engine = (engine or os.environ.get("DB_ENGINE") or "mysql").strip().lower()
+    if engine == "mysql":
+        return MySQLBackend()
+    if engine == "mysql-pure":
+        return MySQLBackend(use_pure=True)
+    if engine == "sqlite":
+        return SQLiteBackend()
+    raise ValueError(f"Unknown DB_ENGINE {engine!r}. Use mysql, mysql-pure or sqlite")
@@ -0,0 +1,183 @@
+from concurrent.futures import ThreadPoolExecutor
+from rate_limit import create_session
+import json
+import os
+import threading
+import time
+import rate_limit
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
+
+
+class QueueClient:
+    def __init__(self, api_url: str = None, auth: str = None, bulk_url: str = None, max_in_flight: int = 8, bulk_size: int = 100,
+                 spool_path: str = "cache/enqueue_spool.jsonl", prepend_url: str = "https://youtube.com/watch?v="):
+        """
+        Client for the Patchwork archive queue API. Keeps a pooled session, sends up to max_in_flight
+        posts at once, uses the bulk endpoint when one is configured and spools failed posts to disk
+        so a later run can retry them
+        :param api_url: The single-item queue endpoint. Defaults to the PATCHWORK_API env variable
+        :param auth: The worker auth token. Defaults to the WORKER_AUTH env variable
+        :param bulk_url: An endpoint that takes many URLs per post. Defaults to the PATCHWORK_BULK_API env variable
+        :param max_in_flight: The maximum number of concurrent posts
+        :param bulk_size: How many URLs to send per bulk post
+        :param spool_path: Where failed posts are kept for retrying
+        :param prepend_url: The default URL prefix of the queued videos
+        """
+        self.api_url = api_url or os.getenv("PATCHWORK_API")
+        self.bulk_url = bulk_url or os.getenv("PATCHWORK_BULK_API")
+        self.headers = {
+            'User-Agent': USER_AGENT,
+            'X-AUTHENTICATION': auth or os.getenv("WORKER_AUTH")
+        }
+        self.max_in_flight = max(1, max_in_flight)
+        self.bulk_size = max(1, bulk_size)
+        self.spool_path = spool_path
+        self.prepend_url = prepend_url
+        self.session = create_session(self.max_in_flight)
+        self.sent = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def _post_single(self, video_id: str, prepend_url: str) -> int:
+        """
+        Post one video to the queue
+        :return: The HTTP status code, or 0 if the request failed
+        """
+        data = {
+            'url': prepend_url + video_id,
+            'mode': 0
+        }
+        try:
+            return rate_limit.request("POST", self.api_url, session=self.session, headers=self.headers, data=data).status_code
+        except Exception as e:
+            print(f"[Enqueue] Failed to enqueue video {video_id}: {e}")
+            return 0
+
+    def _post_bulk(self, video_ids: list[str], prepend_url: str) -> bool:
+        """
+        Post several videos to the bulk endpoint
+        :return: True if the whole batch was accepted
+        """
+        payload = {
+            'urls': [prepend_url + vid for vid in video_ids],
+            'mode': 0
+        }
+        try:
+            response = rate_limit.request("POST", self.bulk_url, session=self.session, headers=self.headers, json=payload)
+        except Exception as e:
+            print(f"[Enqueue] Bulk enqueue of {len(video_ids)} videos failed: {e}")
+            return False
+        return response.status_code == 200
+
+    def _spool(self, video_ids: list[str], prepend_url: str):
+        if not video_ids:
+            return
+        os.makedirs(os.path.dirname(self.spool_path) or ".", exist_ok=True)
+        with self._lock:
+            with open(self.spool_path, "a", encoding="utf-8") as f:
+                for vid in video_ids:
+                    f.write(json.dumps({"video_id": vid, "prepend_url": prepend_url, "failed_at": time.time()}) + "\n")
+
+    def submit(self, video_ids: list[str], spool_failures: bool = True, prepend_url: str = None) -> dict[str, int]:
+        """
+        Enqueue videos. Batches go to the bulk endpoint when there is one; batches it rejects and
+        everything else is posted one video at a time with at most max_in_flight posts in flight
+        :param video_ids: The video IDs to enqueue
+        :param spool_failures: Append videos that could not be enqueued to the retry spool
+        :param prepend_url: The URL prefix of these videos. Defaults to the client's prepend_url
+        :return: A dict of video ID to HTTP status code (0 if the request failed)
+        """
+        video_ids = list(dict.fromkeys(video_ids))
+        if not video_ids:
+            return {}
+        if prepend_url is None:
+            prepend_url = self.prepend_url
+        start = time.perf_counter()
+        statuses = {}
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            if self.bulk_url:
+                chunks = [video_ids[i:i + self.bulk_size] for i in range(0, len(video_ids), self.bulk_size)]
+                for chunk, accepted in zip(chunks, executor.map(lambda chunk: self._post_bulk(chunk, prepend_url), chunks)):
+                    if accepted:
+                        statuses.update({vid: 200 for vid in chunk})
+            remaining = [vid for vid in video_ids if vid not in statuses]
+            if remaining and self.api_url:
+                for vid, status in zip(remaining, executor.map(lambda vid: self._post_single(vid, prepend_url), remaining)):
+                    statuses[vid] = status
+            statuses.update({vid: 0 for vid in remaining if vid not in statuses})
+        failures = [vid for vid in video_ids if statuses[vid] != 200]
+        if spool_failures:
+            self._spool(failures, prepend_url)
+        with self._lock:
+            self.sent += len(video_ids)
+            self.succeeded += len(video_ids) - len(failures)
+            self.failed += len(failures)
+            self.elapsed += time.perf_counter() - start
+        return {vid: statuses[vid] for vid in video_ids}
+
+    def retry_spool(self) -> dict[str, int]:
+        """
+        Retry every spooled video with the URL prefix it was first sent with. Videos that still fail
+        stay in the spool. The spool is renamed while it is retried and only deleted once every
+        video was resubmitted, so a retry that dies halfway is picked up again by the next one
+        :return: A dict of video ID to HTTP status code
+        """
+        retrying_path = self.spool_path + ".retrying"
+        with self._lock:
+            if os.path.exists(self.spool_path):
+                if os.path.exists(retrying_path):
+                    # Left behind by a retry that didn't finish
+                    with open(self.spool_path, "r", encoding="utf-8") as src, open(retrying_path, "a", encoding="utf-8") as dst:
+                        dst.write(src.read())
+                    os.remove(self.spool_path)
+                else:
+                    os.replace(self.spool_path, retrying_path)
+            if not os.path.exists(retrying_path):
+                return {}
+            by_prefix = {}
+            with open(retrying_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        by_prefix.setdefault(entry.get("prepend_url") or self.prepend_url, []).append(entry["video_id"])
+                    except (ValueError, KeyError):
+                        continue
+        statuses = {}
+        for prepend_url, video_ids in by_prefix.items():
+            statuses.update(self.submit(video_ids, prepend_url=prepend_url))
+        os.remove(retrying_path)
+        return statuses
+
+    def stats(self) -> dict:
+        """
+        Enqueue totals and end-to-end throughput so far
+        """
+        with self._lock:
+            return {
+                "sent": self.sent,
+                "succeeded": self.succeeded,
+                "failed": self.failed,
+                "seconds": self.elapsed,
+                "per_second": self.sent / self.elapsed if self.elapsed else 0.0
+            }
+
+    def close(self):
+        self.session.close()
+
+
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+
+def get_shared_client() -> QueueClient:
+    """
+    Get the process wide queue client, configured from the environment on first use
+    """
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            _shared_client = QueueClient(max_in_flight=int(os.getenv("ENQUEUE_IN_FLIGHT") or 8))
+        return _shared_client
@@ -1,29 +1,150 @@
 import json
+import os
+import rate_limit
 import requests
+from concurrent.futures import ThreadPoolExecutor
 
-def check_if_video_valid(api_key: str, videoID: str, min_time=65, max_time=480) -> tuple[bool, str]:
+HOLODEX_API_URL = os.getenv("HOLODEX_API_URL") or "https://holodex.net/api/v2"
+# The topics the search page filters on, used by the JSON search backend
+HOLODEX_SEARCH_TOPICS = [topic.strip() for topic in (os.getenv("HOLODEX_SEARCH_TOPICS") or "Music_Cover,Original_Song").split(",") if topic.strip()]
+# Videos per JSON search request. Holodex serves up to 100
+SEARCH_PAGE_SIZE = 50
+
+ERROR_REASON = "An error occurred while trying to check the video"
+
+
+def evaluate_video(api_data: dict, min_time=65, max_time=480) -> tuple[bool, str]:
     """
-    Check if a video is valid based on its length
-    :param api_key: The API key to use for the request
-    :param videoID: The ID of the video to check
+    Decide if a video is valid from its Holodex metadata. Both limits are exclusive, like in the
+    YouTube path: a video of exactly min_time seconds is too short and one of exactly max_time
+    seconds is too long (the original check returned None for them)
+    :param api_data: The video object returned by the Holodex API
     :param min_time: The minimum length of the video in seconds
     :param max_time: The maximum length of the video in seconds
     :return: A tuple containing a boolean indicating if the video is valid and the reason if it is not
     """
-    url = f"https://holodex.net/api/v2/videos/{videoID}"
-    headers = {
-        "X-APIKEY": api_key
-    }
-    api_data = json.loads(requests.get(url, headers=headers).text)
     try:
         if api_data["status"] != "past":
             return False, "Video is not past, its either currently premiering or upcoming"
         if min_time < api_data["duration"] < max_time:
             return True, "Success"
-        if api_data["duration"] < min_time:
+        if api_data["duration"] <= min_time:
             return False, f"Video is too short (Less than {min_time} seconds)"
-        if api_data["duration"] > max_time:
+        if api_data["duration"] >= max_time:
             return False, f"Video is too long (Exceeds {max_time} seconds)"
     except:
-        print(f"An error occurred while trying to check the video {videoID}")
-        return False, "An error occurred while trying to check the video"
+        video_id = api_data.get("id", "") if isinstance(api_data, dict) else ""
+        print(f"An error occurred while trying to check the video {video_id}")
+    return False, ERROR_REASON
+
+
+def check_if_video_valid(api_key: str, videoID: str, min_time=65, max_time=480, session: requests.Session = None, base_url: str = HOLODEX_API_URL) -> tuple[bool, str]:
+    """
+    Check if a video is valid based on its length
+    :param api_key: The API key to use for the request
+    :param videoID: The ID of the video to check
+    :param min_time: The minimum length of the video in seconds
+    :param max_time: The maximum length of the video in seconds
+    :param session: An optional session to reuse pooled connections
+    :param base_url: The Holodex API root
+    :return: A tuple containing a boolean indicating if the video is valid and the reason if it is not
+    """
+    url = f"{base_url}/videos/{videoID}"
+    headers = {
+        "X-APIKEY": api_key
+    }
+    api_data = json.loads(rate_limit.request("GET", url, session=session, cache="holodex_video", headers=headers).text)
+    return evaluate_video(api_data, min_time, max_time)
+
+
+def search_videos(api_key: str, offset: int = 0, limit: int = SEARCH_PAGE_SIZE, topics: list[str] = None, session: requests.Session = None,
+                  base_url: str = HOLODEX_API_URL) -> tuple[list[dict], int]:
+    """
+    One page of the Holodex video search, newest first, as JSON. The records carry the status and
+    duration evaluate_video needs, so no further request per video is needed
+    :param api_key: The API key to use for the request
+    :param offset: The number of results to skip
+    :param limit: The number of results to return
+    :param topics: The topics to search. Defaults to HOLODEX_SEARCH_TOPICS
+    :param session: An optional session to reuse pooled connections
+    :param base_url: The Holodex API root
+    :return: The video records and the total number of results
+    :raises requests.HTTPError: If the search fails
+    """
+    response = rate_limit.request("POST", f"{base_url}/search/videoSearch", session=session, cache="holodex_search", idempotent=True,
+                                  headers={"X-APIKEY": api_key},
+                                  json={"sort": "newest", "target": ["stream", "clip"], "topic": topics or HOLODEX_SEARCH_TOPICS,
+                                        "conditions": [], "paginated": True, "offset": offset, "limit": limit})
+    response.raise_for_status()
+    data = response.json()
+    if isinstance(data, list):
+        return data, offset + len(data)
+    items = [item for item in data.get("items", []) if isinstance(item, dict) and item.get("id")]
+    return items, int(data.get("total") or 0)
+
+
+def _fetch_video_batch(session: requests.Session, api_key: str, video_ids: list[str], base_url: str) -> dict[str, dict]:
+    """
+    Fetch metadata for several videos with a single multi-ID request
+    :return: A dict of video ID to its metadata. IDs the API did not return are absent
+    """
+    try:
+        response = rate_limit.request("GET", f"{base_url}/videos", session=session, cache="holodex_video",
+                                      headers={"X-APIKEY": api_key},
+                                      params={"id": ",".join(video_ids), "limit": len(video_ids)})
+        if response.status_code != 200:
+            return {}
+        items = response.json()
+    except Exception:
+        return {}
+    if isinstance(items, dict):
+        items = items.get("items", [])
+    wanted = set(video_ids)
+    return {item["id"]: item for item in items if isinstance(item, dict) and item.get("id") in wanted}
+
+
+def check_videos_valid(api_key: str, video_ids: list[str], min_time=65, max_time=480, max_workers: int = 8, batch_size: int = 50,
+                       session: requests.Session = None, base_url: str = HOLODEX_API_URL) -> dict[str, tuple[bool, str]]:
+    """
+    Check the validity of many videos at once.
+    Metadata is requested in multi-ID batches first; any ID the batch endpoint does not return
+    is looked up individually with at most max_workers requests in flight.
+    :param api_key: The API key to use for the requests
+    :param video_ids: The IDs of the videos to check
+    :param min_time: The minimum length of the video in seconds
+    :param max_time: The maximum length of the video in seconds
+    :param max_workers: The maximum number of concurrent requests
+    :param batch_size: How many IDs to ask for per multi-ID request. 1 disables batching
+    :param session: An optional session to reuse. One is created (and closed) otherwise
+    :param base_url: The Holodex API root
+    :return: A dict of video ID to (valid, reason), same verdicts as check_if_video_valid
+    """
+    video_ids = list(dict.fromkeys(video_ids))
+    if not video_ids:
+        return {}
+    own_session = session is None
+    if own_session:
+        session = rate_limit.create_session(max_workers)
+    metadata = {}
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            if batch_size > 1:
+                chunks = [video_ids[i:i + batch_size] for i in range(0, len(video_ids), batch_size)]
+                for found in executor.map(lambda chunk: _fetch_video_batch(session, api_key, chunk, base_url), chunks):
+                    metadata.update(found)
+            verdicts = {vid: evaluate_video(metadata[vid], min_time, max_time) for vid in video_ids if vid in metadata}
+
+            def check_single(vid: str) -> tuple[bool, str]:
+                try:
+                    return check_if_video_valid(api_key, vid, min_time, max_time, session=session, base_url=base_url)
+                except Exception:
+                    print(f"An error occurred while trying to check the video {vid}")
+                    return False, ERROR_REASON
+
+            remaining = [vid for vid in video_ids if vid not in verdicts]
+            for vid, verdict in zip(remaining, executor.map(check_single, remaining)):
+                verdicts[vid] = verdict
+    finally:
+        if own_session:
+            session.close()
+    return {vid: verdicts[vid] for vid in video_ids}
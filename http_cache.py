@@ -0,0 +1,298 @@
+from requests.structures import CaseInsensitiveDict
+from metrics import get_shared_metrics
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+import requests
+
+# Seconds a cached response stays fresh, per source. Stale responses are revalidated with their
+# ETag / Last-Modified when they have one, and fetched again otherwise
+DEFAULT_TTLS = {
+    "holodex_video": 6 * 3600,
+    "holodex_search": 600,
+    "youtube_listing": 3600,
+    "youtube_watch": 7 * 86400,
+    "yt_dlp": 7 * 86400,
+    "channel_page": 86400,
+    "channel_list": 0,
+    "browser": 3600,
+}
+DEFAULT_TTL = 3600
+
+# off: no caching. on: serve fresh responses, revalidate stale ones. record: always fetch and store
+# everything. replay: only serve from the cache, never touch the network
+MODES = ("off", "on", "record", "replay")
+
+# Responses worth keeping. Errors and throttling are always fetched again
+CACHEABLE_STATUSES = {200, 404, 410}
+# Headers kept with a cached body. The body is stored decoded, so the transfer headers are dropped
+KEPT_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Cache-Control", "Date")
+CONDITIONAL_HEADERS = ("If-None-Match", "If-Modified-Since")
+# A hit only rewrites its access time (for LRU eviction) when that is older than this, in seconds
+ACCESS_RESOLUTION = 60.0
+# Eviction brings the cache down to this share of its size limit, so it doesn't run on every store
+EVICTION_TARGET = 0.9
+
+
+class CacheMissError(Exception):
+    """Raised in replay mode for a request that was never recorded"""
+
+
+def parse_ttls(spec: str) -> dict[str, float]:
+    """
+    Parse a TTL spec such as "holodex_video=3600,browser=0" (seconds per source)
+    :param spec: The spec, usually from the HTTP_CACHE_TTLS env variable
+    """
+    ttls = {}
+    for entry in (spec or "").split(","):
+        if "=" in entry:
+            source, seconds = entry.split("=", 1)
+            ttls[source.strip()] = float(seconds)
+    return ttls
+
+
+def request_key(method: str, url: str, params=None, data=None, json_body=None) -> str:
+    """
+    The cache key of a request: its method, full URL (with the query built from params) and body.
+    Headers such as API keys are not part of it
+    """
+    prepared = requests.Request(method.upper(), url, params=params, data=data, json=json_body).prepare()
+    body = prepared.body or b""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    return hashlib.sha256(f"{prepared.method} {prepared.url}\n".encode("utf-8") + body).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path: str = "cache/http_cache.db", mode: str = "on", max_bytes: int = 512 << 20, ttls: dict[str, float] = None):
+        """
+        An on-disk cache of HTTP responses and other fetched values (rendered pages, yt_dlp results),
+        shared by every fetch path that opts in with a source name. Bodies are stored zlib compressed
+        in SQLite. The least recently used entries are evicted once the compressed bodies exceed
+        max_bytes
+        :param path: The path of the SQLite file
+        :param mode: "off", "on", "record" or "replay", see MODES
+        :param max_bytes: The size limit of the stored bodies
+        :param ttls: Seconds a response stays fresh per source, on top of DEFAULT_TTLS
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown HTTP cache mode {mode!r}, expected one of {', '.join(MODES)}")
+        self.path = path
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.total_bytes = 0
+        self.connection = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def _connect(self) -> sqlite3.Connection:
+        # Called with the lock held. A forked worker process opens its own connection
+        if self.connection is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                url TEXT,
+                status INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL,
+                stored_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                size INTEGER NOT NULL)""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+            self.connection.commit()
+            self.total_bytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            self._pid = os.getpid()
+        return self.connection
+
+    def _get(self, key: str):
+        """
+        :return: (status, headers, body, expires_at, url) or None
+        """
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute("SELECT status, headers, body, expires_at, url, accessed_at FROM responses WHERE key = ?",
+                                     (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[5] > ACCESS_RESOLUTION:
+                connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                connection.commit()
+        return row[0], json.loads(row[1]), zlib.decompress(row[2]), row[3], row[4]
+
+    def _put(self, key: str, source: str, url: str, status: int, headers: dict, body: bytes):
+        now = time.time()
+        compressed = zlib.compress(body, 6)
+        with self._lock:
+            connection = self._connect()
+            previous = connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            connection.execute("INSERT OR REPLACE INTO responses (key, source, url, status, headers, body, stored_at, expires_at, accessed_at, size) "
+                               "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                               (key, source, url, status, json.dumps(headers), compressed, now, now + self.ttl(source), now, len(compressed)))
+            connection.commit()
+            self.total_bytes += len(compressed) - (previous[0] if previous else 0)
+            evicted = self._evict() if self.total_bytes > self.max_bytes else 0
+        get_shared_metrics().incr("http_cache_stored")
+        if evicted:
+            get_shared_metrics().incr("http_cache_evicted", evicted)
+
+    def _evict(self) -> int:
+        # Called with the lock held. Other processes write to the file too, so the size is re-read first
+        connection = self.connection
+        self.total_bytes = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        evicted = 0
+        while self.total_bytes > self.max_bytes * EVICTION_TARGET:
+            rows = connection.execute("SELECT key, size FROM responses ORDER BY accessed_at LIMIT 500").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.total_bytes -= size
+                evicted += 1
+                if self.total_bytes <= self.max_bytes * EVICTION_TARGET:
+                    break
+            connection.commit()
+        return evicted
+
+    def _touch(self, key: str, source: str):
+        # A revalidated response is fresh again
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute("UPDATE responses SET expires_at = ?, accessed_at = ? WHERE key = ?", (now + self.ttl(source), now, key))
+            connection.commit()
+
+    def ttl(self, source: str) -> float:
+        return self.ttls.get(source, DEFAULT_TTL)
+
+    def fetch(self, source: str, method: str, url: str, send, **kwargs) -> requests.Response:
+        """
+        Answer a request from the cache, or send it and store the response
+        :param source: The kind of response, which picks its TTL (e.g. "holodex_video")
+        :param method: The HTTP method
+        :param url: The URL
+        :param send: Sends the request, called with the (possibly extended) requests keyword arguments
+        :param kwargs: The requests keyword arguments. Streamed requests (stream=True) are passed through
+                       uncached, because storing the body would read all of it. Callers cache what they
+                       take from it with put_value instead
+        :raises CacheMissError: In replay mode, if the request was never recorded
+        """
+        metrics = get_shared_metrics()
+        if kwargs.get("stream"):
+            if self.mode == "replay":
+                metrics.incr("http_cache_misses")
+                raise CacheMissError(f"{method} {url} is streamed, so it is never in the HTTP cache")
+            return send(**kwargs)
+        key = request_key(method, url, kwargs.get("params"), kwargs.get("data"), kwargs.get("json"))
+        entry = self._get(key) if self.mode != "record" else None
+        if self.mode == "replay":
+            if entry is None:
+                metrics.incr("http_cache_misses")
+                raise CacheMissError(f"{method} {url} is not in the HTTP cache")
+            metrics.incr("http_cache_hits")
+            return _build_response(entry, url)
+        if entry is not None and entry[3] > time.time():
+            metrics.incr("http_cache_hits")
+            return _build_response(entry, url)
+        headers = dict(kwargs.get("headers") or {})
+        # A caller doing its own conditional request gets the server's answer to it
+        own_validators = any(name in headers for name in CONDITIONAL_HEADERS)
+        revalidating = entry is not None and not own_validators and (entry[1].get("ETag") or entry[1].get("Last-Modified"))
+        if revalidating:
+            if entry[1].get("ETag"):
+                headers["If-None-Match"] = entry[1]["ETag"]
+            if entry[1].get("Last-Modified"):
+                headers["If-Modified-Since"] = entry[1]["Last-Modified"]
+            kwargs["headers"] = headers
+        try:
+            response = send(**kwargs)
+        except requests.RequestException:
+            if entry is None:
+                raise
+            # Better a stale response than none while the source is unreachable
+            metrics.incr("http_cache_stale_served")
+            return _build_response(entry, url)
+        if revalidating and response.status_code == 304:
+            response.close()
+            self._touch(key, source)
+            metrics.incr("http_cache_revalidated")
+            return _build_response(entry, url)
+        metrics.incr("http_cache_misses")
+        if response.status_code in CACHEABLE_STATUSES and "no-store" not in response.headers.get("Cache-Control", ""):
+            self._put(key, source, url, response.status_code,
+                      {name: response.headers[name] for name in KEPT_HEADERS if name in response.headers}, response.content)
+        return response
+
+    def get_value(self, source: str, key: str):
+        """
+        A cached value that isn't an HTTP response, e.g. a rendered page or a yt_dlp result
+        :return: The value, or None if it isn't cached or no longer fresh
+        :raises CacheMissError: In replay mode, if the value was never recorded
+        """
+        entry = self._get(request_key("GET", f"value://{source}/{key}")) if self.mode != "record" else None
+        metrics = get_shared_metrics()
+        if entry is not None and (self.mode == "replay" or entry[3] > time.time()):
+            metrics.incr("http_cache_hits")
+            return json.loads(entry[2])
+        metrics.incr("http_cache_misses")
+        if self.mode == "replay":
+            raise CacheMissError(f"{source} {key} is not in the HTTP cache")
+        return None
+
+    def put_value(self, source: str, key: str, value):
+        """
+        Store a JSON serializable value for get_value
+        """
+        self._put(request_key("GET", f"value://{source}/{key}"), source, key, 200, {},
+                  json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+    def close(self):
+        with self._lock:
+            if self.connection is not None and self._pid == os.getpid():
+                self.connection.close()
+            self.connection = None
+
+
+def _build_response(entry, url: str) -> requests.Response:
+    status, headers, body, _, stored_url = entry
+    response = requests.Response()
+    response.status_code = status
+    response.headers = CaseInsensitiveDict(headers)
+    response._content = body
+    response._content_consumed = True
+    response.url = stored_url or url
+    response.reason = "OK" if status == 200 else "Cached"
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    response.from_cache = True
+    return response
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_shared_cache() -> ResponseCache:
+    """
+    Get the process wide response cache. It is configured by the HTTP_CACHE (mode, off by default),
+    HTTP_CACHE_PATH, HTTP_CACHE_MAX_MB and HTTP_CACHE_TTLS env variables
+    """
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = ResponseCache(os.getenv("HTTP_CACHE_PATH") or "cache/http_cache.db", os.getenv("HTTP_CACHE") or "off",
+                                          int(float(os.getenv("HTTP_CACHE_MAX_MB") or 512) * (1 << 20)), parse_ttls(os.getenv("HTTP_CACHE_TTLS")))
+        return _shared_cache
@@ -0,0 +1,156 @@
+import json
+import mmap
+import os
+import threading
+
+# YouTube video IDs are 11 characters. Every record in the index file is padded to this width
+ID_WIDTH = 11
+
+
+class ArchivedIdIndex:
+    def __init__(self, path: str = "cache/archived_ids.idx"):
+        """
+        A local index of video IDs that are already archived or queued. IDs are kept as a
+        sorted array of fixed width records in a memory-mapped file, so membership is a binary
+        search that touches only a few pages. IDs added since the last compaction live in a
+        small in-memory set until the next save
+        :param path: The path of the index file. Sync state is stored next to it as <path>.json
+        """
+        self.path = path
+        self.state_path = path + ".json"
+        self.pending = set()
+        self.state = {"songs": 0, "archive_queue": 0}
+        self._lock = threading.Lock()
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r") as f:
+                self.state.update(json.load(f))
+        # (mmap, file, record count), replaced in one assignment so readers never see a mix of two files
+        self._mapped = self._open()
+
+    def _open(self) -> tuple:
+        """
+        Map the index file
+        :return: The mmap, the open file and the number of records. (None, None, 0) when there is no index yet
+        """
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return None, None, 0
+        file = open(self.path, "rb")
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return mapped, file, len(mapped) // ID_WIDTH
+
+    @staticmethod
+    def _close(mapped: tuple):
+        if mapped[0] is not None:
+            mapped[0].close()
+            mapped[1].close()
+
+    @staticmethod
+    def _record(mapped: mmap.mmap, i: int) -> bytes:
+        return mapped[i * ID_WIDTH:(i + 1) * ID_WIDTH]
+
+    @staticmethod
+    def _encode(video_id: str) -> bytes:
+        return video_id.encode("ascii", "ignore")[:ID_WIDTH].ljust(ID_WIDTH, b" ")
+
+    def __contains__(self, video_id: str) -> bool:
+        if video_id in self.pending:
+            return True
+        key = self._encode(video_id)
+        while True:
+            mapped, _, count = self._mapped
+            if mapped is None:
+                return False
+            try:
+                lo, hi = 0, count
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    if self._record(mapped, mid) < key:
+                        lo = mid + 1
+                    else:
+                        hi = mid
+                return lo < count and self._record(mapped, lo) == key
+            except ValueError:
+                # save() closed this mapping mid-search. The new one has every ID the old one had
+                if self._mapped[0] is mapped:
+                    raise
+
+    def __len__(self) -> int:
+        return self._mapped[2] + len(self.pending)
+
+    def add(self, video_ids):
+        """
+        Add IDs to the in-memory part of the index. Call save() to persist them
+        :param video_ids: The video IDs to add
+        """
+        with self._lock:
+            self.pending.update(video_ids)
+
+    def save(self):
+        """
+        Merge the pending IDs into the sorted index file and persist the sync state
+        """
+        with self._lock:
+            if self.pending:
+                mapped, _, count = self._mapped
+                existing = [self._record(mapped, i) for i in range(count)] if mapped is not None else []
+                merged = sorted(set(existing).union(self._encode(vid) for vid in self.pending))
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(b"".join(merged))
+                # The old mapping stays valid after the replace, so lookups go on until the new one is swapped in
+                os.replace(tmp_path, self.path)
+                old = self._mapped
+                self._mapped = self._open()
+                # Cleared only after the swap, so an ID is always in pending or in the mapped file
+                self.pending = set()
+                self._close(old)
+            with open(self.state_path, "w") as f:
+                json.dump(self.state, f)
+
+    def sync(self, server, prepend_url: str = "https://youtube.com/watch?v=", batch_size: int = 10000):
+        """
+        Pull IDs added to songs and archive_queue since the last sync. Only rows with an
+        auto-increment id above the last seen one are fetched
+        :param server: A SQLHandler
+        :param prepend_url: The URL prefix archive_queue rows are stored with
+        :param batch_size: The number of rows fetched per query
+        :return: The number of IDs added to the index
+        """
+        added = 0
+        for table, column in (("songs", "video_id"), ("archive_queue", "url")):
+            while True:
+                rows = server.get_query_result(f"SELECT id, {column} FROM {table} WHERE id > %s ORDER BY id LIMIT %s",
+                                               (int(self.state[table]), int(batch_size)))
+                if not rows:
+                    break
+                video_ids = []
+                for row_id, value in rows:
+                    if value and table == "archive_queue":
+                        value = value.replace(prepend_url, "").split("&")[0]
+                    if value:
+                        video_ids.append(value)
+                self.add(video_ids)
+                added += len(video_ids)
+                self.state[table] = rows[-1][0]
+                if len(rows) < batch_size:
+                    break
+        self.save()
+        print(f"[ID Index] Synced {added} IDs. {len(self)} known IDs")
+        return added
+
+
+_shared_index = None
+_shared_index_lock = threading.Lock()
+
+
+def get_shared_index(path: str = None) -> ArchivedIdIndex:
+    """
+    Get the process wide archived-ID index, opening it on first use
+    :param path: The index file path. Defaults to the ARCHIVED_ID_INDEX env variable or cache/archived_ids.idx
+    """
+    global _shared_index
+    with _shared_index_lock:
+        if _shared_index is None:
+            _shared_index = ArchivedIdIndex(path or os.getenv("ARCHIVED_ID_INDEX") or "cache/archived_ids.idx")
+        return _shared_index
@@ -0,0 +1,281 @@
+from collections import Counter
+from contextlib import contextmanager
+import bisect
+import json
+import os
+import threading
+import time
+
+# Upper bounds (seconds) of the stage latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRIC_PREFIX = "patchwork_crawler"
+
+
+class StageHistogram:
+    def __init__(self):
+        """
+        Latencies of one stage in fixed buckets, so memory stays constant however long the run is
+        """
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def merge(self, other: dict):
+        for i, value in enumerate(other["buckets"]):
+            self.buckets[i] += value
+        self.count += other["count"]
+        self.total += other["total"]
+        self.max = max(self.max, other["max"])
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate a quantile by interpolating inside the bucket it falls in
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, value in enumerate(self.buckets):
+            if value and seen + value >= rank:
+                lower = LATENCY_BUCKETS[i - 1] if i > 0 else 0.0
+                upper = LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else self.max
+                return min(self.max, lower + (upper - lower) * (rank - seen) / value)
+            seen += value
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {"buckets": list(self.buckets), "count": self.count, "total": self.total, "max": self.max}
+
+
+class RunMetrics:
+    def __init__(self):
+        """
+        Per-stage timings, counters and rejection reasons of a crawl run. Verdicts and enqueues are
+        streamed to a JSONL report as they happen once open_report has been called
+        """
+        self.mode = None
+        self.started_at = time.time()
+        self.stages = {}
+        self.counters = Counter()
+        self.rejections = Counter()
+        self.report_path = None
+        self._report = None
+        self._lock = threading.Lock()
+
+    def open_report(self, path: str, mode: str):
+        """
+        Start streaming events to a JSONL report
+        :param path: The path of the report
+        :param mode: The crawl mode, recorded in the report and as a metric label
+        """
+        self.mode = mode
+        self.report_path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._report = open(path, "a", encoding="utf-8")
+        self._write({"type": "run", "mode": mode})
+
+    def _write(self, event: dict):
+        if self._report is None:
+            # Skips the serialization when no report is open
+            return
+        event["time"] = round(time.time(), 3)
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        with self._lock:
+            # Checked again under the lock, since close() may run on another thread in between
+            if self._report is None:
+                return
+            self._report.write(line)
+            self._report.flush()
+
+    def observe(self, stage: str, seconds: float):
+        """
+        Record how long one call of a stage took
+        """
+        with self._lock:
+            if stage not in self.stages:
+                self.stages[stage] = StageHistogram()
+            self.stages[stage].observe(seconds)
+
+    @contextmanager
+    def timer(self, stage: str):
+        """
+        Time the body of a with block as one call of stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def incr(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def record_verdict(self, video_id: str, valid: bool, reason: str, source: str = None):
+        """
+        Record whether a video passed validation
+        :param video_id: The video ID
+        :param valid: True if the video is valid
+        :param reason: Why it was rejected (or "Success")
+        :param source: Where the video was found, e.g. a Holodex page or a channel ID
+        """
+        with self._lock:
+            self.counters["videos_valid" if valid else "videos_invalid"] += 1
+            if not valid:
+                self.rejections[reason] += 1
+        event = {"type": "verdict", "video_id": video_id, "valid": valid, "reason": reason}
+        if source is not None:
+            event["source"] = source
+        self._write(event)
+
+    def record_enqueue(self, destination: str, outcomes: dict):
+        """
+        Record the outcome of handing videos to the archive queue
+        :param destination: "db", "api" or "stub"
+        :param outcomes: A dict of video ID to its outcome (e.g. "enqueued", "archived", "error")
+        """
+        if not outcomes:
+            return
+        totals = Counter(str(outcome) for outcome in outcomes.values())
+        with self._lock:
+            for outcome, amount in totals.items():
+                self.counters[f"enqueue_{destination}_{outcome}"] += amount
+        self._write({"type": "enqueue", "destination": destination, "outcomes": {vid: str(outcome) for vid, outcome in outcomes.items()}})
+
+    def record_job(self, job: dict):
+        """
+        Record a finished daemon job in the report
+        :param job: The job as CrawlJob.to_dict returns it
+        """
+        self._write({"type": "job", **job})
+
+    def snapshot(self, reset: bool = False) -> dict:
+        """
+        The stage histograms and counters, e.g. to hand them from a worker process to the parent
+        :param reset: Start counting from zero again afterwards
+        """
+        with self._lock:
+            snapshot = {
+                "stages": {stage: histogram.to_dict() for stage, histogram in self.stages.items()},
+                "counters": dict(self.counters),
+                "rejections": dict(self.rejections)
+            }
+            if reset:
+                self.stages = {}
+                self.counters = Counter()
+                self.rejections = Counter()
+        return snapshot
+
+    def merge(self, snapshot: dict):
+        """
+        Add a snapshot taken in another process
+        """
+        with self._lock:
+            for stage, histogram in snapshot["stages"].items():
+                self.stages.setdefault(stage, StageHistogram()).merge(histogram)
+            self.counters.update(snapshot["counters"])
+            self.rejections.update(snapshot["rejections"])
+
+    def summary(self) -> dict:
+        """
+        The run so far: per-stage call counts, total/p50/p95/max seconds, counters and rejection reasons
+        """
+        with self._lock:
+            stages = {stage: {"calls": h.count, "total": h.total, "p50": h.quantile(0.5), "p95": h.quantile(0.95), "max": h.max}
+                      for stage, h in sorted(self.stages.items())}
+            return {
+                "mode": self.mode,
+                "duration": time.time() - self.started_at,
+                "stages": stages,
+                "counters": dict(sorted(self.counters.items())),
+                "rejections": dict(self.rejections.most_common())
+            }
+
+    def write_json(self, path: str):
+        """
+        Write the summary as JSON
+        """
+        _write_atomic(path, json.dumps(self.summary(), indent=2, ensure_ascii=False))
+
+    def write_prometheus(self, path: str):
+        """
+        Write the metrics in the Prometheus text format, e.g. for the node_exporter textfile collector
+        """
+        _write_atomic(path, self.prometheus_text())
+
+    def prometheus_text(self) -> str:
+        """
+        The metrics in the Prometheus text exposition format
+        """
+        labels = f'mode="{_escape_label(self.mode or "")}"'
+        lines = [f"# HELP {METRIC_PREFIX}_stage_seconds Time spent in each crawl stage",
+                 f"# TYPE {METRIC_PREFIX}_stage_seconds histogram"]
+        with self._lock:
+            for stage, histogram in sorted(self.stages.items()):
+                stage_labels = f'{labels},stage="{_escape_label(stage)}"'
+                cumulative = 0
+                for bound, value in zip(LATENCY_BUCKETS + ("+Inf",), histogram.buckets):
+                    cumulative += value
+                    lines.append(f'{METRIC_PREFIX}_stage_seconds_bucket{{{stage_labels},le="{bound}"}} {cumulative}')
+                lines.append(f"{METRIC_PREFIX}_stage_seconds_sum{{{stage_labels}}} {histogram.total}")
+                lines.append(f"{METRIC_PREFIX}_stage_seconds_count{{{stage_labels}}} {histogram.count}")
+            lines += [f"# HELP {METRIC_PREFIX}_events_total Videos, pages and enqueue outcomes counted during the run",
+                      f"# TYPE {METRIC_PREFIX}_events_total counter"]
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'{METRIC_PREFIX}_events_total{{{labels},event="{_escape_label(name)}"}} {value}')
+            lines += [f"# HELP {METRIC_PREFIX}_rejections_total Videos rejected, by reason",
+                      f"# TYPE {METRIC_PREFIX}_rejections_total counter"]
+            for reason, value in self.rejections.most_common():
+                lines.append(f'{METRIC_PREFIX}_rejections_total{{{labels},reason="{_escape_label(reason)}"}} {value}')
+        lines += [f"# HELP {METRIC_PREFIX}_run_duration_seconds How long the run has been going",
+                  f"# TYPE {METRIC_PREFIX}_run_duration_seconds gauge",
+                  f"{METRIC_PREFIX}_run_duration_seconds{{{labels}}} {time.time() - self.started_at}"]
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        """
+        Append the summary to the report and close it
+        """
+        if self._report is None:
+            return
+        self._write({"type": "summary", **self.summary()})
+        with self._lock:
+            if self._report is not None:
+                self._report.close()
+                self._report = None
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _write_atomic(path: str, content: str):
+    # Readers (e.g. node_exporter) must never see a half written file
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+_shared_metrics = None
+_shared_metrics_lock = threading.Lock()
+
+
+def get_shared_metrics() -> RunMetrics:
+    """
+    Get the process wide run metrics
+    """
+    global _shared_metrics
+    with _shared_metrics_lock:
+        if _shared_metrics is None:
+            _shared_metrics = RunMetrics()
+        return _shared_metrics
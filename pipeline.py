@@ -0,0 +1,85 @@
+import queue
+import threading
+from typing import Callable, Iterable
+
+# Marks the end of a stage's input
+_DONE = object()
+
+
+class Stage:
+    def __init__(self, name: str, func: Callable, workers: int = 1):
+        """
+        A single step of a Pipeline
+        :param name: The name of the stage, used in log messages
+        :param func: Called once per input item. Returns an iterable of items for the next stage (or None)
+        :param workers: The number of threads running func concurrently
+        """
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+
+
+class Pipeline:
+    def __init__(self, stages: list[Stage], queue_size: int = 8, on_error: Callable = None):
+        """
+        A staged producer/consumer pipeline. Every stage runs in its own worker threads and
+        hands items to the next stage through a bounded queue, so a slow stage applies
+        backpressure instead of letting work pile up in memory.
+        :param stages: The stages in the order items flow through them
+        :param queue_size: The maximum number of items waiting between two stages
+        :param on_error: Called with (stage name, item, exception) when a stage raises. Errors are printed otherwise
+        """
+        self.stages = stages
+        self.queue_size = queue_size
+        self.on_error = on_error
+
+    def _report_error(self, stage: Stage, item, err: Exception):
+        if self.on_error is not None:
+            self.on_error(stage.name, item, err)
+        else:
+            print(f"[Pipeline] Stage {stage.name} failed on {item}: {err}")
+
+    def _run_worker(self, stage: Stage, inbox: queue.Queue, outbox: queue.Queue):
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                # Let the other workers of this stage see the marker as well
+                inbox.put(_DONE)
+                return
+            try:
+                results = stage.func(item)
+            except (Exception, SystemExit) as err:
+                # SystemExit too: a worker dying here would leave the upstream stage blocked on a full queue
+                self._report_error(stage, item, err)
+                continue
+            if outbox is not None and results is not None:
+                for result in results:
+                    outbox.put(result)
+
+    def _run_stage(self, stage: Stage, inbox: queue.Queue, outbox: queue.Queue):
+        workers = [threading.Thread(target=self._run_worker, args=(stage, inbox, outbox), name=f"{stage.name}-{i}", daemon=True)
+                   for i in range(stage.workers)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        if outbox is not None:
+            outbox.put(_DONE)
+
+    def run(self, items: Iterable):
+        """
+        Feed items into the first stage and block until every stage has drained
+        :param items: The inputs of the first stage
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        runners = []
+        for i, stage in enumerate(self.stages):
+            outbox = queues[i + 1] if i + 1 < len(queues) else None
+            runner = threading.Thread(target=self._run_stage, args=(stage, queues[i], outbox), name=stage.name, daemon=True)
+            runner.start()
+            runners.append(runner)
+        for item in items:
+            queues[0].put(item)
+        queues[0].put(_DONE)
+        for runner in runners:
+            runner.join()
@@ -0,0 +1,305 @@
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from http_cache import get_shared_cache
+import os
+import random
+import threading
+import time
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+# Requests per second and burst size per host, used unless RATE_LIMITS overrides them
+DEFAULT_BUDGETS = {
+    "holodex.net": (8.0, 16),
+    "www.youtube.com": (5.0, 10),
+    "youtube.com": (5.0, 10),
+    "raw.githubusercontent.com": (5.0, 5),
+}
+DEFAULT_BUDGET = (10.0, 20)
+
+# Statuses that mean "slow down" or "try again later" rather than "this request is wrong"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Of those, the ones a server answers without acting on the request. Only these are retried for
+# requests that must not be sent twice (e.g. queue posts), since a 5xx may come after the work was done
+REJECTED_STATUSES = {429}
+# Methods that can safely be sent twice. Other methods are only retried when they provably never
+# reached the server, unless the caller says the request is idempotent
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE", "TRACE"}
+
+
+class CircuitOpenError(Exception):
+    """Raised when a host has failed too often and calls to it are paused"""
+
+
+def parse_budgets(spec: str) -> dict[str, tuple[float, int]]:
+    """
+    Parse a budget spec such as "holodex.net=8/16,www.youtube.com=5" (requests per second / burst)
+    :param spec: The spec, usually from the RATE_LIMITS env variable
+    :return: A dict of host to (rate, burst)
+    A rate of 0 means the host is not throttled
+    :raises ValueError: For a negative rate or a burst below 1
+    """
+    budgets = {}
+    for entry in (spec or "").split(","):
+        if "=" not in entry:
+            continue
+        host, budget = entry.split("=", 1)
+        rate, _, burst = budget.partition("/")
+        rate = float(rate)
+        burst = int(burst) if burst else max(1, int(rate))
+        if rate < 0 or burst < 1:
+            raise ValueError(f"Invalid rate limit {entry.strip()!r}: the rate must be 0 or more and the burst 1 or more")
+        budgets[host.strip().lower()] = (rate, burst)
+    return budgets
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        """
+        :param rate: Tokens added per second. 0 means unlimited
+        :param burst: The maximum number of tokens that can be saved up
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token, blocking until one is available
+        """
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60.0):
+        """
+        Stops calls to a host after failure_threshold consecutive failures. After reset_timeout
+        seconds one trial call is let through; it closes the breaker again if it succeeds
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def check(self, host: str):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                raise CircuitOpenError(f"Too many failures from {host}. Paused for {self.reset_timeout:.0f}s")
+            # Half open: let this call through as the trial
+            self.opened_at = time.monotonic()
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class RateLimiter:
+    def __init__(self, budgets: dict[str, tuple[float, int]] = None, max_retries: int = 4, base_delay: float = 1.0,
+                 max_delay: float = 60.0, failure_threshold: int = 5, reset_timeout: float = 60.0, processes: int = 1):
+        """
+        Per-host token buckets with retries and circuit breakers, shared by every outbound call
+        :param budgets: A dict of host to (requests per second, burst). Unlisted hosts get DEFAULT_BUDGET
+        :param max_retries: How often a throttled or failed request is retried
+        :param base_delay: The first backoff delay in seconds, doubled on every retry
+        :param max_delay: The longest backoff (or Retry-After) delay honored, in seconds
+        :param failure_threshold: Consecutive failures before a host's breaker opens
+        :param reset_timeout: Seconds an open breaker waits before a trial call
+        :param processes: The number of processes crawling in parallel with the same budgets (e.g.
+                          channel workers). Each gets an equal share, so together they stay within them
+        """
+        self.budgets = dict(DEFAULT_BUDGETS)
+        self.budgets.update(budgets or {})
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.processes = max(1, processes)
+        self.buckets = {}
+        self.breakers = {}
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def _host_state(self, host: str) -> tuple[TokenBucket, CircuitBreaker]:
+        host = host.lower()
+        with self._lock:
+            if host not in self.buckets:
+                rate, burst = self.budgets.get(host, DEFAULT_BUDGET)
+                self.buckets[host] = TokenBucket(rate / self.processes, max(1, burst // self.processes))
+                self.breakers[host] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self.buckets[host], self.breakers[host]
+
+    def backoff_delay(self, attempt: int, retry_after: str = None) -> float:
+        """
+        How long to wait before retry number attempt. Retry-After wins when the server sent one,
+        otherwise exponential backoff with full jitter is used
+        :param attempt: The retry number, starting at 0
+        :param retry_after: The Retry-After header value, if any
+        """
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                except (TypeError, ValueError):
+                    delay = None
+            if delay is not None:
+                return min(self.max_delay, max(0.0, delay))
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    @contextmanager
+    def guard(self, host: str):
+        """
+        Wrap a network call that doesn't go through request() (e.g. yt_dlp or the browser):
+        waits for the host's budget and feeds the outcome to its circuit breaker
+        :param host: The host the call talks to
+        """
+        bucket, breaker = self._host_state(host)
+        breaker.check(host)
+        bucket.acquire()
+        try:
+            yield
+        except Exception:
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+
+    def request(self, method: str, url: str, session: requests.Session = None, cache: str = None, idempotent: bool = None,
+                **kwargs) -> requests.Response:
+        """
+        Send a request within the host's budget. 429 and 5xx responses and connection errors are
+        retried with backoff; after the last retry the final response is returned (or the error raised).
+        Requests that are not idempotent are only retried when the server can't have acted on them:
+        on 429 and when the connection could not be opened
+        :param method: The HTTP method
+        :param url: The URL
+        :param session: An optional session to send the request with
+        :param cache: The source name under which the response may be answered from and stored in the
+                      shared response cache (see http_cache). Not cached when None or the cache is off
+        :param idempotent: Whether the request may be sent twice. Defaults to what its method promises;
+                           pass True for a POST that only reads (e.g. a search)
+        :param kwargs: Passed on to requests
+        :raises CircuitOpenError: If the host's circuit breaker is open
+        :raises CacheMissError: If the cache is replaying and the request was never recorded
+        """
+        if cache is not None:
+            response_cache = get_shared_cache()
+            if response_cache.enabled:
+                return response_cache.fetch(cache, method, url,
+                                            lambda **send_kwargs: self._send(method, url, session, idempotent, **send_kwargs), **kwargs)
+        return self._send(method, url, session, idempotent, **kwargs)
+
+    def _send(self, method: str, url: str, session: requests.Session = None, idempotent: bool = None, **kwargs) -> requests.Response:
+        host = urlparse(url).hostname or ""
+        bucket, breaker = self._host_state(host)
+        http = session if session is not None else requests
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            breaker.check(host)
+            bucket.acquire()
+            try:
+                response = http.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                breaker.record_failure()
+                if attempt >= self.max_retries or not (idempotent or never_sent(e)):
+                    raise
+                time.sleep(self.backoff_delay(attempt))
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    breaker.record_success()
+                    return response
+                breaker.record_failure()
+                if attempt >= self.max_retries or not (idempotent or response.status_code in REJECTED_STATUSES):
+                    return response
+                time.sleep(self.backoff_delay(attempt, response.headers.get("Retry-After")))
+            attempt += 1
+            with self._lock:
+                self.retries += 1
+
+
+def never_sent(error: Exception) -> bool:
+    """
+    Whether a connection error happened before any of the request reached the server, so that
+    sending it again can't duplicate it
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = error.args[0] if error.args else None
+    # requests wraps urllib3's MaxRetryError, which carries the underlying error as its reason
+    reason = getattr(reason, "reason", reason)
+    return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+
+_shared_limiter = None
+_shared_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """
+    Get the process wide rate limiter. Budgets can be set with the RATE_LIMITS env variable
+    """
+    global _shared_limiter
+    with _shared_limiter_lock:
+        if _shared_limiter is None:
+            _shared_limiter = RateLimiter(parse_budgets(os.getenv("RATE_LIMITS")))
+        return _shared_limiter
+
+
+def share_budgets(processes: int):
+    """
+    Give this process an equal share of every host budget, for when several processes crawl in parallel
+    (e.g. channel workers). Replaces the process wide rate limiter
+    :param processes: The number of processes sharing the budgets
+    """
+    global _shared_limiter
+    with _shared_limiter_lock:
+        _shared_limiter = RateLimiter(parse_budgets(os.getenv("RATE_LIMITS")), processes=processes)
+
+
+def create_session(pool_size: int = 16) -> requests.Session:
+    """
+    Create a session whose connection pool can serve pool_size concurrent requests
+    :param pool_size: The maximum number of pooled connections per host
+    :return: A requests session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def request(method: str, url: str, session: requests.Session = None, cache: str = None, idempotent: bool = None,
+            **kwargs) -> requests.Response:
+    """
+    Send a request through the shared rate limiter. See RateLimiter.request
+    """
+    return get_rate_limiter().request(method, url, session=session, cache=cache, idempotent=idempotent, **kwargs)
@@ -0,0 +1,273 @@
+from collections import Counter
+import json
+import math
+import os
+import re
+import threading
+import time
+
+# Same notion of a word as the \b boundaries the REGEXP search used
+_TOKEN = re.compile(r"\w+")
+
+# BM25 parameters: term frequency saturation and document length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN.findall(text.lower())
+
+
+class RomanizedIndex:
+    def __init__(self, path: str = "cache/romanized_index.json", refresh_interval: float = 60.0, resync_interval: float = 3600.0):
+        """
+        An in-process inverted index of romanized titles. Every token maps to the videos whose title
+        contains it, so a multi-keyword search is an intersection of posting lists and the number of
+        matches is the size of the intersection. Titles are synced incrementally from the romanized
+        table and kept in a JSON file, so a restart only pulls new rows. The table has no updated-at
+        column, so edited and deleted rows are picked up by a full resync every resync_interval seconds
+        :param path: The path of the index file
+        :param refresh_interval: Minimum seconds between syncs triggered by searches
+        :param resync_interval: Seconds between full resyncs triggered by searches
+        """
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.resync_interval = resync_interval
+        self.state = {"romanized": 0}
+        # Table -> wall clock time of its last full sync. Saved with the titles
+        self.full_syncs = {}
+        self.titles = {}
+        self.lengths = {}
+        self.postings = {}
+        self.total_length = 0
+        # Table -> the video IDs in it, so a search can count only one table's videos. Not saved,
+        # the first sync of a table after a restart reads all of it
+        self.members = {}
+        self.member_state = {}
+        # Table -> monotonic time of its last full member sync
+        self.member_syncs = {}
+        # (table, "titles" or "members") -> monotonic time of its last sync
+        self.last_sync = {}
+        self.dirty = False
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            self.state.update(saved.get("state", {}))
+            self.full_syncs.update(saved.get("full_syncs", {}))
+            for video_id, title in saved.get("titles", {}).items():
+                self._add(video_id, title)
+            self.dirty = False
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+    def _remove(self, video_id: str):
+        title = self.titles.pop(video_id, None)
+        if title is None:
+            return
+        for token in set(tokenize(title)):
+            posting = self.postings[token]
+            del posting[video_id]
+            if not posting:
+                del self.postings[token]
+        self.total_length -= self.lengths.pop(video_id)
+
+    def _add(self, video_id: str, title: str):
+        # A re-romanized title replaces the old one
+        self._remove(video_id)
+        tokens = tokenize(title)
+        self.titles[video_id] = title
+        self.lengths[video_id] = len(tokens)
+        self.total_length += len(tokens)
+        for token, frequency in Counter(tokens).items():
+            self.postings.setdefault(token, {})[video_id] = frequency
+        self.dirty = True
+
+    def add(self, rows):
+        """
+        Index titles
+        :param rows: (video ID, romanized title) pairs
+        """
+        with self._lock:
+            for video_id, title in rows:
+                if video_id and title:
+                    self._add(video_id, title)
+
+    def save(self):
+        """
+        Write the titles and sync state to the index file. Posting lists are rebuilt when it is loaded
+        """
+        with self._lock:
+            if not self.dirty:
+                return
+            content = json.dumps({"state": self.state, "full_syncs": self.full_syncs, "titles": self.titles}, ensure_ascii=False)
+            self.dirty = False
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _read_rows(server, query: str, after: int, batch_size: int):
+        """
+        Read the rows of a table with an id above after, in id order
+        :param server: A SQLHandler
+        :param query: A SELECT without a WHERE clause, whose first column is the table's id
+        :param after: The id to read after. 0 reads the whole table
+        :param batch_size: The number of rows fetched per query
+        :return: The rows, or None if a query failed
+        """
+        rows = []
+        while True:
+            batch = server.get_query_result(f"{query} WHERE id > %s ORDER BY id LIMIT %s", (int(after), int(batch_size)))
+            if batch is None:
+                return None
+            rows.extend(batch)
+            if len(batch) < batch_size:
+                return rows
+            after = batch[-1][0]
+
+    def sync(self, server, table_name: str = "romanized", batch_size: int = 10000, full: bool = False) -> int:
+        """
+        Pull romanized titles added since the last sync. Only rows with an auto-increment id above
+        the last seen one are fetched, unless full is set
+        :param server: A SQLHandler
+        :param table_name: The table of romanized titles
+        :param batch_size: The number of rows fetched per query
+        :param full: Read the whole table, so edited titles are replaced and deleted ones removed
+        :return: The number of titles added, changed or removed
+        """
+        rows = self._read_rows(server, f"SELECT id, video_id, romanized_title FROM {table_name}",
+                               0 if full else self.state.get(table_name, 0), batch_size)
+        if rows is None:
+            return 0
+        changed = 0
+        with self._lock:
+            for _, video_id, title in rows:
+                if video_id and title and self.titles.get(video_id) != title:
+                    self._add(video_id, title)
+                    changed += 1
+            if full:
+                current = {video_id for _, video_id, title in rows if video_id and title}
+                for video_id in set(self.titles) - current:
+                    self._remove(video_id)
+                    self.dirty = True
+                    changed += 1
+                self.full_syncs[table_name] = time.time()
+                self.dirty = True
+            if rows:
+                self.state[table_name] = max(int(self.state.get(table_name, 0)), rows[-1][0])
+                self.dirty = True
+        self.last_sync[(table_name, "titles")] = time.monotonic()
+        self.save()
+        if changed:
+            print(f"[Romanized Index] Synced {changed} titles{' (full resync)' if full else ''}. {len(self)} indexed titles")
+        return changed
+
+    def sync_members(self, server, table_name: str, batch_size: int = 10000, full: bool = False) -> int:
+        """
+        Pull the video IDs of a table, so searches can be limited to it. Only rows with an id above the
+        last seen one are fetched, unless full is set or the table wasn't synced before
+        :param server: A SQLHandler
+        :param table_name: The table, e.g. songs
+        :param batch_size: The number of rows fetched per query
+        :param full: Read the whole table, so deleted rows are dropped
+        :return: The number of video IDs read
+        """
+        full = full or table_name not in self.members
+        rows = self._read_rows(server, f"SELECT id, video_id FROM {table_name}", 0 if full else self.member_state[table_name], batch_size)
+        if rows is None:
+            return 0
+        video_ids = {video_id for _, video_id in rows if video_id}
+        with self._lock:
+            if full:
+                self.members[table_name] = video_ids
+                self.member_state[table_name] = 0
+            else:
+                self.members[table_name] |= video_ids
+            if rows:
+                self.member_state[table_name] = max(self.member_state[table_name], rows[-1][0])
+        now = time.monotonic()
+        self.last_sync[(table_name, "members")] = now
+        if full:
+            self.member_syncs[table_name] = now
+        return len(video_ids)
+
+    def refresh(self, server, table_name: str = "romanized", members: str = None):
+        """
+        Sync unless the last sync was less than refresh_interval seconds ago. The sync is a full resync
+        when the last one is more than resync_interval seconds old
+        :param server: A SQLHandler
+        :param table_name: The table of romanized titles
+        :param members: A table whose video IDs are synced too, see sync_members
+        """
+        now = time.monotonic()
+        if now - self.last_sync.get((table_name, "titles"), -math.inf) >= self.refresh_interval:
+            self.sync(server, table_name, full=time.time() - self.full_syncs.get(table_name, 0) >= self.resync_interval)
+        if members and now - self.last_sync.get((members, "members"), -math.inf) >= self.refresh_interval:
+            self.sync_members(server, members, full=now - self.member_syncs.get(members, -math.inf) >= self.resync_interval)
+
+    def search(self, keywords: list, limit: int = None, offset: int = 0, table_name: str = None) -> tuple[list[str], int]:
+        """
+        Find videos whose romanized title contains every keyword as a whole word, best matches first.
+        Keywords of several words must appear as that phrase
+        :param keywords: The keywords
+        :param limit: The number of video IDs to return. None returns all of them
+        :param offset: The number of best matches to skip
+        :param table_name: Only match videos in this table, as synced by sync_members. A table that
+                           was never synced matches nothing
+        :return: The ranked video IDs and the number of matches
+        """
+        query_tokens = [tokenize(keyword) for keyword in keywords]
+        query_tokens = [tokens for tokens in query_tokens if tokens]
+        if not query_tokens:
+            return [], 0
+        unique_tokens = {token for tokens in query_tokens for token in tokens}
+        with self._lock:
+            postings = [self.postings.get(token) for token in unique_tokens]
+            if not all(postings):
+                return [], 0
+            # Intersect from the shortest posting list, so the candidates only shrink
+            postings.sort(key=len)
+            candidates = set(postings[0])
+            if table_name is not None:
+                candidates.intersection_update(self.members.get(table_name, ()))
+            for posting in postings[1:]:
+                if not candidates:
+                    return [], 0
+                candidates.intersection_update(posting)
+            phrases = [re.compile(r"\b" + r"\W+".join(map(re.escape, tokens)) + r"\b") for tokens in query_tokens if len(tokens) > 1]
+            if phrases:
+                candidates = {vid for vid in candidates if all(phrase.search(self.titles[vid].lower()) for phrase in phrases)}
+            ranked = sorted(candidates, key=lambda vid: (-self._bm25(vid, postings), vid))
+        end = None if limit is None else offset + limit
+        return ranked[offset:end], len(ranked)
+
+    def _bm25(self, video_id: str, postings: list[dict]) -> float:
+        documents = len(self.titles)
+        average_length = self.total_length / documents if documents else 1
+        length_norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[video_id] / (average_length or 1))
+        score = 0.0
+        for posting in postings:
+            frequency = posting[video_id]
+            idf = math.log(1 + (documents - len(posting) + 0.5) / (len(posting) + 0.5))
+            score += idf * frequency * (BM25_K1 + 1) / (frequency + length_norm)
+        return score
+
+
+_shared_index = None
+_shared_index_lock = threading.Lock()
+
+
+def get_shared_romanized_index(path: str = None) -> RomanizedIndex:
+    """
+    Get the process wide romanized title index, loading it on first use
+    :param path: The index file path. Defaults to the ROMANIZED_INDEX env variable or cache/romanized_index.json
+    """
+    global _shared_index
+    with _shared_index_lock:
+        if _shared_index is None:
+            _shared_index = RomanizedIndex(path or os.getenv("ROMANIZED_INDEX") or "cache/romanized_index.json")
+        return _shared_index
@@ -0,0 +1,107 @@
+from crawl_state import CrawlState
+import time
+
+DAY = 86400.0
+# Bounds of the recrawl interval. Busy channels are checked at most every MIN_INTERVAL, dormant ones
+# at least every MAX_INTERVAL
+MIN_INTERVAL = 6 * 3600.0
+MAX_INTERVAL = 30 * DAY
+# Interval of a channel crawled once, before an incremental crawl has measured its upload rate
+BASELINE_INTERVAL = DAY
+# Assumed crawl duration of a channel that was never crawled, in seconds
+DEFAULT_CRAWL_SECONDS = 20.0
+# New channels go first; among crawled channels, ones that never yielded anything get this share
+# of the priority of a channel with the same upload rate that did
+NO_YIELD_WEIGHT = 0.25
+
+
+class CrawlScheduler:
+    def __init__(self, state: CrawlState):
+        """
+        Decides which channels are worth crawling in a run, from the activity CrawlState.record_crawl
+        keeps per channel. A channel is due once its recrawl interval (about the time between two
+        uploads, within MIN_INTERVAL and MAX_INTERVAL) has passed since its last crawl. Due channels are
+        ordered by expected new valid videos per second of crawling
+        :param state: The crawl state store
+        """
+        self.state = state
+        self.activity = state.get_activity()
+
+    @staticmethod
+    def interval(activity: tuple) -> float:
+        """
+        The recrawl interval of a channel in seconds
+        :param activity: The channel's (upload rate, yield rate, last crawled, last yield, average duration, crawls)
+        """
+        upload_rate = activity[0]
+        if upload_rate is None:
+            return BASELINE_INTERVAL
+        if upload_rate <= 0:
+            return MAX_INTERVAL
+        return min(MAX_INTERVAL, max(MIN_INTERVAL, DAY / upload_rate))
+
+    def priority(self, channel_id: str, now: float = None) -> tuple[bool, float]:
+        """
+        Whether a channel is due and how valuable crawling it is
+        :return: (due, expected new valid videos per second of crawling). Channels never crawled are
+                 always due with an infinite priority
+        """
+        activity = self.activity.get(channel_id)
+        if activity is None:
+            return True, float("inf")
+        upload_rate, yield_rate, last_crawled, last_yield, avg_duration, _ = activity
+        now = now or time.time()
+        elapsed = now - last_crawled
+        due = elapsed >= self.interval(activity)
+        if upload_rate is None:
+            # Not measured yet: worth about one upload per baseline interval
+            expected = elapsed / BASELINE_INTERVAL
+        elif yield_rate:
+            expected = yield_rate * elapsed / DAY
+        else:
+            expected = NO_YIELD_WEIGHT * upload_rate * elapsed / DAY
+        return due, expected / max(avg_duration, 1.0)
+
+    def estimated_duration(self, channel_id: str) -> float:
+        activity = self.activity.get(channel_id)
+        return activity[4] if activity is not None else DEFAULT_CRAWL_SECONDS
+
+    def plan(self, channel_ids, time_budget: float = None, max_channels: int = None, workers: int = 1,
+             include_not_due: bool = False, now: float = None) -> list[str]:
+        """
+        Build the work queue of a run: the due channels, highest priority first, as many as fit in the
+        budget by their estimated crawl time
+        :param channel_ids: The candidate channel IDs
+        :param time_budget: Seconds of crawling available for the run. None for no limit
+        :param max_channels: The most channels to crawl. None for no limit
+        :param workers: The number of channels crawled in parallel, to spread the time budget over
+        :param include_not_due: Also queue channels that aren't due yet (after the due ones)
+        :param now: The time to plan for. Defaults to now
+        :return: The channel IDs to crawl, in order
+        """
+        now = now or time.time()
+        ranked = []
+        not_due = 0
+        for position, channel_id in enumerate(channel_ids):
+            due, value = self.priority(channel_id, now)
+            if not due and not include_not_due:
+                not_due += 1
+                continue
+            # Due channels first, then by value; list order breaks ties (e.g. among new channels)
+            ranked.append((not due, -value, position, channel_id))
+        ranked.sort()
+        queue = []
+        budget = time_budget * max(workers, 1) if time_budget is not None else None
+        spent = 0.0
+        for _, _, _, channel_id in ranked:
+            if max_channels is not None and len(queue) >= max_channels:
+                break
+            cost = self.estimated_duration(channel_id)
+            if budget is not None and spent + cost > budget:
+                # Cheaper channels further down may still fit
+                continue
+            spent += cost
+            queue.append(channel_id)
+        print(f"[Scheduler] Queued {len(queue)} of {len(ranked)} due channels ({not_due} not due yet), "
+              f"about {spent / max(workers, 1) / 60:.1f} minutes of crawling")
+        return queue
@@ -1,17 +1,65 @@
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options as ChromeOptions
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import TimeoutException
 from selenium import webdriver
+from contextlib import contextmanager
+from rate_limit import get_rate_limiter
+from http_cache import CacheMissError, get_shared_cache
+from urllib.parse import urlparse
+import os
+import queue
+import threading
 import time
 
 
+class PageLoadError(Exception):
+    """Raised when a page couldn't be loaded or never became ready"""
+
+
+def default_chrome_driver_path() -> str:
+    """
+    The ChromeDriver path from the CHROME_DRIVER_PATH env variable, or the usual system location
+    """
+    chrome_driver_path = os.getenv("CHROME_DRIVER_PATH")
+    if chrome_driver_path is None:
+        chrome_driver_path = "/usr/bin/chromedriver"
+    return chrome_driver_path
+
+
+def summarize_load_times(load_times: list[float], timeouts: int = 0) -> dict:
+    """
+    Summarize page load times
+    :param load_times: The load times in seconds
+    :param timeouts: The number of loads whose ready condition timed out
+    :return: A dict with the count, mean, p50, p95 and max load time and the timeout count
+    """
+    if not load_times:
+        return {"pages": 0, "mean": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0, "timeouts": timeouts}
+    ordered = sorted(load_times)
+    return {
+        "pages": len(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "p50": ordered[len(ordered) // 2],
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "max": ordered[-1],
+        "timeouts": timeouts
+    }
+
+
 class SiteScraper:
     def __init__(self, chrome_driver_path: str, headless: bool = False, wait_time = 5):
         """
         Initialize the SiteScraper with the path to ChromeDriver
         :param chrome_driver_path: Path to the ChromeDriver executable
         :param headless: Run the browser in headless mode if True
+        :param wait_time: The maximum time to wait for a page to become ready
         """
         self.wait_time = wait_time
+        self.load_times = []
+        self.timeouts = 0
         try:
             self.service = Service(chrome_driver_path)
             self.chrome_options = ChromeOptions()
@@ -31,20 +79,70 @@ class SiteScraper:
             print(f"An unknown error occurred: {e}")
             quit()
 
-    def get_page_source(self, url) -> str:
+    def _wait_until_ready(self, ready_selector: str = None) -> bool:
+        """
+        Wait until ready_selector matches an element, or until the document has finished
+        loading when no selector is given. Gives up after wait_time seconds
+        :return: False if the wait timed out
+        """
+        if self.wait_time <= 0:
+            return True
+        if ready_selector is not None:
+            condition = expected_conditions.presence_of_element_located((By.CSS_SELECTOR, ready_selector))
+        else:
+            condition = lambda driver: driver.execute_script("return document.readyState") == "complete"
+        try:
+            WebDriverWait(self.driver, self.wait_time, poll_frequency=0.1).until(condition)
+        except TimeoutException:
+            return False
+        return True
+
+    def get_page_source(self, url, ready_selector: str = None) -> str:
         """
         Get the page source of the given URL
         :param url: The URL of the page to scrape
-        :param wait_time: The time to wait for the page to load (for JavaScript)
+        :param ready_selector: A CSS selector that only matches once the content we want has rendered (for JavaScript)
+        :return: The page source. Empty if the page couldn't be loaded, partial if it never became ready
+        """
+        return self.load_page(url, ready_selector)[0]
+
+    def load_page(self, url, ready_selector: str = None) -> tuple[str, bool]:
+        """
+        Same as get_page_source, and also tell whether the page became ready
+        :return: The page source and whether it became ready. A page that couldn't be loaded is ("", False)
         """
+        cache = get_shared_cache()
+        if cache.enabled:
+            try:
+                cached = cache.get_value("browser", url)
+            except CacheMissError as e:
+                print(f"An error occurred while trying to get the page source: {e}")
+                return "", False
+            if cached is not None:
+                return cached, True
+        start = time.perf_counter()
         try:
-            self.driver.get(url)
+            with get_rate_limiter().guard(urlparse(url).hostname or ""):
+                self.driver.get(url)
         except Exception as e:
             print(f"An error occurred while trying to get the page source: {e}")
-            return ""
-        if self.wait_time > 0:
-            time.sleep(self.wait_time)
-        return self.driver.page_source
+            return "", False
+        ready = self._wait_until_ready(ready_selector)
+        if not ready:
+            self.timeouts += 1
+            print(f"Timed out after {self.wait_time}s waiting for {url} to be ready")
+        self.load_times.append(time.perf_counter() - start)
+        source = self.driver.page_source
+        # A page that never became ready is fetched again next time
+        if ready and cache.enabled:
+            cache.put_value("browser", url, source)
+        return source, ready
+
+    def load_stats(self) -> dict:
+        """
+        Statistics over the page loads done by this scraper
+        """
+        return summarize_load_times(self.load_times, self.timeouts)
 
     def close(self):
         """
@@ -53,3 +151,59 @@ class SiteScraper:
         self.driver.quit()
         self.service.stop()
         print("WebDriver closed successfully")
+
+
+class ScraperPool:
+    def __init__(self, chrome_driver_path: str = None, size: int = 1, headless: bool = True, wait_time = 5):
+        """
+        A pool of long-lived SiteScrapers shared across pages, channels and crawl modes.
+        Browsers are started lazily, up to size of them
+        :param chrome_driver_path: Path to the ChromeDriver executable. Defaults to default_chrome_driver_path()
+        :param size: The maximum number of browsers
+        :param headless: Run the browsers in headless mode if True
+        :param wait_time: The maximum time to wait for a page to become ready
+        """
+        self.chrome_driver_path = chrome_driver_path or default_chrome_driver_path()
+        self.size = max(1, size)
+        self.headless = headless
+        self.wait_time = wait_time
+        self.scrapers = []
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def acquire(self):
+        """
+        Borrow a scraper for the duration of a with block. Blocks while every browser is busy
+        """
+        scraper = None
+        try:
+            scraper = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                if len(self.scrapers) < self.size:
+                    scraper = SiteScraper(chrome_driver_path=self.chrome_driver_path, headless=self.headless, wait_time=self.wait_time)
+                    self.scrapers.append(scraper)
+            if scraper is None:
+                scraper = self._idle.get()
+        try:
+            yield scraper
+        finally:
+            self._idle.put(scraper)
+
+    def load_stats(self) -> dict:
+        """
+        Statistics over the page loads done by every browser in the pool
+        """
+        load_times = [load for scraper in self.scrapers for load in scraper.load_times]
+        return summarize_load_times(load_times, sum(scraper.timeouts for scraper in self.scrapers))
+
+    def close(self):
+        """
+        Close every browser in the pool
+        """
+        with self._lock:
+            for scraper in self.scrapers:
+                scraper.close()
+            self.scrapers = []
+            self._idle = queue.LifoQueue()
@@ -1,55 +1,320 @@
 import re
-from bs4 import BeautifulSoup
-from site_scraper import SiteScraper
+import json
+from html.parser import HTMLParser
+from title_classifier import TitleScore, get_shared_classifier
 
-music_keywords = [
-    "cover", "original", "mv", "歌ってみた", "covered by", "official", "オリジナル曲"
-]
+# Video IDs are 11 characters of [A-Za-z0-9_-]
+_HOLODEX_WATCH_LINK = re.compile(r'href="/watch/([\w-]+)"')
+_YT_WATCH_ID = re.compile(r'/watch\?v=([\w-]+)')
 
-def find_all_yt_video_ids_hldex(source: str) -> list[str]:
+def find_all_yt_video_ids_hldex(source: str, known_ids=None) -> list[str]:
     """
     Find all YouTube video IDs in the given source
     :param source: The page source to search for video IDs
+    :param known_ids: Optional container (e.g. an ArchivedIdIndex) of IDs to leave out
     :return: A list of video IDs
     """
-    return list(set(re.findall(r'href="/watch/(\w+)"', source)))
+    video_ids = set(_HOLODEX_WATCH_LINK.findall(source))
+    if known_ids is not None:
+        video_ids = {vid for vid in video_ids if vid not in known_ids}
+    return list(video_ids)
 
 
-def find_all_yt_videos_yt(source: str) -> list[str, str]:
+class _YtGridExtractor(HTMLParser):
+    def __init__(self, h3_class: str, link_id: str, renderer_name: str):
+        """
+        Streaming extractor for the video links of a rendered YouTube channel or playlist page.
+        Collects the title link of every h3 with class h3_class and the length label of the
+        renderer_name item around it, without building a document tree
+        :param h3_class: The exact class attribute of the title h3
+        :param link_id: The id of the title link inside the h3
+        :param renderer_name: The tag name of the video item (e.g. ytd-rich-grid-media)
+        """
+        super().__init__(convert_charrefs=True)
+        self.h3_class = h3_class
+        self.link_id = link_id
+        self.renderer_name = renderer_name
+        # [href, title, item] per title link in page order. item is shared by the links of one
+        # video item and receives its duration once the item has been read completely
+        self.links = []
+        self._item = None
+        self._item_depth = 0
+        self._overlay_depth = 0
+        self._overlay_text = []
+        self._h3_depth = 0
+        self._h3_linked = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == self.renderer_name:
+            if self._item_depth == 0:
+                self._item = {"duration": None, "overlay_seen": False}
+            self._item_depth += 1
+        elif tag == "ytd-thumbnail-overlay-time-status-renderer":
+            if self._overlay_depth or (self._item is not None and not self._item["overlay_seen"]):
+                self._overlay_depth += 1
+        elif tag == "h3":
+            if self._h3_depth:
+                self._h3_depth += 1
+            elif dict(attrs).get("class") == self.h3_class:
+                self._h3_depth = 1
+                self._h3_linked = False
+        elif tag == "a" and self._h3_depth and not self._h3_linked:
+            attrs = dict(attrs)
+            if attrs.get("id") == self.link_id:
+                self._h3_linked = True
+                self.links.append([attrs.get("href"), attrs.get("title"), self._item])
+
+    def handle_endtag(self, tag):
+        if tag == self.renderer_name and self._item_depth:
+            self._item_depth -= 1
+            if self._item_depth == 0:
+                self._item = None
+        elif tag == "ytd-thumbnail-overlay-time-status-renderer" and self._overlay_depth:
+            self._overlay_depth -= 1
+            if self._overlay_depth == 0 and self._item is not None:
+                self._item["overlay_seen"] = True
+                self._item["duration"] = parse_yt_duration("".join(self._overlay_text))
+            if self._overlay_depth == 0:
+                self._overlay_text = []
+        elif tag == "h3" and self._h3_depth:
+            self._h3_depth -= 1
+
+    def handle_data(self, data):
+        if self._overlay_depth:
+            data = data.strip()
+            if data:
+                self._overlay_text.append(data)
+
+    def extract(self, source: str) -> list[tuple[str, str, int]]:
+        """
+        Feed a whole page source
+        :return: (href, title, duration in seconds or None) per title link, in page order
+        """
+        # Only the video items are tokenized; the rest of the page (mostly inline script) is skipped
+        open_tag, close_tag = "<" + self.renderer_name, "</" + self.renderer_name + ">"
+        pos = source.find(open_tag)
+        while pos != -1:
+            after = source[pos + len(open_tag):pos + len(open_tag) + 1]
+            end = source.find(close_tag, pos)
+            if not after or after not in " \t\r\n/>" or end == -1:
+                pos = source.find(open_tag, pos + 1)
+                continue
+            self.feed(source[pos:end + len(close_tag)])
+            pos = source.find(open_tag, end + len(close_tag))
+        self.close()
+        return [(href, title, item["duration"] if item else None) for href, title, item in self.links]
+
+def find_all_yt_videos_yt(source: str, known_ids=None) -> list[tuple[str, str, int]]:
     """
     Find all YouTube video IDs in the given source and their titles
     :param source: The page source to search for video IDs
-    :return: A list of video IDs
+    :param known_ids: Optional container (e.g. an ArchivedIdIndex) of IDs to leave out
+    :return: A list of (video ID, title, duration in seconds or None) tuples
     """
-    soup = BeautifulSoup(source, "html.parser")
-    videos = set()
-    for h3_tag in soup.find_all('h3', class_='style-scope ytd-rich-grid-media'):
-        a_tag = h3_tag.find('a', id='video-title-link')
-        if a_tag:
-            href = a_tag.get('href')
-            title = a_tag.get('title')
-            if href and title:
-                video_id = re.search(r'/watch\?v=(\w+)', href)
-                # check if video_id is valid youtube video id and not already in video_ids set
-                if video_id:
-                    videos.add((video_id.group(1), title))
+    if "ytd-rich-grid-media" not in source:
+        return []
+    extractor = _YtGridExtractor("style-scope ytd-rich-grid-media", "video-title-link", "ytd-rich-grid-media")
+    # A dict keeps the page order (newest first) while deduplicating
+    videos = {}
+    for href, title, duration in extractor.extract(source):
+        if href and title:
+            video_id = _YT_WATCH_ID.search(href)
+            # check if video_id is valid youtube video id and not already in video_ids set
+            if video_id and (known_ids is None or video_id.group(1) not in known_ids):
+                videos.setdefault((video_id.group(1), title, duration))
     return list(videos)
 
-def find_all_videos_yt_playlist(source: str) -> list[str, str]:
-    soup = BeautifulSoup(source, "html.parser")
-    videos = set()
-    for h3_tag in soup.find_all('h3', class_='style-scope ytd-playlist-video-renderer'):
-        a_tag = h3_tag.find('a', id='video-title')
-        if a_tag:
-            href = a_tag.get('href')
-            title = a_tag.get('title')
-            if href and title:
-                video_id = href.split('&')[0].replace("/watch?v=", "")
-                print(video_id, title)
-                videos.add((video_id, title))
+def find_all_videos_yt_playlist(source: str, known_ids=None) -> list[tuple[str, str, int]]:
+    """
+    Find all video IDs and titles in a YouTube playlist page source
+    :param source: The page source of the playlist
+    :param known_ids: Optional container (e.g. an ArchivedIdIndex) of IDs to leave out
+    :return: A list of (video ID, title, duration in seconds or None) tuples
+    """
+    if "ytd-playlist-video-renderer" not in source:
+        return []
+    extractor = _YtGridExtractor("style-scope ytd-playlist-video-renderer", "video-title", "ytd-playlist-video-renderer")
+    videos = {}
+    for href, title, duration in extractor.extract(source):
+        if href and title:
+            video_id = href.split('&')[0].replace("/watch?v=", "")
+            if known_ids is not None and video_id in known_ids:
+                continue
+            print(video_id, title)
+            videos.setdefault((video_id, title, duration))
     return list(videos)
 
 
+def _decode_js_object(source: str, start: int):
+    """
+    Decode the JSON object literal that begins at or after start
+    :return: The decoded object, or None if there is none
+    """
+    start = source.find("{", start)
+    if start == -1:
+        return None
+    try:
+        return json.JSONDecoder().raw_decode(source, start)[0]
+    except ValueError:
+        return None
+
+
+def extract_yt_initial_data(source: str) -> dict:
+    """
+    Extract the ytInitialData JSON that YouTube embeds in channel and playlist pages
+    :param source: The page source
+    :return: The decoded data, or None if the page has none
+    """
+    for marker in ("var ytInitialData = ", 'window["ytInitialData"] = ', "ytInitialData = "):
+        pos = source.find(marker)
+        if pos != -1:
+            return _decode_js_object(source, pos + len(marker))
+    return None
+
+
+def extract_yt_config(source: str) -> dict:
+    """
+    Extract the merged ytcfg.set({...}) values (API key, client context) from a YouTube page
+    :param source: The page source
+    :return: The merged config values
+    """
+    config = {}
+    pos = source.find("ytcfg.set({")
+    while pos != -1:
+        values = _decode_js_object(source, pos)
+        if isinstance(values, dict):
+            config.update(values)
+        pos = source.find("ytcfg.set({", pos + 1)
+    return config
+
+
+def parse_yt_duration(text) -> int:
+    """
+    Convert a YouTube length label such as "3:45" or "1:02:03" to seconds
+    :param text: The label, or a number of seconds as a string
+    :return: The duration in seconds, or None if it can't be parsed (e.g. "LIVE", "SHORTS")
+    """
+    if text is None:
+        return None
+    text = str(text).strip()
+    if text.isdigit():
+        return int(text)
+    if not re.fullmatch(r"\d+(:\d{1,2}){1,2}", text):
+        return None
+    seconds = 0
+    for part in text.split(":"):
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
+def _yt_text(value) -> str:
+    if not isinstance(value, dict):
+        return None
+    if "simpleText" in value:
+        return value["simpleText"]
+    if "runs" in value:
+        return "".join(run.get("text", "") for run in value["runs"])
+    if "content" in value:
+        return value["content"]
+    return None
+
+
+def _parse_video_renderer(renderer: dict) -> tuple[str, str, int]:
+    video_id = renderer.get("videoId")
+    title = _yt_text(renderer.get("title"))
+    duration = parse_yt_duration(renderer.get("lengthSeconds"))
+    if duration is None:
+        duration = parse_yt_duration(_yt_text(renderer.get("lengthText")))
+    if duration is None:
+        for overlay in renderer.get("thumbnailOverlays", []):
+            label = _yt_text(overlay.get("thumbnailOverlayTimeStatusRenderer", {}).get("text"))
+            if label:
+                duration = parse_yt_duration(label)
+                break
+    return video_id, title, duration
+
+
+def _parse_lockup_view_model(model: dict) -> tuple[str, str, int]:
+    if model.get("contentType") not in (None, "LOCKUP_CONTENT_TYPE_VIDEO"):
+        return None, None, None
+    video_id = model.get("contentId")
+    title = _yt_text(model.get("metadata", {}).get("lockupMetadataViewModel", {}).get("title"))
+    duration = None
+    overlays = model.get("contentImage", {}).get("thumbnailViewModel", {}).get("overlays", [])
+    for overlay in overlays:
+        for badge in overlay.get("thumbnailOverlayBadgeViewModel", {}).get("thumbnailBadges", []):
+            duration = parse_yt_duration(badge.get("thumbnailBadgeViewModel", {}).get("text"))
+            if duration is not None:
+                break
+    return video_id, title, duration
+
+
+# Renderers that describe a single video in channel, playlist and continuation JSON
+_YT_VIDEO_RENDERERS = {
+    "videoRenderer": _parse_video_renderer,
+    "gridVideoRenderer": _parse_video_renderer,
+    "playlistVideoRenderer": _parse_video_renderer,
+    "lockupViewModel": _parse_lockup_view_model,
+}
+
+
+def iter_yt_listing_videos(data, known_ids=None):
+    """
+    Walk ytInitialData or a continuation response and yield its videos in page order
+    :param data: The decoded JSON
+    :param known_ids: Optional container (e.g. an ArchivedIdIndex) of IDs to leave out
+    :return: A generator of (video ID, title, duration in seconds or None) tuples
+    """
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(reversed(node))
+            continue
+        if not isinstance(node, dict):
+            continue
+        for key, value in node.items():
+            if key in _YT_VIDEO_RENDERERS and isinstance(value, dict):
+                video_id, title, duration = _YT_VIDEO_RENDERERS[key](value)
+                if video_id and title and (known_ids is None or video_id not in known_ids):
+                    yield video_id, title, duration
+        stack.extend(reversed([value for key, value in node.items()
+                               if key not in _YT_VIDEO_RENDERERS and isinstance(value, (dict, list))]))
+
+
+def find_yt_continuation_token(data) -> str:
+    """
+    Find the token that loads the next batch of a channel or playlist listing
+    :param data: ytInitialData or a continuation response
+    :return: The token, or None if the listing is complete
+    """
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, dict):
+            renderer = node.get("continuationItemRenderer")
+            if isinstance(renderer, dict):
+                token = renderer.get("continuationEndpoint", {}).get("continuationCommand", {}).get("token")
+                if token:
+                    return token
+            stack.extend(value for value in node.values() if isinstance(value, (dict, list)))
+    return None
+
+
+def find_yt_length_seconds(source: str) -> int:
+    """
+    Find a video's length in the player response embedded in its watch page
+    :param source: The watch page source
+    :return: The duration in seconds, or None if the page has none
+    """
+    match = re.search(r'"lengthSeconds"\s*:\s*"(\d+)"', source)
+    if match:
+        return int(match.group(1))
+    return None
+
+
 def parse_title_yt_video(source: str) -> str:
     """
     Parse the title of a YouTube video
@@ -60,12 +325,24 @@ def parse_title_yt_video(source: str) -> str:
     title = title.replace(" - YouTube", "")
     return title
 
+def _music_verdict(result: TitleScore) -> tuple[bool, str]:
+    if result.is_music:
+        return True, "Valid music content"
+    if result.negatives:
+        return False, "Non-music keywords found"
+    return False, "No music keywords found"
+
 def is_potentially_music_content(title: str)-> tuple[bool, str]:
     """
     Given a title, determine if the content is music or not
     """
-    # Stage 1: Preliminary Keyword Checks
-    title = title.lower()
-    if not any(keyword in title for keyword in music_keywords):
-        return False, "No music keywords found"
-    return True, "Valid music content"
+    return _music_verdict(get_shared_classifier().score(title))
+
+def classify_music_titles(titles: list[str]) -> list[tuple[bool, str]]:
+    """
+    is_potentially_music_content for many titles at once (e.g. a channel's listing)
+    :param titles: The titles
+    :return: One (is music, reason) tuple per title, in order
+    """
+    score = get_shared_classifier().score
+    return [_music_verdict(score(title)) for title in titles]
@@ -1,6 +1,13 @@
-import mysql.connector
 from mysql.connector import Error, errorcode
+from contextlib import contextmanager
+from db_backends import DatabaseConnectionError, get_backend
+from metrics import get_shared_metrics
+from romanized_index import get_shared_romanized_index
+import atexit
+import random
+import re
 import sshtunnel
+import threading
 import os
 import dotenv
 
@@ -9,45 +16,153 @@ sshtunnel.TUNNEL_TIMEOUT = 5.0
 
 dotenv.load_dotenv()
 
+# Rounds of random key draws get_random_row makes before falling back to sorting the table
+RANDOM_SAMPLE_ROUNDS = 4
+# The most keys looked up with one IN (...) query while sampling
+RANDOM_SAMPLE_MAX_DRAW = 5000
+
+# MySQL's ngram_token_size. Shorter keywords can't be looked up in an ngram FULLTEXT index
+NGRAM_TOKEN_SIZE = int(os.getenv("NGRAM_TOKEN_SIZE") or 2)
+
+# Table and column names can't be bound as parameters, so they are checked before going into SQL
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)?$")
+
+_shared_handler = None
+_shared_handler_lock = threading.Lock()
+
+
+def get_shared_handler(pool_size: int = 5) -> "SQLHandler":
+    """
+    Get the process wide pooled SQLHandler, creating it on first use.
+    It is closed automatically when the process exits
+    :param pool_size: The number of pooled connections, only used when the handler is created
+    """
+    global _shared_handler
+    with _shared_handler_lock:
+        if _shared_handler is None:
+            _shared_handler = SQLHandler(pool_size=pool_size)
+            atexit.register(_shared_handler.close_connection)
+        return _shared_handler
+
+
+def _identifier(name: str) -> str:
+    """
+    Check that a table or column name is a plain identifier
+    :raises Error: If it isn't, so it is handled like any other failed query
+    """
+    if not _IDENTIFIER.match(name or ""):
+        raise Error(msg=f"Invalid SQL identifier {name!r}")
+    return name
+
+
+def _column_list(columns: str) -> str:
+    return ", ".join(_identifier(column.strip()) for column in columns.split(","))
+
+
+def _existing_values_query(table_name: str, column_name: str, count: int) -> str:
+    table_name, column_name = _identifier(table_name), _identifier(column_name)
+    placeholders = ', '.join(['%s'] * count)
+    return f"SELECT {column_name} FROM {table_name} WHERE {column_name} IN ({placeholders})"
+
+
+def _enqueue_chunks(video_ids: list[str], chunk_size: int) -> list[list[str]]:
+    """
+    Drop duplicate video IDs, keeping their order, and split them into chunks for bulk_enqueue
+    """
+    video_ids = list(dict.fromkeys(video_ids))
+    return [video_ids[i:i + chunk_size] for i in range(0, len(video_ids), chunk_size)]
+
+
+def _new_enqueue_ids(chunk: list[str], archived: set[str], queued_urls: set[str], prepend_url: str, outcomes: dict) -> list[str]:
+    """
+    Record the outcome of the videos of a chunk that are already archived or queued
+    :return: The video IDs to insert into the queue
+    """
+    new_ids = []
+    for vid in chunk:
+        if vid in archived:
+            outcomes[vid] = "archived"
+        elif prepend_url + vid in queued_urls:
+            outcomes[vid] = "queued"
+        else:
+            new_ids.append(vid)
+    return new_ids
+
+
+def _queue_insert_query(queue_table: str) -> str:
+    return f"INSERT INTO {_identifier(queue_table)} (url, mode) VALUES (%s, %s)"
+
+
 class SQLHandler:
-    def __init__(self):
+    def __init__(self, pool_size: int = 0, backend=None):
+        """
+        :param pool_size: Keep a pool of this many connections for thread safe batch calls. 0 uses a single connection
+        :param backend: A MySQLBackend or SQLiteBackend. Defaults to the one selected by DB_ENGINE
+        :raises DatabaseConnectionError: If the database can't be reached
+        """
+        self.backend = backend or get_backend()
+        self.engine = self.backend.name
+        self.pool = None
+        # SQLite has a single connection, so pooled callers take turns on it
+        self._shared_lock = threading.Lock()
+        # (table, column) -> whether it has a FULLTEXT index
+        self._fulltext_columns = {}
+        if pool_size > 0:
+            self.pool = self._create_connection_pool(pool_size)
         self.connection = self._create_server_connection()
-        self._load_database(os.environ.get("DB_DATABASE").strip())
-    
-    def _create_server_connection(self) -> mysql.connector:
-        connection = None
-        try:
-            connection = mysql.connector.connect(
-            host=os.environ.get("DB_HOST"),
-            database=os.environ.get("DB_DATABASE"),
-            user=os.environ.get("DB_USERNAME"),
-            password=os.environ.get("DB_PASSWORD"),
-            use_pure=True
-            )
-        except Error as err:
-            print(f"Error: '{err}'")
-        if connection is None:
-            print("Connection failed")
-            exit(1)
-        return connection
+        self._load_database((os.environ.get("DB_DATABASE") or "").strip())
+
+    def _create_connection_pool(self, pool_size: int):
+        try:
+            return self.backend.create_pool(pool_size, f"patchwork_{id(self)}")
+        except Error as err:
+            raise DatabaseConnectionError(msg=f"Connection failed: {err}")
+
+    def _create_server_connection(self):
+        try:
+            if self.pool is not None:
+                return self.pool.get_connection()
+            return self.backend.connect()
+        except DatabaseConnectionError:
+            raise
+        except Error as err:
+            raise DatabaseConnectionError(msg=f"Connection failed: {err}")
+
+    @contextmanager
+    def pooled_connection(self):
+        """
+        Borrow a connection for the duration of a with block. Falls back to the handler's own
+        connection when no pool was configured
+        """
+        if self.backend.shared_connection:
+            with self._shared_lock:
+                yield self.connection
+            return
+        if self.pool is None:
+            yield self.connection
+            return
+        connection = self.pool.get_connection()
+        try:
+            yield connection
+        finally:
+            # Returns the connection to the pool
+            connection.close()
 
     def get_connection(self):
         return self.connection
 
-    def _create_database(self, cursor: str, database_name: str):
+    def _create_database(self, cursor, database_name: str):
         try:
             cursor.execute(
-                f"CREATE DATABASE {database_name} DEFAULT CHARACTER SET 'utf8'")
+                f"CREATE DATABASE {_identifier(database_name)} DEFAULT CHARACTER SET 'utf8'")
         except Error as err:
-            print(f"Failed creating database: {err}")
-            exit(1)
+            raise DatabaseConnectionError(msg=f"Failed creating database: {err}")
 
     def _load_database(self, database_name: str):
         try:
             cursor = self.connection.cursor(buffered=True)
         except Error as err:
-            print(f"Failed to load database: {err}")
-            exit(1)
+            raise DatabaseConnectionError(msg=f"Failed to load database: {err}")
         try:
             print(f"Database {database_name} loaded successfully")
         except Error as err:
@@ -57,8 +172,7 @@ class SQLHandler:
                 print(f"Database {database_name} created successfully")
                 self.connection.database = database_name
             else:
-                print(err)
-                exit(1)
+                raise DatabaseConnectionError(msg=str(err))
 
     def create_table(self, name: str, column: str):
         cursor = self.connection.cursor(buffered=True)
@@ -69,32 +183,90 @@ class SQLHandler:
             print(err)
 
     def insert_row(self, table_name: str, column: str, data: tuple):
-        cursor = self.connection.cursor(buffered=True)
+        cursor = self.connection.cursor(prepared=True)
         try:
             placeholders = ', '.join(['%s'] * len(data))
-            query = f"INSERT INTO {table_name} ({column}) VALUES ({placeholders})"
-            cursor.execute(query, data)
+            query = f"INSERT INTO {_identifier(table_name)} ({_column_list(column)}) VALUES ({placeholders})"
+            cursor.execute(query, tuple(data))
             self.connection.commit()
             print("Data Inserted:", data)
         except Error as err:
             print("Error inserting data")
             print(err)
-            if err not in ("Duplicate entry", "Duplicate entry for key 'PRIMARY'"):
+            # A row that is already there counts as inserted
+            if err.errno != errorcode.ER_DUP_ENTRY:
                 return False
+        finally:
+            cursor.close()
         return True
 
+    def find_existing_values(self, table_name: str, column_name: str, values: list[str], connection=None) -> set[str]:
+        """
+        Find which of the given values already exist in a column, using a single IN (...) query
+        :param table_name: The table to search
+        :param column_name: The column to match against
+        :param values: The values to look for
+        :param connection: The connection to use. Defaults to the handler's own connection
+        :return: The subset of values that exist
+        """
+        if not values:
+            return set()
+        connection = connection if connection is not None else self.connection
+        query = _existing_values_query(table_name, column_name, len(values))
+        cursor = connection.cursor(buffered=True)
+        cursor.execute(query, tuple(values))
+        found = {row[0] for row in cursor.fetchall()}
+        cursor.close()
+        return found
+
+    def bulk_enqueue(self, video_ids: list[str], prepend_url: str = "https://youtube.com/watch?v=", chunk_size: int = 500,
+                     songs_table: str = "songs", queue_table: str = "archive_queue") -> dict[str, str]:
+        """
+        Enqueue many videos to the archive queue. Existence is checked against songs and archive_queue
+        with one query per table and chunk, and new videos are inserted with one executemany per chunk
+        :param video_ids: The video IDs to enqueue
+        :param prepend_url: The URL prefix stored in archive_queue
+        :param chunk_size: The maximum number of IDs per query and transaction
+        :param songs_table: The table of archived songs
+        :param queue_table: The archive queue table
+        :return: A dict of video ID to its outcome: "archived", "queued", "enqueued" or "error"
+        """
+        outcomes = {}
+        with self.pooled_connection() as connection:
+            for chunk in _enqueue_chunks(video_ids, chunk_size):
+                try:
+                    with get_shared_metrics().timer("db_check"):
+                        archived = self.find_existing_values(songs_table, "video_id", chunk, connection)
+                        queued_urls = self.find_existing_values(queue_table, "url", [prepend_url + vid for vid in chunk], connection)
+                    new_ids = _new_enqueue_ids(chunk, archived, queued_urls, prepend_url, outcomes)
+                    if new_ids:
+                        with get_shared_metrics().timer("db_insert"):
+                            cursor = connection.cursor()
+                            cursor.executemany(_queue_insert_query(queue_table), [(prepend_url + vid, 0) for vid in new_ids])
+                            connection.commit()
+                            cursor.close()
+                    for vid in new_ids:
+                        outcomes[vid] = "enqueued"
+                except Error as err:
+                    print("Error enqueueing data")
+                    print(err)
+                    connection.rollback()
+                    for vid in chunk:
+                        outcomes.setdefault(vid, "error")
+        return outcomes
+
     def close_connection(self):
         if self.connection.is_connected():
             if hasattr(self, '_tunnel'):
                 self._tunnel.stop()
             self.connection.close()
-            print("MySQL connection is closed")
+            print(f"{'SQLite' if self.engine == 'sqlite' else 'MySQL'} connection is closed")
 
 
     def clear_table(self, name: str):
         cursor = self.connection.cursor(buffered=True)
         try:
-            cursor.execute(f"DELETE FROM {name}")
+            cursor.execute(f"DELETE FROM {_identifier(name)}")
             self.connection.commit()
             print("Table cleared successfully")
         except Error as err:
@@ -104,7 +276,7 @@ class SQLHandler:
     def reset_auto_increment(self, name: str):
         cursor = self.connection.cursor(buffered=True)
         try:
-            cursor.execute(f"ALTER TABLE {name} AUTO_INCREMENT = 1")
+            cursor.execute(f"ALTER TABLE {_identifier(name)} AUTO_INCREMENT = 1")
             self.connection.commit()
             print("Table reset successfully")
         except Error as err:
@@ -114,6 +286,7 @@ class SQLHandler:
     def copy_rows_to_new_table(self, name: str, new_name: str, column: str):
         cursor = self.connection.cursor(buffered=True)
         try:
+            name, new_name, column = _identifier(name), _identifier(new_name), _column_list(column)
             cursor.execute(
                 f"INSERT INTO {new_name} ({column}) SELECT {column} FROM {name}")
             cursor.execute(
@@ -127,7 +300,7 @@ class SQLHandler:
     def drop_table(self, name: str):
         cursor = self.connection.cursor(buffered=True)
         try:
-            cursor.execute(f"DROP TABLE {name}")
+            cursor.execute(f"DROP TABLE {_identifier(name)}")
             self.connection.commit()
             print("Table dropped successfully")
         except Error as err:
@@ -138,10 +311,10 @@ class SQLHandler:
         """
         Checks if a row exists in a table
         """
-        cursor = self.connection.cursor(buffered=True)
+        cursor = self.connection.cursor(prepared=True)
         try:
-            cursor.execute(f"SELECT * FROM {table_name} WHERE {column_name} = '{value}'")
-            result = cursor.fetchone()
+            cursor.execute(f"SELECT 1 FROM {_identifier(table_name)} WHERE {_identifier(column_name)} = %s LIMIT 1", (value,))
+            result = cursor.fetchall()
             if result:
                 return True
             else:
@@ -149,88 +322,280 @@ class SQLHandler:
         except Error as err:
             print("Error checking row")
             print(err)
+        finally:
+            cursor.close()
 
     def update_row(self, name: str, column_name: str, search_val: str, replace_col:str, new_value: str):
         """
         Updates a row in a table
         """
-        cursor = self.connection.cursor(buffered=True)
+        cursor = self.connection.cursor(prepared=True)
         try:
-            cursor.execute(f"UPDATE {name} SET {replace_col} = '{new_value}' WHERE {column_name} = '{search_val}'")
+            cursor.execute(f"UPDATE {_identifier(name)} SET {_identifier(replace_col)} = %s WHERE {_identifier(column_name)} = %s",
+                           (new_value, search_val))
             self.connection.commit()
             print("Row updated successfully")
         except Error as err:
             print("Error updating row")
             print(err)
-    
-    def execute_query(self, query: str):
-        cursor = self.connection.cursor(buffered=True)
-        try:
-            cursor.execute(query)
-            result = cursor.fetchall()
-            return result
-        except Error as err:
-            print("Error executing query")
-            print(err)
-    
-    def get_query_result(self, query: str):
+        finally:
+            cursor.close()
+
+    def execute_query(self, query: str, params: tuple = None):
+        """
+        Run a query and return its rows
+        :param query: The SQL, with %s placeholders for params
+        :param params: The values bound to the placeholders
+        """
         cursor = self.connection.cursor(buffered=True)
         try:
-            cursor.execute(query)
+            cursor.execute(query, params or ())
             result = cursor.fetchall()
             return result
         except Error as err:
             print("Error executing query")
             print(err)
+        finally:
+            cursor.close()
+
+    def get_query_result(self, query: str, params: tuple = None):
+        """
+        Same as execute_query
+        """
+        return self.execute_query(query, params)
 
     def delete_row(self, name: str, column: str, data: tuple):
-        cursor = self.connection.cursor()
+        cursor = self.connection.cursor(prepared=True)
         try:
-            query = f"DELETE FROM {name} WHERE {column} = %s"
-            cursor.execute(query, data)
+            query = f"DELETE FROM {_identifier(name)} WHERE {_identifier(column)} = %s"
+            cursor.execute(query, tuple(data))
             self.connection.commit()
             print("Data Deleted:", data)
         except Error as err:
             print("Error deleting data")
             print(err)
             return False
+        finally:
+            cursor.close()
         return True
-    
-    def get_random_row(self,table_name: str, limit: int = 1):
+
+    def get_random_row(self, table_name: str, limit: int = 1, key_column: str = "id"):
+        """
+        Pick distinct random rows without sorting the table. Random keys are drawn between the lowest
+        and highest key and looked up by primary key; keys that fall into gaps are simply drawn again,
+        so every row is equally likely. Only when the keys are too sparse for that (or the table has
+        fewer rows than asked for) is the rest picked with ORDER BY RAND()
+        :param table_name: The table
+        :param limit: The number of rows
+        :param key_column: An integer primary key, e.g. an auto-increment id
+        :return: The rows, in random order
+        """
+        with self.pooled_connection() as connection:
+            cursor = connection.cursor(buffered=True)
+            try:
+                table_name, key_column = _identifier(table_name), _identifier(key_column)
+                # Separate subqueries, so each is answered from the end of the index rather than a scan
+                cursor.execute(f"SELECT (SELECT MIN({key_column}) FROM {table_name}), (SELECT MAX({key_column}) FROM {table_name})")
+                low, high = cursor.fetchone()
+                if low is None:
+                    return []
+                span = high - low + 1
+                found = {}
+                draw = limit * 2
+                for _ in range(RANDOM_SAMPLE_ROUNDS):
+                    if len(found) >= limit:
+                        break
+                    keys = [key for key in random.sample(range(low, high + 1), min(span, draw, RANDOM_SAMPLE_MAX_DRAW))
+                            if key not in found]
+                    if not keys:
+                        break
+                    placeholders = ', '.join(['%s'] * len(keys))
+                    cursor.execute(f"SELECT * FROM {table_name} WHERE {key_column} IN ({placeholders})", keys)
+                    rows = cursor.fetchall()
+                    key_index = [description[0] for description in cursor.description].index(key_column)
+                    # Rows come back in key order, so take them in draw order to keep the pick random
+                    by_key = {row[key_index]: row for row in rows}
+                    for key in keys:
+                        if key in by_key and len(found) < limit:
+                            found[key] = by_key[key]
+                    # Draw enough keys for the remaining rows at the density seen so far
+                    hit_rate = max(len(rows), 1) / len(keys)
+                    draw = int((limit - len(found)) / hit_rate * 1.5) + 1
+                result = list(found.values())
+                if len(result) < limit:
+                    random_function = self.backend.random_function
+                    # Enough rows to still have limit new ones after skipping those already picked
+                    cursor.execute(f"SELECT * FROM {table_name} ORDER BY {random_function} LIMIT %s", (limit + len(found),))
+                    key_index = [description[0] for description in cursor.description].index(key_column)
+                    for row in cursor.fetchall():
+                        if len(result) < limit and row[key_index] not in found:
+                            found[row[key_index]] = row
+                            result.append(row)
+                    random.shuffle(result)
+                return result
+            except Error as err:
+                print("Error getting random row")
+                print(err)
+            finally:
+                cursor.close()
+
+    def create_title_search_index(self, table_name: str = "songs", column: str = "title") -> bool:
+        """
+        Add an ngram FULLTEXT index on a title column so searches don't scan the table. MySQL only.
+        The ngram parser skips every ngram that contains a stopword, so the server should run with
+        innodb_ft_enable_stopword=OFF (or an empty stopword table) for titles to be fully indexed
+        :param table_name: The table
+        :param column: The title column
+        :return: True if the index was created
+        """
+        if not self.backend.supports_fulltext:
+            print(f"FULLTEXT indexes are not supported on {self.engine}, searches will scan the table")
+            return False
         cursor = self.connection.cursor(buffered=True)
         try:
-            cursor.execute(f"SELECT * FROM {table_name} ORDER BY RAND() LIMIT {str(limit)}")
-            result = cursor.fetchall()
-            return result
+            table_name, column = _identifier(table_name), _identifier(column)
+            cursor.execute(f"ALTER TABLE {table_name} ADD FULLTEXT INDEX ft_{column} ({column}) WITH PARSER ngram")
+            self.connection.commit()
+            self._fulltext_columns[(table_name, column)] = True
+            print(f"FULLTEXT index on {table_name}.{column} created successfully")
+            return True
         except Error as err:
-            print("Error getting random row")
+            print("Error creating FULLTEXT index")
             print(err)
-    
-    def search_video_row(self, table_name: str, keywords: list, limit: int = 1, offset: int = 0):
-        cursor = self.connection.cursor(buffered=True)
-        query = f"SELECT * FROM {table_name} WHERE 1=1"
-        keyword_conditions = [] 
+            return False
+        finally:
+            cursor.close()
+
+    def has_fulltext_index(self, table_name: str, column: str = "title", connection=None) -> bool:
+        """
+        Check (once per handler) whether a column has a FULLTEXT index
+        """
+        if not self.backend.supports_fulltext:
+            return False
+        key = (table_name, column)
+        if key not in self._fulltext_columns:
+            connection = connection if connection is not None else self.connection
+            cursor = connection.cursor(buffered=True)
+            try:
+                cursor.execute("SELECT 1 FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() "
+                               "AND TABLE_NAME = %s AND COLUMN_NAME = %s AND INDEX_TYPE = 'FULLTEXT' LIMIT 1",
+                               (table_name, column))
+                self._fulltext_columns[key] = cursor.fetchone() is not None
+            except Error as err:
+                print(err)
+                return False
+            finally:
+                cursor.close()
+        return self._fulltext_columns[key]
 
+    def _title_conditions(self, table_name: str, keywords: list, column: str = "title", connection=None) -> tuple[list[str], list]:
+        """
+        Build the WHERE conditions matching titles that contain every keyword. With a FULLTEXT index the
+        keywords go through MATCH ... AGAINST first, so only the rows it finds are checked with LIKE.
+        LIKE stays in either case because ngram matches are a superset of substring matches
+        :return: The conditions and their parameters
+        """
+        column = _identifier(column)
+        keywords = [keyword.lower() for keyword in keywords if keyword and keyword.strip()]
+        conditions = []
+        params = []
+        indexed = [keyword for keyword in keywords if len(keyword.strip()) >= NGRAM_TOKEN_SIZE]
+        if indexed and self.has_fulltext_index(table_name, column, connection):
+            conditions.append(f"MATCH({column}) AGAINST (%s IN BOOLEAN MODE)")
+            params.append(" ".join('+"' + keyword.replace('"', " ") + '"' for keyword in indexed))
         for keyword in keywords:
-            keyword_condition = f"LOWER(title) LIKE %s"
-            formatted_keyword = f"%{keyword.lower()}%"  
-            keyword_conditions.append((keyword_condition, formatted_keyword))  
-        if keyword_conditions:
-            query += " AND " + " AND ".join([condition[0] for condition in keyword_conditions])
-        count_query = query
-        query += " LIMIT %s OFFSET %s"
+            conditions.append(f"LOWER({column}) LIKE %s")
+            params.append(f"%{keyword}%")
+        return conditions, params
+
+    def _count_rows(self, cursor, table_name: str, where: str, params: list, count_limit: int = None) -> int:
+        if count_limit:
+            # Stops counting after count_limit rows, so broad searches don't read every match
+            cursor.execute(f"SELECT COUNT(*) FROM (SELECT 1 FROM {table_name} WHERE {where} LIMIT %s) AS capped",
+                           params + [count_limit])
+        else:
+            cursor.execute(f"SELECT COUNT(*) FROM {table_name} WHERE {where}", params)
+        return cursor.fetchone()[0]
+
+    def search_videos(self, table_name: str, keywords: list, limit: int = 20, after=None, key_column: str = "id",
+                      count: bool = True, count_limit: int = None, column: str = "title"):
+        """
+        Search titles containing every keyword, one page at a time. Pages follow key_column
+        (keyset pagination), so a deep page costs the same as the first one
+        :param table_name: The table to search
+        :param keywords: The keywords, matched case insensitively as substrings
+        :param limit: The page size
+        :param after: The cursor returned with the previous page. None for the first page
+        :param key_column: A unique, indexed column to page by
+        :param count: Also count all matches (e.g. only for the first page)
+        :param count_limit: Count at most this many matches. A count equal to it means "at least"
+        :param column: The title column
+        :return: The rows, the number of matches (None when not counted) and the cursor of the next page
+                 (None on the last page), or None on error
+        """
+        with self.pooled_connection() as connection:
+            cursor = connection.cursor(buffered=True)
+            try:
+                table_name, key_column = _identifier(table_name), _identifier(key_column)
+                conditions, params = self._title_conditions(table_name, keywords, column, connection)
+                where = " AND ".join(["1=1"] + conditions)
+                result_count = self._count_rows(cursor, table_name, where, params, count_limit) if count else None
+                page_where = where
+                page_params = list(params)
+                if after is not None:
+                    page_where += f" AND {key_column} > %s"
+                    page_params.append(after)
+                # One extra row tells whether there is a next page
+                cursor.execute(f"SELECT * FROM {table_name} WHERE {page_where} ORDER BY {key_column} LIMIT %s",
+                               page_params + [limit + 1])
+                rows = cursor.fetchall()
+                next_cursor = None
+                if len(rows) > limit:
+                    rows = rows[:limit]
+                    key_index = [description[0] for description in cursor.description].index(key_column)
+                    next_cursor = rows[-1][key_index]
+                return rows, result_count, next_cursor
+            except Error as err:
+                print("Error searching video row")
+                print(err)
+            finally:
+                cursor.close()
 
+    def search_video_row(self, table_name: str, keywords: list, limit: int = 1, offset: int = 0):
+        """
+        Search titles containing every keyword with LIMIT/OFFSET paging. Uses the FULLTEXT index when
+        there is one. Prefer search_videos for deep pages
+        :return: The rows and the number of matches
+        """
+        cursor = self.connection.cursor(buffered=True)
         try:
-            cursor.execute(count_query, ([condition[1] for condition in keyword_conditions]))
-            result_count = len(cursor.fetchall())
-            cursor.execute(query, ([condition[1] for condition in keyword_conditions] + [limit, offset]))
+            table_name = _identifier(table_name)
+            conditions, params = self._title_conditions(table_name, keywords)
+            where = " AND ".join(["1=1"] + conditions)
+            result_count = self._count_rows(cursor, table_name, where, params)
+            cursor.execute(f"SELECT * FROM {table_name} WHERE {where} LIMIT %s OFFSET %s", params + [limit, offset])
             result = cursor.fetchall()
             return result, result_count
         except Error as err:
             print("Error searching video row")
             print(err)
-    
-    def search_romanized(self, table_name: str, keywords: list, limit: int = 1, offset: int = 0):
+
+    def search_romanized(self, table_name: str, keywords: list, limit: int = 1, offset: int = 0, use_index: bool = True):
+        """
+        Search romanized titles containing every keyword as a whole word
+        :param use_index: Rank and count matches with the in-process romanized index (synced from the
+                          romanized table and table_name first) and only fetch the rows of the requested page.
+                          False runs a REGEXP over every joined row
+        :return: The rows and the number of matches
+        """
+        try:
+            table_name = _identifier(table_name)
+        except Error as err:
+            print("Error searching video row")
+            print(err)
+            return None
+        if use_index:
+            return self._search_romanized_index(table_name, keywords, limit, offset)
         cursor = self.connection.cursor(buffered=True)
         query = f"SELECT * FROM {table_name} S JOIN romanized R on S.video_id=R.video_id WHERE 1=1"
         keyword_conditions = [] 
@@ -241,15 +606,39 @@ class SQLHandler:
             keyword_conditions.append((keyword_condition, formatted_keyword))  
         if keyword_conditions:
             query += " AND " + " AND ".join([condition[0] for condition in keyword_conditions])
-        count_query = query
+        count_query = query.replace("SELECT *", "SELECT COUNT(*)", 1)
         query += " LIMIT %s OFFSET %s"
 
         try:
             cursor.execute(count_query, ([condition[1] for condition in keyword_conditions]))
-            result_count = len(cursor.fetchall())
+            result_count = cursor.fetchone()[0]
             cursor.execute(query, ([condition[1] for condition in keyword_conditions] + [limit, offset]))
             result = cursor.fetchall()
             return result, result_count
         except Error as err:
             print("Error searching video row")
-            print(err)
\ No newline at end of file
+            print(err)
+
+    def _search_romanized_index(self, table_name: str, keywords: list, limit: int, offset: int):
+        index = get_shared_romanized_index()
+        index.refresh(self, members=table_name)
+        video_ids, result_count = index.search(keywords, limit, offset, table_name=table_name)
+        if not video_ids:
+            return [], result_count
+        cursor = self.connection.cursor(buffered=True)
+        placeholders = ', '.join(['%s'] * len(video_ids))
+        try:
+            cursor.execute(f"SELECT * FROM {table_name} S JOIN romanized R on S.video_id=R.video_id "
+                           f"WHERE S.video_id IN ({placeholders})", video_ids)
+            rows = cursor.fetchall()
+            video_id_index = [description[0] for description in cursor.description].index("video_id")
+        except Error as err:
+            print("Error searching video row")
+            print(err)
+            return None
+        finally:
+            cursor.close()
+        # Keep the index's ranking
+        rank = {video_id: i for i, video_id in enumerate(video_ids)}
+        rows.sort(key=lambda row: rank.get(row[video_id_index], len(rank)))
+        return rows, result_count
@@ -0,0 +1,20 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+# The stand-in server must not be throttled, and nothing may hit a real cache or service
+os.environ["RATE_LIMITS"] = "127.0.0.1=100000/100000"
+os.environ["HTTP_CACHE"] = "off"
+
+import pytest
+from standins import Fixtures, StandInServer
+
+
+@pytest.fixture(scope="module")
+def standin():
+    server = StandInServer(Fixtures()).start()
+    yield server
+    server.stop()
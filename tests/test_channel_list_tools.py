@@ -0,0 +1,23 @@
+import dotenv
+
+import channel_list_tools
+from standins import channel_id
+
+
+def test_names_uses_the_env_file(standin, tmp_path, monkeypatch):
+    for name in ("YOUTUBE_BASE_URL", "CHANNEL_CACHE_PATH"):
+        monkeypatch.delenv(name, raising=False)
+    env_path = tmp_path / ".env"
+    env_path.write_text(f"YOUTUBE_BASE_URL={standin.base_url}\nCHANNEL_CACHE_PATH={tmp_path / 'names.db'}\n")
+    load_dotenv = dotenv.load_dotenv
+    monkeypatch.setattr(channel_list_tools.dotenv, "load_dotenv", lambda *args, **kwargs: load_dotenv(env_path))
+
+    channels = [channel_id(1), channel_id(2)]
+    (tmp_path / "channels.txt").write_text("\n".join(channels) + "\n")
+    channel_list_tools.main(["names", "--input", str(tmp_path / "channels.txt"), "--output", str(tmp_path / "appended.txt")])
+
+    assert (tmp_path / "appended.txt").read_text().splitlines() == [
+        f"{channel} - {standin.fixtures.listing_name(channel)}" for channel in channels]
+    cache = channel_list_tools.ChannelNameCache(str(tmp_path / "names.db"))
+    assert cache.get(channels[0])[:2] == (standin.fixtures.listing_name(channels[0]), "ok")
+    cache.close()
@@ -0,0 +1,133 @@
+from contextlib import contextmanager
+
+import pytest
+
+import crawler
+import holodex
+import youtube
+from checkpoint import CheckpointJournal
+from standins import channel_id, holodex_video_id
+from youtube_listing import YouTubeListingClient
+
+
+@pytest.fixture
+def listing_client(standin, monkeypatch):
+    client = YouTubeListingClient(base_url=standin.base_url)
+    monkeypatch.setattr(youtube, "_listing_client", client)
+    return client
+
+
+def test_channel_verdicts_are_journaled_per_video_and_reused(listing_client, tmp_path, monkeypatch):
+    channel = channel_id(7)
+    path = str(tmp_path / "channels.jsonl")
+    lookups = []
+    resolve = youtube.resolve_video_duration
+
+    def interrupted_after_three(video_id, *args):
+        if len(lookups) == 3:
+            raise KeyboardInterrupt
+        lookups.append(video_id)
+        return resolve(video_id, *args)
+
+    journal = CheckpointJournal(path, "channels")
+    monkeypatch.setattr(youtube, "resolve_video_duration", interrupted_after_three)
+    with pytest.raises(KeyboardInterrupt):
+        youtube.get_content_youtube_channel(channel, backend="http", journal=journal)
+    journal.close()
+    judged = CheckpointJournal(path).verdicts
+    assert len(lookups) == 3 and set(lookups) <= set(judged)
+
+    # The resumed run judges only what the interrupted one didn't
+    journal = CheckpointJournal(path)
+    resumed = []
+    monkeypatch.setattr(youtube, "resolve_video_duration", lambda video_id, *args: resumed.append(video_id) or resolve(video_id, *args))
+    succeeded, failed = youtube.get_content_youtube_channel(channel, backend="http", journal=journal)
+    journal.close()
+    assert resumed and not set(resumed) & set(judged)
+    assert {vid for vid, _ in succeeded + failed} == set(CheckpointJournal(path).verdicts)
+    assert {vid for vid, _ in succeeded + failed} >= set(judged)
+
+
+def test_verdicts_recorded_elsewhere_are_not_written_again(tmp_path):
+    path = str(tmp_path / "channels.jsonl")
+    journal = CheckpointJournal(path, "channels")
+    journal.record_verdicts({"a": (True, "Success")}, write=False)
+    journal.record_verdicts({"b": (False, "Not music content")})
+    journal.close()
+    assert journal.verdicts == {"a": (True, "Success"), "b": (False, "Not music content")}
+    assert CheckpointJournal(path).verdicts == {"b": (False, "Not music content")}
+
+
+@pytest.fixture
+def holodex_api(standin, monkeypatch):
+    base_url = standin.base_url + "/api/v2"
+    search_videos, check_videos_valid = holodex.search_videos, holodex.check_videos_valid
+    monkeypatch.setattr(holodex, "search_videos", lambda *args, **kwargs: search_videos(*args, **dict(kwargs, base_url=base_url)))
+    monkeypatch.setattr(holodex, "check_videos_valid", lambda *args, **kwargs: check_videos_valid(*args, **dict(kwargs, base_url=base_url)))
+    return check_videos_valid, base_url
+
+
+def test_holodex_api_errors_are_checked_again_on_resume(standin, holodex_api, tmp_path, monkeypatch):
+    check_videos_valid, base_url = holodex_api
+    path = str(tmp_path / "holodex.jsonl")
+    without_details = {holodex_video_id(1, i) for i in range(3)}
+    standin.fixtures.search_without_details = without_details
+    lookups = []
+
+    def check(api_key, video_ids, *args, **kwargs):
+        lookups.append(list(video_ids))
+        if len(lookups) == 1:
+            return {vid: (False, holodex.ERROR_REASON) for vid in video_ids}
+        return check_videos_valid(api_key, video_ids, *args, **dict(kwargs, base_url=base_url))
+
+    monkeypatch.setattr(holodex, "check_videos_valid", check)
+    try:
+        journal = CheckpointJournal(path, "holodex")
+        crawler.get_content_holodex("key", 1, 2, backend="api", page_size=10, journal=journal)
+        journal.close()
+        journal = CheckpointJournal(path)
+        # The failed lookups are neither verdicts nor a finished page
+        assert not without_details & set(journal.verdicts) and len(journal.verdicts) == 17
+        assert journal.completed_pages == {2}
+
+        succeeded, failed = crawler.get_content_holodex("key", 1, 2, backend="api", page_size=10, journal=journal)
+        journal.close()
+    finally:
+        standin.fixtures.search_without_details = set()
+    assert sorted(lookups[1]) == sorted(without_details)
+    journal = CheckpointJournal(path)
+    assert journal.completed_pages == {1, 2}
+    assert all(reason != holodex.ERROR_REASON for _, reason in journal.verdicts.values())
+    assert set(succeeded) | {vid for vid, _ in failed} == without_details | {holodex_video_id(1, i) for i in range(3, 10)}
+
+
+class PagedScraper:
+    def __init__(self, pages: dict):
+        self.pages = pages
+
+    def load_page(self, url: str, ready_selector=None):
+        return self.pages[int(url.rsplit("=", 1)[1])]
+
+
+class PagedPool:
+    def __init__(self, pages: dict):
+        self.scraper = PagedScraper(pages)
+
+    @contextmanager
+    def acquire(self):
+        yield self.scraper
+
+
+def test_unrendered_holodex_pages_are_not_journaled(standin, holodex_api, tmp_path):
+    path = str(tmp_path / "holodex.jsonl")
+    fixtures = standin.fixtures
+    pool = PagedPool({
+        1: ("", False),
+        2: (fixtures.holodex_search_page(2), True),
+        3: (fixtures.holodex_search_page(3)[:200], False),
+    })
+    journal = CheckpointJournal(path, "holodex")
+    succeeded, failed = crawler.get_content_holodex("key", 1, 3, pool=pool, journal=journal)
+    journal.close()
+    assert CheckpointJournal(path).completed_pages == {2}
+    assert len(succeeded) + len(failed) == len(journal.verdicts) > 0
@@ -0,0 +1,99 @@
+import pytest
+
+import crawler
+import youtube
+from crawl_state import CrawlState, ChannelProgress, HIGH_WATER_IDS
+from standins import channel_id
+from youtube_listing import YouTubeListingClient
+
+
+@pytest.fixture
+def state(tmp_path):
+    store = CrawlState(str(tmp_path / "crawl_state.db"))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def listing_client(standin, monkeypatch):
+    client = YouTubeListingClient(base_url=standin.base_url)
+    monkeypatch.setattr(youtube, "_listing_client", client)
+    return client
+
+
+def crawl(channel: str, state: CrawlState, known_ids=None) -> tuple[ChannelProgress, list, list]:
+    progress = ChannelProgress(channel)
+    succeeded, failed = youtube.get_content_youtube_channel(channel, known_ids=known_ids, backend="http", state=state, progress=progress)
+    return progress, succeeded, failed
+
+
+def test_high_water_is_not_moved_before_commit(standin, listing_client, state):
+    channel = channel_id(1)
+    progress, _, _ = crawl(channel, state)
+    assert state.get_high_water(channel) == ([], None)
+    state.commit(progress)
+    assert state.get_high_water(channel)[0] == standin.fixtures.listing_ids(channel)[:HIGH_WATER_IDS]
+
+
+def test_high_water_stops_a_listing_whose_videos_are_archived(standin, listing_client, state):
+    channel = channel_id(2)
+    progress, _, _ = crawl(channel, state)
+    state.commit(progress)
+    # Everything listed before is archived now, the high-water videos included
+    archived = set(standin.fixtures.listing_ids(channel))
+    before = standin.requests
+    progress, succeeded, failed = crawl(channel, state, known_ids=archived)
+    assert progress.new_ids == [] and succeeded == [] and failed == []
+    # Only the first page was read, no continuations
+    assert standin.requests - before == 1
+
+
+def test_high_water_stays_behind_videos_to_retry():
+    progress = ChannelProgress("UC")
+    progress.seen_ids = ["old1", "old2"]
+    progress.new_ids = ["v1", "v2", "v3", "v4"]
+    assert progress.high_water() == ["v1", "v2", "v3", "v4", "old1"]
+    progress.retry_ids = {"v2"}
+    assert progress.high_water() == ["v3", "v4", "old1", "old2"]
+    progress.retry_ids = {"v4", "v1"}
+    assert progress.high_water() == ["old1", "old2"]
+
+
+def test_crawl_channels_commits_only_enqueued_videos(standin, listing_client, state, monkeypatch):
+    channel = channel_id(3)
+    args = crawler.build_arg_parser().parse_args(["--youtube", "--listing-backend", "http", "--stub"])
+    monkeypatch.setattr(crawler, "get_shared_state", lambda: state)
+    rejected = []
+
+    def enqueue_all_but_first(video_ids, args):
+        rejected.append(video_ids[0])
+        return video_ids[1:]
+
+    monkeypatch.setattr(crawler, "enqueue_videos", enqueue_all_but_first)
+    crawler.crawl_channels([channel], args, None)
+    listing = standin.fixtures.listing_ids(channel)
+    marks = state.get_high_water(channel)[0]
+    # The next crawl lists the rejected video again
+    assert marks == listing[listing.index(rejected[0]) + 1:][:HIGH_WATER_IDS]
+
+
+def test_rates_are_measured_only_when_the_listing_reached_the_high_water_mark(standin, listing_client, state):
+    channel = channel_id(4)
+    progress, _, _ = crawl(channel, state)
+    assert not progress.stopped_at_seen
+    state.commit(progress)
+    assert state.get_activity()[channel][:2] == (None, None)
+
+    # The high-water videos were deleted from the channel: the whole listing is new again
+    listing = standin.fixtures.listing_ids(channel)
+    state.set_high_water(channel, ["deleted1", "deleted2"])
+    progress, _, _ = crawl(channel, state, known_ids=set(listing))
+    assert progress.since is not None and not progress.stopped_at_seen
+    state.commit(progress)
+    assert state.get_activity()[channel][:2] == (None, None)
+
+    state.set_high_water(channel, listing[5:5 + HIGH_WATER_IDS])
+    progress, _, _ = crawl(channel, state, known_ids=set(listing))
+    assert progress.stopped_at_seen and progress.new_ids == listing[:5]
+    state.commit(progress)
+    assert state.get_activity()[channel][0] is not None
@@ -0,0 +1,54 @@
+import pytest
+
+import crawler
+import youtube
+from crawl_state import CrawlState
+from standins import channel_id
+from youtube_listing import YouTubeListingClient
+
+
+@pytest.fixture
+def state(tmp_path):
+    store = CrawlState(str(tmp_path / "crawl_state.db"))
+    yield store
+    store.close()
+
+
+def parse_args(*argv: str):
+    return crawler.build_arg_parser().parse_args(["--youtube", "--listing-backend", "http", "--stub", *argv])
+
+
+def test_jobs_resume_only_when_they_ask_to():
+    args = parse_args("--daemon", "--resume")
+    assert args.resume == "latest"
+    assert crawler.build_job_args(args, {"mode": "channels"}).resume is None
+    assert crawler.build_job_args(args, {"mode": "channels", "resume": "latest"}).resume == "latest"
+
+
+@pytest.mark.parametrize("spec", [{"mode": "channels", "shard": "5/4"}, {"mode": "channels", "shard": "x"},
+                                  {"mode": "channels", "max_time": "long"}, {"mode": "videos"}, {"mode": "channel"}])
+def test_invalid_jobs_raise_value_error(spec):
+    with pytest.raises(ValueError):
+        crawler.build_job_args(parse_args("--daemon"), spec)
+
+
+def test_channel_workers_are_kept_between_crawls(standin, state, monkeypatch):
+    # The workers are forked, so they inherit the stand-in listing client and state
+    monkeypatch.setattr(youtube, "_listing_client", YouTubeListingClient(base_url=standin.base_url))
+    monkeypatch.setattr(crawler, "get_shared_state", lambda: state)
+    enqueued = []
+    monkeypatch.setattr(crawler, "enqueue_videos", lambda video_ids, args: enqueued.extend(video_ids) or video_ids)
+    args = parse_args("--workers", "2")
+    try:
+        first, _ = crawler.crawl_channels([channel_id(11), channel_id(12)], args, None)
+        executor = crawler.get_channel_executor(args)
+        second, _ = crawler.crawl_channels([channel_id(13)], args, None)
+        assert crawler.get_channel_executor(args) is executor
+        assert first and second and sorted(enqueued) == sorted(first + second)
+        assert state.get_high_water(channel_id(13))[0]
+
+        # Workers set up for another wait time are replaced
+        args.wait_time += 1
+        assert crawler.get_channel_executor(args) is not executor
+    finally:
+        crawler.close_channel_executor()
@@ -0,0 +1,161 @@
+import json
+import os
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from daemon import TAKEN_SUFFIX, CrawlDaemon
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+class Jobs:
+    """
+    Records the specs it runs. A spec with "fail" raises while running, one with "invalid" is rejected
+    """
+    def __init__(self):
+        self.ran = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def run(self, spec: dict):
+        self.release.wait(5)
+        self.ran.append(spec)
+        if spec.get("fail"):
+            raise RuntimeError("job failed")
+
+    def validate(self, spec: dict):
+        if spec.get("invalid"):
+            raise ValueError("invalid job")
+
+
+@pytest.fixture
+def jobs():
+    return Jobs()
+
+
+@pytest.fixture
+def make_daemon(jobs):
+    daemons = []
+
+    def make(**kwargs) -> CrawlDaemon:
+        daemon = CrawlDaemon(jobs.run, validate_job=jobs.validate, **dict({"port": 0, "poll_interval": 0.02}, **kwargs))
+        daemon.start()
+        daemons.append(daemon)
+        return daemon
+
+    yield make
+    jobs.release.set()
+    for daemon in daemons:
+        daemon.stop()
+        daemon.wait()
+
+
+def finished(daemon: CrawlDaemon, count: int) -> bool:
+    stats = daemon.stats()["jobs"]
+    return stats["done"] + stats["failed"] == count
+
+
+def test_jobs_run_in_order_and_record_their_status(jobs, make_daemon):
+    daemon = make_daemon()
+    queued = daemon.submit([{"n": 1}, {"n": 2, "fail": True}]) + daemon.submit({"n": 3})
+    wait_for(lambda: finished(daemon, 3))
+    assert jobs.ran == [{"n": 1}, {"n": 2, "fail": True}, {"n": 3}]
+    assert [daemon.get_job(job.id).status for job in queued] == ["done", "failed", "done"]
+    assert daemon.get_job(queued[1].id).error == "job failed"
+    assert daemon.stats()["jobs"] == {"queued": 0, "done": 2, "failed": 1}
+
+
+@pytest.mark.parametrize("spec", [[{"n": 1}, {"invalid": True}], [], "job", [{"n": 1}, 2]])
+def test_invalid_submissions_queue_nothing(jobs, make_daemon, spec):
+    daemon = make_daemon()
+    with pytest.raises(ValueError):
+        daemon.submit(spec)
+    assert daemon.jobs == {}
+
+
+def write_job(path, spec):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(spec, f)
+
+
+def test_job_files_are_picked_up_and_taken_ones_replayed(jobs, make_daemon, tmp_path):
+    job_dir = tmp_path / "jobs"
+    job_dir.mkdir()
+    # Taken by a daemon that crashed before finishing it
+    write_job(job_dir / ("a.json" + TAKEN_SUFFIX), {"n": "replayed"})
+    write_job(job_dir / "b.json", [{"n": "b1"}, {"n": "b2"}])
+    write_job(job_dir / "c.json", {"invalid": True})
+    daemon = make_daemon(job_dir=str(job_dir))
+    wait_for(lambda: finished(daemon, 3))
+    assert jobs.ran == [{"n": "replayed"}, {"n": "b1"}, {"n": "b2"}]
+    wait_for(lambda: sorted(os.listdir(job_dir)) == ["c.json.invalid"])
+
+    # A file removed while its job runs doesn't stop the worker
+    jobs.release.clear()
+    write_job(job_dir / "d.json", {"n": "d"})
+    wait_for(lambda: os.path.exists(job_dir / ("d.json" + TAKEN_SUFFIX)))
+    os.remove(job_dir / ("d.json" + TAKEN_SUFFIX))
+    jobs.release.set()
+    wait_for(lambda: finished(daemon, 4))
+    assert daemon.healthy() and daemon.stats()["jobs"]["done"] == 4
+
+
+def call(port: int, method: str, path: str, body=None, token: str = None) -> tuple[int, object]:
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    request = urllib.request.Request(f"http://127.0.0.1:{port}{path}", data=data, method=method, headers=headers)
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            status, text = response.status, response.read().decode("utf-8")
+    except urllib.error.HTTPError as e:
+        status, text = e.code, e.read().decode("utf-8")
+    try:
+        return status, json.loads(text)
+    except ValueError:
+        return status, text
+
+
+def test_control_endpoint_needs_the_token_except_for_health(jobs, make_daemon):
+    port = free_port()
+    daemon = make_daemon(port=port, token="secret")
+    assert call(port, "GET", "/health")[0] == 200
+    assert call(port, "GET", "/stats")[0] == 401
+    assert call(port, "GET", "/jobs", token="wrong")[0] == 401
+    assert call(port, "POST", "/jobs", {"n": 1})[0] == 401
+    assert call(port, "POST", "/shutdown")[0] == 401
+    assert daemon.jobs == {}
+
+    status, body = call(port, "POST", "/jobs", {"n": 1}, token="secret")
+    assert status == 202
+    wait_for(lambda: finished(daemon, 1))
+    status, job = call(port, "GET", f"/jobs/{body['ids'][0]}", token="secret")
+    assert status == 200 and job["status"] == "done"
+    assert call(port, "POST", "/jobs", {"invalid": True}, token="secret") == (400, {"error": "invalid job"})
+    assert call(port, "GET", "/jobs/unknown", token="secret")[0] == 404
+    assert call(port, "GET", "/stats", token="secret")[1]["jobs"]["done"] == 1
+    assert call(port, "GET", "/metrics", token="secret")[0] == 200
+
+
+def test_health_reports_a_stopping_daemon(jobs, make_daemon):
+    port = free_port()
+    daemon = make_daemon(port=port)
+    status, body = call(port, "GET", "/health")
+    assert status == 200 and body["status"] == "ok"
+    assert call(port, "POST", "/shutdown") == (202, {"status": "stopping"})
+    assert call(port, "GET", "/health") == (503, {"status": "stopping", "uptime": pytest.approx(time.time() - daemon.started_at, abs=5)})
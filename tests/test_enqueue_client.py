@@ -0,0 +1,126 @@
+import json
+import threading
+
+import pytest
+
+from enqueue_client import QueueClient
+from standins import Fixtures, StandInServer
+
+PREFIX = "https://youtube.com/watch?v="
+
+
+@pytest.fixture
+def queue():
+    server = StandInServer(Fixtures(), bulk_queue=True).start()
+    yield server
+    server.stop()
+
+
+def make_client(server, tmp_path, bulk: bool = True, **kwargs) -> QueueClient:
+    return QueueClient(api_url=server.base_url + "/queue", auth="token", bulk_url=server.base_url + "/queue/bulk" if bulk else "",
+                       spool_path=str(tmp_path / "spool.jsonl"), **kwargs)
+
+
+def video_ids(count: int, prefix: str = "vid") -> list[str]:
+    return [f"{prefix}{i:08d}" for i in range(count)]
+
+
+def test_bulk_posts_are_batched(queue, tmp_path):
+    client = make_client(queue, tmp_path, bulk_size=10)
+    ids = video_ids(35)
+    assert client.submit(ids + ids[:5]) == {vid: 200 for vid in ids}
+    assert queue.requests == 4
+    assert sorted(queue.queued) == sorted(PREFIX + vid for vid in ids)
+    assert client.stats()["succeeded"] == 35
+
+
+def test_single_posts_without_bulk_endpoint(queue, tmp_path):
+    client = make_client(queue, tmp_path, bulk=False, max_in_flight=4)
+    ids = video_ids(12)
+    assert client.submit(ids) == {vid: 200 for vid in ids}
+    assert queue.requests == 12
+    assert sorted(queue.queued) == sorted(PREFIX + vid for vid in ids)
+
+
+def test_rejected_batch_falls_back_to_single_posts_and_spools_failures(queue, tmp_path):
+    client = make_client(queue, tmp_path, bulk_size=10)
+    ids = video_ids(20)
+    queue.queue_rejected = {PREFIX + ids[3]}
+    statuses = client.submit(ids)
+    assert statuses[ids[3]] == 400
+    assert all(status == 200 for vid, status in statuses.items() if vid != ids[3])
+    # Two bulk posts, then the rejected batch one video at a time
+    assert queue.requests == 2 + 10
+    with open(client.spool_path, encoding="utf-8") as f:
+        assert [json.loads(line)["video_id"] for line in f] == [ids[3]]
+
+    queue.queue_rejected = set()
+    assert client.retry_spool() == {ids[3]: 200}
+    assert sorted(queue.queued) == sorted(PREFIX + vid for vid in ids)
+    assert client.retry_spool() == {}
+
+
+def test_throttled_posts_are_retried(queue, tmp_path):
+    client = make_client(queue, tmp_path, bulk=False, max_in_flight=1)
+    queue.queue_throttled = 2
+    assert client.submit(["vid00000001"]) == {"vid00000001": 200}
+    assert queue.requests == 3
+    assert queue.queued == [PREFIX + "vid00000001"]
+
+
+def test_prefix_is_per_call(queue, tmp_path):
+    client = make_client(queue, tmp_path, bulk_size=5, max_in_flight=2)
+    prefixes = {"a": "https://youtube.com/watch?v=", "b": "https://music.youtube.com/watch?v="}
+
+    def submit(name: str):
+        for _ in range(5):
+            client.submit(video_ids(10, name), prepend_url=prefixes[name])
+
+    threads = [threading.Thread(target=submit, args=(name,)) for name in prefixes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(url.startswith(prefixes[url.rsplit("=", 1)[1][0]]) for url in queue.queued)
+    assert len(queue.queued) == 100
+
+
+def test_spool_keeps_the_prefix(queue, tmp_path):
+    client = make_client(queue, tmp_path, bulk=False)
+    queue.queue_rejected = {"https://music.youtube.com/watch?v=vid00000000"}
+    client.submit(["vid00000000"], prepend_url="https://music.youtube.com/watch?v=")
+    queue.queue_rejected = set()
+    assert client.retry_spool() == {"vid00000000": 200}
+    assert queue.queued == ["https://music.youtube.com/watch?v=vid00000000"]
+
+
+def test_retry_that_dies_halfway_keeps_the_spool(queue, tmp_path, monkeypatch):
+    client = make_client(queue, tmp_path, bulk=False)
+    prefixes = ["https://youtube.com/watch?v=", "https://music.youtube.com/watch?v="]
+    queue.queue_rejected = {prefix + vid for prefix in prefixes for vid in video_ids(3)}
+    for prefix in prefixes:
+        client.submit(video_ids(3), prepend_url=prefix)
+    queue.queue_rejected = set()
+
+    submit = client.submit
+    calls = []
+
+    def dies_on_second_prefix(*args, **kwargs):
+        calls.append(kwargs["prepend_url"])
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+        return submit(*args, **kwargs)
+
+    monkeypatch.setattr(client, "submit", dies_on_second_prefix)
+    with pytest.raises(KeyboardInterrupt):
+        client.retry_spool()
+    monkeypatch.setattr(client, "submit", submit)
+    # A failure spooled after the crash is retried together with what the crashed retry left
+    queue.queue_rejected = {PREFIX + "late00000000"}
+    client.submit(["late00000000"])
+    queue.queue_rejected = set()
+
+    statuses = client.retry_spool()
+    assert statuses == {vid: 200 for vid in video_ids(3) + ["late00000000"]}
+    assert sorted(set(queue.queued)) == sorted({prefix + vid for prefix in prefixes for vid in video_ids(3)} | {PREFIX + "late00000000"})
+    assert client.retry_spool() == {}
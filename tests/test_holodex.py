@@ -0,0 +1,151 @@
+import pytest
+
+import crawler
+import holodex
+from standins import Fixtures, StandInServer, holodex_video_id
+
+
+def api_url(server) -> str:
+    return server.base_url + "/api/v2"
+
+
+def expected_verdict(fixtures: Fixtures, video_id: str, min_time: int = 65, max_time: int = 480):
+    return holodex.evaluate_video(fixtures.holodex_video(video_id), min_time, max_time)
+
+
+@pytest.mark.parametrize("duration, verdict", [
+    (64, (False, "Video is too short (Less than 65 seconds)")),
+    (65, (False, "Video is too short (Less than 65 seconds)")),
+    (66, (True, "Success")),
+    (479, (True, "Success")),
+    (480, (False, "Video is too long (Exceeds 480 seconds)")),
+    (481, (False, "Video is too long (Exceeds 480 seconds)")),
+])
+def test_evaluate_video_limits_are_exclusive(duration, verdict):
+    assert holodex.evaluate_video({"id": "x", "status": "past", "duration": duration}) == verdict
+
+
+def test_evaluate_video_rejects_upcoming_and_broken_records():
+    assert holodex.evaluate_video({"id": "x", "status": "upcoming", "duration": 100})[0] is False
+    assert holodex.evaluate_video({"id": "x", "status": "past"}) == (False, holodex.ERROR_REASON)
+
+
+def test_check_videos_valid_batches_requests(standin):
+    ids = [holodex_video_id(1, i) for i in range(40)]
+    before = standin.requests
+    verdicts = holodex.check_videos_valid("key", ids, batch_size=10, base_url=api_url(standin))
+    assert standin.requests - before == 4
+    assert list(verdicts) == ids
+    assert verdicts == {vid: expected_verdict(standin.fixtures, vid) for vid in ids}
+
+
+def test_check_videos_valid_looks_up_ids_missing_from_batches(standin):
+    ids = [holodex_video_id(2, i) for i in range(20)]
+    standin.fixtures.batch_missing = set(ids[:3])
+    try:
+        before = standin.requests
+        verdicts = holodex.check_videos_valid("key", ids, batch_size=20, base_url=api_url(standin))
+    finally:
+        standin.fixtures.batch_missing = set()
+    # One batch plus one single lookup per missing ID
+    assert standin.requests - before == 4
+    assert verdicts == {vid: expected_verdict(standin.fixtures, vid) for vid in ids}
+
+
+def test_check_videos_valid_deduplicates(standin):
+    vid = holodex_video_id(3, 0)
+    assert holodex.check_videos_valid("key", [vid, vid], base_url=api_url(standin)) == {vid: expected_verdict(standin.fixtures, vid)}
+
+
+@pytest.fixture(scope="module")
+def slow_standin():
+    # Latency makes the number of round trips, not local CPU, decide the throughput
+    server = StandInServer(Fixtures(), latency=0.005).start()
+    yield server
+    server.stop()
+
+
+@pytest.mark.parametrize("batch_size", [1, 50], ids=["per_id", "batched"])
+def test_validation_throughput(benchmark, slow_standin, batch_size):
+    benchmark.group = "holodex validation, 100 videos"
+    ids = [holodex_video_id(4, i) for i in range(40)] + [holodex_video_id(5, i) for i in range(40)] + \
+          [holodex_video_id(6, i) for i in range(20)]
+    verdicts = benchmark.pedantic(holodex.check_videos_valid, args=("key", ids),
+                                  kwargs={"batch_size": batch_size, "max_workers": 8, "base_url": api_url(slow_standin)},
+                                  rounds=3, iterations=1)
+    assert len(verdicts) == len(ids)
+
+
+def search_ids(offset: int, limit: int, per_page: int = 40) -> list[str]:
+    return [holodex_video_id(i // per_page + 1, i % per_page) for i in range(offset, offset + limit)]
+
+
+def test_search_videos_pages_by_offset(standin):
+    records, total = holodex.search_videos("key", offset=30, limit=20, base_url=api_url(standin))
+    assert [record["id"] for record in records] == search_ids(30, 20)
+    assert total == standin.fixtures.holodex_total
+    assert all("status" in record and "duration" in record for record in records)
+    assert holodex.search_videos("key", offset=0, limit=5, topics=["Original_Song"], base_url=api_url(standin)) == ([], total)
+
+
+@pytest.fixture
+def api_crawl(standin, monkeypatch):
+    """
+    Run get_content_holodex with the api backend against the stand-in
+    """
+    search_videos, check_videos_valid = holodex.search_videos, holodex.check_videos_valid
+
+    def search(api_key, offset, limit, **kwargs):
+        return search_videos(api_key, offset, limit, **dict(kwargs, base_url=api_url(standin)))
+
+    monkeypatch.setattr(holodex, "search_videos", search)
+    monkeypatch.setattr(holodex, "check_videos_valid", lambda *args, **kwargs: check_videos_valid(*args, **dict(kwargs, base_url=api_url(standin))))
+
+    def run(end_page: int, page_size: int):
+        before = standin.requests
+        succeeded, failed = crawler.get_content_holodex("key", 1, end_page, backend="api", page_size=page_size)
+        return succeeded, failed, standin.requests - before
+
+    return run
+
+
+def verdicts_of(succeeded, failed) -> dict:
+    verdicts = {vid: (True, "Success") for vid in succeeded}
+    for vid, reason in failed:
+        assert vid not in verdicts
+        verdicts[vid] = (False, reason)
+    return verdicts
+
+
+def test_search_records_are_judged_inline(standin, api_crawl):
+    succeeded, failed, requests = api_crawl(end_page=3, page_size=20)
+    ids = search_ids(0, 60)
+    assert verdicts_of(succeeded, failed) == {vid: expected_verdict(standin.fixtures, vid) for vid in ids}
+    # One search request per page and no video lookups
+    assert requests == 3
+
+
+def test_records_without_status_or_duration_are_looked_up(standin, api_crawl):
+    ids = search_ids(0, 40)
+    standin.fixtures.search_without_details = {ids[3], ids[25], ids[26]}
+    try:
+        succeeded, failed, requests = api_crawl(end_page=2, page_size=20)
+    finally:
+        standin.fixtures.search_without_details = set()
+    assert verdicts_of(succeeded, failed) == {vid: expected_verdict(standin.fixtures, vid) for vid in ids}
+    # Two search pages and one batch lookup for each page with records missing details
+    assert requests == 2 + 2
+
+
+def test_videos_repeated_on_shifted_pages_are_judged_once(standin, api_crawl, monkeypatch):
+    search = holodex.search_videos
+
+    def shifted(api_key, offset, limit, **kwargs):
+        # Five videos were published after the first page was read, so the next page starts five earlier
+        return search(api_key, max(0, offset - 5), limit, **kwargs)
+
+    monkeypatch.setattr(holodex, "search_videos", shifted)
+    succeeded, failed, _ = api_crawl(end_page=2, page_size=20)
+    ids = search_ids(0, 35)
+    assert len(succeeded) + len(failed) == len(ids)
+    assert verdicts_of(succeeded, failed) == {vid: expected_verdict(standin.fixtures, vid) for vid in ids}
@@ -0,0 +1,81 @@
+import pytest
+import requests
+
+import channel_list_tools
+from http_cache import CacheMissError, ResponseCache
+from standins import channel_id
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "http_cache.db")
+
+
+def test_responses_are_cached(standin, cache_path):
+    cache = ResponseCache(cache_path, "on")
+    url = f"{standin.base_url}/channel/{channel_id(1)}"
+    before = standin.requests
+    first = cache.fetch("youtube_listing", "GET", url, lambda **kwargs: requests.get(url, **kwargs), timeout=10)
+    second = cache.fetch("youtube_listing", "GET", url, lambda **kwargs: requests.get(url, **kwargs), timeout=10)
+    assert first.text == second.text
+    assert standin.requests - before == 1
+    cache.close()
+
+
+def test_streamed_requests_are_not_cached(standin, cache_path):
+    cache = ResponseCache(cache_path, "on")
+    url = f"{standin.base_url}/channel/{channel_id(2)}"
+    before = standin.requests
+    for _ in range(2):
+        response = cache.fetch("channel_page", "GET", url, lambda **kwargs: requests.get(url, **kwargs), stream=True, timeout=10)
+        assert b"og:title" in b"".join(response.iter_content(chunk_size=4096))
+    assert standin.requests - before == 2
+    cache.close()
+
+    with pytest.raises(CacheMissError):
+        ResponseCache(cache_path, "replay").fetch("channel_page", "GET", url, lambda **kwargs: requests.get(url, **kwargs), stream=True)
+
+
+def test_channel_names_are_cached_as_values(standin, cache_path, monkeypatch):
+    monkeypatch.setenv("YOUTUBE_BASE_URL", standin.base_url)
+    cache = ResponseCache(cache_path, "on")
+    monkeypatch.setattr(channel_list_tools, "get_shared_cache", lambda: cache)
+    channel = channel_id(3)
+    name = standin.fixtures.listing_name(channel)
+    before = standin.requests
+    assert channel_list_tools.fetch_channel_name(channel)[:2] == (name, "ok")
+    assert channel_list_tools.fetch_channel_name(channel)[:2] == (name, "ok")
+    assert standin.requests - before == 1
+    cache.close()
+
+    # A recorded name resolves offline
+    replay = ResponseCache(cache_path, "replay")
+    monkeypatch.setattr(channel_list_tools, "get_shared_cache", lambda: replay)
+    assert channel_list_tools.fetch_channel_name(channel)[:2] == (name, "ok")
+    assert channel_list_tools.fetch_channel_name(channel_id(4))[1] == "error"
+    assert standin.requests - before == 1
+    replay.close()
+
+
+def test_channel_list_is_recorded_for_replay(standin, cache_path, tmp_path, monkeypatch):
+    url = f"{standin.base_url}/channel/{channel_id(5)}"
+    local_path = str(tmp_path / "appended_channels.txt")
+    record = ResponseCache(cache_path, "record")
+    monkeypatch.setattr(channel_list_tools, "get_shared_cache", lambda: record)
+    assert channel_list_tools.pull_channel_file(url, local_path)
+    with open(local_path, encoding="utf-8") as f:
+        downloaded = f.read()
+    assert "og:title" in downloaded
+    record.close()
+
+    # Replay serves the recorded list without a request, and reports one that wasn't recorded
+    replay = ResponseCache(cache_path, "replay")
+    monkeypatch.setattr(channel_list_tools, "get_shared_cache", lambda: replay)
+    restored_path = str(tmp_path / "restored.txt")
+    before = standin.requests
+    assert channel_list_tools.pull_channel_file(url, restored_path)
+    with open(restored_path, encoding="utf-8") as f:
+        assert f.read() == downloaded
+    assert channel_list_tools.pull_channel_file(url + "/other", restored_path) is False
+    assert standin.requests == before
+    replay.close()
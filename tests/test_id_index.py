@@ -0,0 +1,104 @@
+import threading
+
+import pytest
+
+from db_backends import SQLiteBackend
+from id_index import ID_WIDTH, ArchivedIdIndex
+from sql_handler import SQLHandler
+
+PREFIX = "https://youtube.com/watch?v="
+
+
+def video_id(i: int) -> str:
+    return f"v{i:010d}"
+
+
+@pytest.fixture
+def index_path(tmp_path):
+    return str(tmp_path / "ids.idx")
+
+
+def test_lookups_binary_search_the_sorted_file(index_path):
+    index = ArchivedIdIndex(index_path)
+    assert "anything" not in index and len(index) == 0
+    ids = [video_id(i) for i in range(0, 2000, 2)]
+    index.add(reversed(ids))
+    index.save()
+    assert not index.pending and len(index) == 1000
+    with open(index_path, "rb") as f:
+        data = f.read()
+    records = [data[i:i + ID_WIDTH] for i in range(0, len(data), ID_WIDTH)]
+    assert records == sorted(records) and len(records) == 1000
+    assert all(vid in index for vid in ids)
+    assert not any(video_id(i) in index for i in range(-1, 2001, 2))
+    # Shorter IDs are padded, so they don't match a longer ID they are a prefix of
+    assert video_id(0)[:-1] not in index
+
+
+def test_save_merges_pending_ids_into_the_file(index_path):
+    index = ArchivedIdIndex(index_path)
+    index.add([video_id(i) for i in range(10)])
+    index.save()
+    index.add([video_id(i) for i in range(5, 15)])
+    assert video_id(12) in index and len(index) == 20
+    index.save()
+    assert len(index) == 15 and not index.pending
+
+    reopened = ArchivedIdIndex(index_path)
+    assert len(reopened) == 15
+    assert all(video_id(i) in reopened for i in range(15)) and video_id(15) not in reopened
+
+
+def test_lookups_during_saves_see_every_id(index_path):
+    index = ArchivedIdIndex(index_path)
+    index.add([video_id(i) for i in range(100)])
+    index.save()
+    errors = []
+    stop = threading.Event()
+
+    def look_up():
+        try:
+            while not stop.is_set():
+                assert all(video_id(i) in index for i in range(0, 100, 7))
+        except Exception as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target=look_up) for _ in range(2)]
+    for reader in readers:
+        reader.start()
+    try:
+        for i in range(100, 120):
+            index.add([video_id(i)])
+            index.save()
+    finally:
+        stop.set()
+        for reader in readers:
+            reader.join()
+    assert not errors
+    assert len(index) == 120
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_DATABASE", "")
+    handler = SQLHandler(backend=SQLiteBackend(str(tmp_path / "songs.db")))
+    yield handler
+    handler.close_connection()
+
+
+def test_sync_pulls_only_rows_past_the_high_water_marks(index_path, server):
+    for i in range(5):
+        server.insert_row("songs", "video_id, title", (video_id(i), f"Song {i}"))
+    server.insert_row("archive_queue", "url, mode", (PREFIX + video_id(100) + "&t=10", 0))
+    index = ArchivedIdIndex(index_path)
+    assert index.sync(server, batch_size=2) == 6
+    assert index.state == {"songs": 5, "archive_queue": 1}
+    assert video_id(100) in index and video_id(4) in index
+
+    server.insert_row("songs", "video_id, title", (video_id(5), "Song 5"))
+    reopened = ArchivedIdIndex(index_path)
+    assert reopened.state == {"songs": 5, "archive_queue": 1}
+    assert reopened.sync(server) == 1
+    assert reopened.state == {"songs": 6, "archive_queue": 1}
+    assert len(reopened) == 7 and video_id(5) in reopened
+    assert reopened.sync(server) == 0
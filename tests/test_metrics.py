@@ -0,0 +1,94 @@
+import json
+import threading
+
+import pytest
+
+from metrics import LATENCY_BUCKETS, METRIC_PREFIX, RunMetrics, StageHistogram
+
+
+def histogram(*seconds: float) -> StageHistogram:
+    result = StageHistogram()
+    for value in seconds:
+        result.observe(value)
+    return result
+
+
+def test_quantile_interpolates_inside_the_bucket():
+    assert histogram().quantile(0.5) == 0.0
+    # Half way through the first bucket, but never above the largest observation
+    assert histogram(*[0.004] * 10).quantile(0.5) == pytest.approx(0.0025)
+    assert histogram(*[0.004] * 10).quantile(0.99) == pytest.approx(0.004)
+    latencies = histogram(*[0.02] * 4 + [0.09] * 4)
+    assert latencies.quantile(0.5) == pytest.approx(0.025)
+    assert latencies.quantile(0.75) == pytest.approx(0.075)
+    assert latencies.quantile(1.0) == pytest.approx(0.09)
+    # The overflow bucket reaches up to the largest observation
+    assert histogram(0.001, 100.0).quantile(0.75) == pytest.approx(LATENCY_BUCKETS[-1] + (100.0 - LATENCY_BUCKETS[-1]) / 2)
+
+
+def test_snapshots_reset_and_merge():
+    worker = RunMetrics()
+    worker.observe("parse", 0.02)
+    worker.incr("pages_fetched", 3)
+    worker.record_verdict("a", True, "Success")
+    worker.record_verdict("b", False, "Too long")
+    snapshot = worker.snapshot(reset=True)
+    assert worker.snapshot() == {"stages": {}, "counters": {}, "rejections": {}}
+
+    parent = RunMetrics()
+    parent.observe("parse", 2.0)
+    parent.merge(snapshot)
+    parent.merge(json.loads(json.dumps(snapshot)))
+    summary = parent.summary()
+    assert summary["counters"] == {"pages_fetched": 6, "videos_invalid": 2, "videos_valid": 2}
+    assert summary["rejections"] == {"Too long": 2}
+    assert summary["stages"]["parse"]["calls"] == 3
+    assert summary["stages"]["parse"]["total"] == pytest.approx(2.04)
+    assert summary["stages"]["parse"]["max"] == 2.0
+
+
+def test_prometheus_buckets_are_cumulative_and_labels_escaped():
+    metrics = RunMetrics()
+    metrics.mode = 'chan"nels'
+    for seconds in (0.001, 0.02, 0.02, 0.7, 90.0):
+        metrics.observe("fetch", seconds)
+    metrics.record_verdict("a", False, 'Title has "live"\\n\nbroken')
+    lines = metrics.prometheus_text().splitlines()
+    labels = 'mode="chan\\"nels",stage="fetch"'
+    buckets = [line for line in lines if line.startswith(f"{METRIC_PREFIX}_stage_seconds_bucket{{{labels},")]
+    assert len(buckets) == len(LATENCY_BUCKETS) + 1
+    counts = [int(line.rsplit(" ", 1)[1]) for line in buckets]
+    assert counts == sorted(counts)
+    assert f'{METRIC_PREFIX}_stage_seconds_bucket{{{labels},le="0.025"}} 3' in lines
+    assert f'{METRIC_PREFIX}_stage_seconds_bucket{{{labels},le="60.0"}} 4' in lines
+    assert f'{METRIC_PREFIX}_stage_seconds_bucket{{{labels},le="+Inf"}} 5' in lines
+    assert f"{METRIC_PREFIX}_stage_seconds_count{{{labels}}} 5" in lines
+    assert f'{METRIC_PREFIX}_rejections_total{{mode="chan\\"nels",reason="Title has \\"live\\"\\\\n\\nbroken"}} 1' in lines
+
+
+def test_events_after_close_are_dropped(tmp_path):
+    path = str(tmp_path / "report.jsonl")
+    metrics = RunMetrics()
+    metrics.open_report(path, "holodex")
+    errors = []
+
+    def write():
+        try:
+            for i in range(200):
+                metrics.record_verdict(str(i), True, "Success")
+        except Exception as e:
+            errors.append(e)
+
+    writers = [threading.Thread(target=write) for _ in range(4)]
+    for writer in writers:
+        writer.start()
+    metrics.close()
+    for writer in writers:
+        writer.join()
+    metrics.record_verdict("late", True, "Success")
+    assert not errors
+    with open(path, encoding="utf-8") as f:
+        events = [json.loads(line) for line in f]
+    assert events[0]["type"] == "run" and [event["type"] for event in events].count("summary") == 1
+    assert all(event["type"] == "verdict" for event in events[1:] if event["type"] != "summary")
+    assert "late" not in {event.get("video_id") for event in events}
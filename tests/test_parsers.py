@@ -0,0 +1,88 @@
+import contextlib
+import io
+import os
+import time
+
+import pytest
+
+import source_parse
+from bench_parsers import reference_channel, reference_playlist, reference_holodex
+
+PAGES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "pages")
+
+# Saved page -> (parser, BeautifulSoup reference, number of videos on the page)
+PARSERS = {
+    "channel_rendered.html": (source_parse.find_all_yt_videos_yt, reference_channel, 240),
+    "playlist_rendered.html": (source_parse.find_all_videos_yt_playlist, reference_playlist, 180),
+    "holodex_search.html": (source_parse.find_all_yt_video_ids_hldex, reference_holodex, 24),
+}
+# The YouTube parsers have to stay at least this many times faster than the reference
+MIN_SPEEDUP = 1.5
+
+
+def read_page(name: str) -> str:
+    with open(os.path.join(PAGES, name), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def quietly(func, *args):
+    # The playlist parser prints every video it finds
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args)
+
+
+@pytest.mark.parametrize("name", PARSERS)
+def test_parser_matches_reference(name):
+    parse, reference, count = PARSERS[name]
+    source = read_page(name)
+    videos = quietly(parse, source)
+    expected = quietly(reference, source)
+    if name == "holodex_search.html":
+        assert sorted(videos) == sorted(expected)
+    else:
+        assert videos == expected
+    assert len(videos) == count
+    # IDs with "-" or "_" are read whole
+    assert all(len(video if isinstance(video, str) else video[0]) == 11 for video in videos)
+
+
+def test_channel_page_durations():
+    videos = source_parse.find_all_yt_videos_yt(read_page("channel_rendered.html"))
+    durations = [duration for _, _, duration in videos]
+    # Live streams show "LIVE", some items have no overlay yet, long streams show hours
+    assert None in durations
+    assert any(duration >= 3600 for duration in durations if duration)
+    assert all(title for _, title, _ in videos)
+
+
+def test_known_ids_are_left_out():
+    source = read_page("playlist_rendered.html")
+    videos = quietly(source_parse.find_all_videos_yt_playlist, source)
+    known = {video_id for video_id, _, _ in videos[::2]}
+    assert quietly(source_parse.find_all_videos_yt_playlist, source, known) == videos[1::2]
+
+
+@pytest.mark.parametrize("name", ["channel_rendered.html", "playlist_rendered.html"])
+def test_parser_is_faster_than_reference(name):
+    parse, reference, _ = PARSERS[name]
+    source = read_page(name)
+
+    def best(func):
+        times = []
+        for _ in range(3):
+            start = time.perf_counter()
+            quietly(func, source)
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    assert best(reference) / best(parse) >= MIN_SPEEDUP
+
+
+@pytest.mark.parametrize("implementation", ["streaming", "beautifulsoup"])
+@pytest.mark.parametrize("name", PARSERS)
+def test_parse_speed(benchmark, name, implementation):
+    parse, reference, count = PARSERS[name]
+    benchmark.group = f"parse {name}"
+    source = read_page(name)
+    videos = benchmark(quietly, parse if implementation == "streaming" else reference, source)
+    assert len(videos) == count
@@ -0,0 +1,88 @@
+import random
+import threading
+import time
+
+from pipeline import Pipeline, Stage
+
+
+def run_with_timeout(pipeline: Pipeline, items, timeout: float = 5.0):
+    runner = threading.Thread(target=pipeline.run, args=(items,), daemon=True)
+    runner.start()
+    runner.join(timeout)
+    assert not runner.is_alive(), "the pipeline didn't shut down"
+
+
+def test_every_item_reaches_the_last_stage_before_it_finishes():
+    collected = []
+
+    def slow_double(item):
+        time.sleep(random.random() / 200)
+        return [item, item]
+
+    pipeline = Pipeline([
+        Stage("double", slow_double, workers=4),
+        Stage("square", lambda item: [item * item], workers=3),
+        Stage("collect", lambda item: collected.append(item), workers=2),
+    ], queue_size=2)
+    run_with_timeout(pipeline, range(50))
+    # The next stage only gets the end marker once all workers of a stage have finished their items
+    assert sorted(collected) == sorted([i * i for i in range(50)] * 2)
+
+
+def test_more_workers_than_items_shut_down():
+    seen = []
+    pipeline = Pipeline([Stage("first", lambda item: [item], workers=8), Stage("last", seen.append, workers=8)])
+    run_with_timeout(pipeline, [1, 2])
+    assert sorted(seen) == [1, 2]
+    run_with_timeout(pipeline, [])
+
+
+def test_errors_go_to_on_error_and_the_rest_flows_on():
+    errors = []
+    collected = []
+
+    def check(item):
+        if item == 3:
+            raise ValueError("three")
+        if item == 5:
+            raise SystemExit(1)
+        return [item]
+
+    pipeline = Pipeline([Stage("check", check, workers=2), Stage("collect", collected.append)],
+                        on_error=lambda stage, item, err: errors.append((stage, item, type(err))))
+    run_with_timeout(pipeline, range(8))
+    assert sorted(errors) == [("check", 3, ValueError), ("check", 5, SystemExit)]
+    assert sorted(collected) == [0, 1, 2, 4, 6, 7]
+
+
+def test_errors_are_printed_without_on_error(capsys):
+    def fail(item):
+        raise RuntimeError("boom")
+
+    run_with_timeout(Pipeline([Stage("fail", fail)]), [1])
+    assert "Stage fail failed on 1: boom" in capsys.readouterr().out
+
+
+def test_a_blocked_stage_holds_back_the_producer():
+    produced = []
+    done = []
+    release = threading.Event()
+
+    def items():
+        for i in range(20):
+            produced.append(i)
+            yield i
+
+    def last(item):
+        release.wait(5)
+        done.append(item)
+
+    pipeline = Pipeline([Stage("first", lambda item: [item]), Stage("last", last)], queue_size=1)
+    runner = threading.Thread(target=pipeline.run, args=(items(),), daemon=True)
+    runner.start()
+    time.sleep(0.2)
+    # One item in each worker and queue, plus the one the producer is blocked on
+    assert len(produced) == 5 and not done
+    release.set()
+    runner.join(5)
+    assert done == list(range(20))
@@ -0,0 +1,95 @@
+import socket
+
+import pytest
+import requests
+import urllib3
+
+from rate_limit import RateLimiter, TokenBucket, parse_budgets, never_sent
+
+
+class ScriptedSession:
+    def __init__(self, *outcomes):
+        """
+        Answers requests with the given statuses, or raises the given exceptions, in order
+        """
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        response = requests.Response()
+        response.status_code = outcome
+        response.headers["Retry-After"] = "0"
+        return response
+
+
+def limiter() -> RateLimiter:
+    return RateLimiter({"queue.test": (0, 1)}, base_delay=0.001)
+
+
+def test_rate_of_zero_is_unlimited():
+    assert parse_budgets("queue.test=0") == {"queue.test": (0.0, 1)}
+    bucket = TokenBucket(0, 1)
+    for _ in range(100):
+        bucket.acquire()
+
+
+def test_negative_rate_is_rejected():
+    with pytest.raises(ValueError):
+        parse_budgets("queue.test=-1")
+
+
+def test_budgets_are_split_between_processes():
+    bucket, _ = RateLimiter({"queue.test": (8.0, 16)}, processes=4)._host_state("queue.test")
+    assert (bucket.rate, bucket.burst) == (2.0, 4)
+
+
+def test_get_is_retried_on_server_errors():
+    session = ScriptedSession(503, 502, 200)
+    assert limiter().request("GET", "http://queue.test/", session=session).status_code == 200
+    assert session.calls == 3
+
+
+def test_post_is_not_retried_on_server_errors():
+    session = ScriptedSession(503, 200)
+    assert limiter().request("POST", "http://queue.test/", session=session).status_code == 503
+    assert session.calls == 1
+
+
+def test_post_is_retried_when_throttled():
+    session = ScriptedSession(429, 200)
+    assert limiter().request("POST", "http://queue.test/", session=session).status_code == 200
+    assert session.calls == 2
+
+
+def test_read_only_post_is_retried_on_server_errors():
+    session = ScriptedSession(500, 200)
+    assert limiter().request("POST", "http://queue.test/", session=session, idempotent=True).status_code == 200
+    assert session.calls == 2
+
+
+def test_post_is_not_retried_after_the_connection_broke():
+    session = ScriptedSession(requests.ConnectionError(urllib3.exceptions.ProtocolError("Connection aborted.")), 200)
+    with pytest.raises(requests.ConnectionError):
+        limiter().request("POST", "http://queue.test/", session=session)
+    assert session.calls == 1
+
+
+def test_post_is_retried_when_it_never_connected():
+    session = ScriptedSession(requests.ConnectTimeout(), 200)
+    assert limiter().request("POST", "http://queue.test/", session=session).status_code == 200
+    assert session.calls == 2
+
+
+def test_refused_connection_counts_as_never_sent():
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    port = server.getsockname()[1]
+    server.close()
+    with pytest.raises(requests.ConnectionError) as error:
+        requests.post(f"http://127.0.0.1:{port}/queue", data={"url": "x"}, timeout=5)
+    assert never_sent(error.value)
+    assert not never_sent(requests.ReadTimeout())
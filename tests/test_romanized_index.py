@@ -0,0 +1,78 @@
+import pytest
+
+import sql_handler
+from db_backends import SQLiteBackend
+from romanized_index import RomanizedIndex
+
+TITLES = {"vid_a": "kimi no na wa", "vid_b": "kimi ga suki", "vid_c": "kimi to boku", "vid_d": "ashita no kimi"}
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_DATABASE", "")
+    handler = sql_handler.SQLHandler(backend=SQLiteBackend(str(tmp_path / "songs.db")))
+    for video_id, title in TITLES.items():
+        handler.execute_query("INSERT INTO romanized (video_id, romanized_title) VALUES (%s, %s)", (video_id, title))
+    # Only some of the romanized videos are songs
+    for video_id in ("vid_a", "vid_b"):
+        handler.execute_query("INSERT INTO songs (video_id, title) VALUES (%s, %s)", (video_id, TITLES[video_id]))
+    handler.connection.commit()
+    yield handler
+    handler.close_connection()
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    index = RomanizedIndex(str(tmp_path / "romanized_index.json"))
+    monkeypatch.setattr(sql_handler, "get_shared_romanized_index", lambda: index)
+    return index
+
+
+def write(server, query: str, params: tuple = ()):
+    server.execute_query(query, params)
+    server.connection.commit()
+
+
+def test_search_counts_only_the_tables_videos(server, index):
+    rows, count = server.search_romanized("songs", ["kimi"], limit=10)
+    assert count == 2
+    assert sorted(row[1] for row in rows) == ["vid_a", "vid_b"]
+    # Without table_name the index counts every romanized title, including those of videos not in songs
+    assert index.search(["kimi"])[1] == 4
+
+    write(server, "INSERT INTO songs (video_id, title) VALUES (%s, %s)", ("vid_c", TITLES["vid_c"]))
+    index.refresh_interval = 0
+    assert server.search_romanized("songs", ["kimi"], limit=10)[1] == 3
+
+
+def test_unsynced_table_matches_nothing(index):
+    index.add(TITLES.items())
+    assert index.search(["kimi"], table_name="songs") == ([], 0)
+
+
+def test_full_resync_picks_up_edits_and_deletes(server, index):
+    index.sync(server)
+    write(server, "UPDATE romanized SET romanized_title = %s WHERE video_id = %s", ("sayonara no natsu", "vid_a"))
+    write(server, "DELETE FROM romanized WHERE video_id = %s", ("vid_b",))
+
+    # Rows above the high-water mark are all an incremental sync sees
+    assert index.sync(server) == 0
+    assert index.search(["kimi"])[1] == 4
+
+    assert index.sync(server, full=True) == 2
+    assert index.search(["kimi"])[1] == 2
+    assert index.search(["natsu"])[0] == ["vid_a"]
+
+
+def test_refresh_resyncs_when_the_last_full_sync_is_old(server, index):
+    index.refresh(server)
+    write(server, "UPDATE romanized SET romanized_title = %s WHERE video_id = %s", ("sayonara no natsu", "vid_a"))
+
+    # A restart within resync_interval of the last full sync stays incremental
+    restarted = RomanizedIndex(index.path, refresh_interval=0)
+    restarted.refresh(server)
+    assert restarted.search(["natsu"]) == ([], 0)
+
+    restarted.resync_interval = 0
+    restarted.refresh(server)
+    assert restarted.search(["natsu"]) == (["vid_a"], 1)
@@ -0,0 +1,78 @@
+import pytest
+
+from crawl_state import CrawlState
+from scheduler import BASELINE_INTERVAL, DAY, DEFAULT_CRAWL_SECONDS, MAX_INTERVAL, MIN_INTERVAL, CrawlScheduler
+
+NOW = 1_700_000_000.0
+
+
+@pytest.fixture
+def state(tmp_path):
+    store = CrawlState(str(tmp_path / "crawl_state.db"))
+    yield store
+    store.close()
+
+
+def seed(state: CrawlState, channels: dict):
+    """
+    Store channel activity as record_crawl would have left it
+    :param channels: A dict of channel ID to (upload rate, yield rate, days since the last crawl, average duration)
+    """
+    for channel_id, (upload_rate, yield_rate, days_ago, avg_duration) in channels.items():
+        state.connection.execute("INSERT INTO channel_activity "
+                                 "(channel_id, upload_rate, yield_rate, last_crawled, last_yield, avg_duration, crawls) "
+                                 "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                 (channel_id, upload_rate, yield_rate, NOW - days_ago * DAY, None, avg_duration, 2))
+    state.connection.commit()
+
+
+@pytest.mark.parametrize("upload_rate, interval", [
+    (None, BASELINE_INTERVAL),
+    (0.0, MAX_INTERVAL),
+    (0.01, MAX_INTERVAL),
+    (1.0, DAY),
+    (2.0, DAY / 2),
+    (100.0, MIN_INTERVAL),
+])
+def test_interval_is_clamped(upload_rate, interval):
+    assert CrawlScheduler.interval((upload_rate, None, NOW, None, 10.0, 1)) == interval
+
+
+def test_due_channels_are_ranked_by_expected_yield_per_second(state):
+    seed(state, {
+        "busy": (4.0, 2.0, 0.5, 10.0),         # due after 6h, 1 expected valid video in 10s
+        "no_yield": (4.0, 0.0, 0.5, 10.0),     # due, but only a quarter of the upload rate counts
+        "unmeasured": (None, None, 2.0, 10.0),  # crawled once, two baseline intervals ago
+        "quiet": (0.1, 0.1, 2.0, 10.0),        # due after 10 days
+    })
+    scheduler = CrawlScheduler(state)
+    assert scheduler.priority("new_1", NOW) == (True, float("inf"))
+    assert scheduler.priority("busy", NOW) == (True, pytest.approx(0.1))
+    assert scheduler.priority("no_yield", NOW) == (True, pytest.approx(0.05))
+    assert scheduler.priority("unmeasured", NOW) == (True, pytest.approx(0.2))
+    assert scheduler.priority("quiet", NOW)[0] is False
+
+    candidates = ["quiet", "no_yield", "new_2", "busy", "unmeasured", "new_1"]
+    # New channels keep their list order
+    assert scheduler.plan(candidates, now=NOW) == ["new_2", "new_1", "unmeasured", "busy", "no_yield"]
+    assert scheduler.plan(candidates, include_not_due=True, now=NOW)[-1] == "quiet"
+    assert scheduler.plan(candidates, max_channels=3, now=NOW) == ["new_2", "new_1", "unmeasured"]
+
+
+def test_plan_packs_the_budget_over_workers(state):
+    # All due; expected yield per second falls from a to d while the crawl times differ
+    seed(state, {
+        "a": (10.0, 400.0, 1.0, 40.0),
+        "b": (10.0, 270.0, 1.0, 30.0),
+        "c": (10.0, 120.0, 1.0, 15.0),
+        "d": (10.0, 35.0, 1.0, 5.0),
+    })
+    scheduler = CrawlScheduler(state)
+    channels = ["d", "c", "b", "a"]
+    assert scheduler.plan(channels, now=NOW) == ["a", "b", "c", "d"]
+    # 60s over two workers: b doesn't fit after a, the cheaper channels after it still do
+    assert scheduler.plan(channels, time_budget=30.0, workers=2, now=NOW) == ["a", "c", "d"]
+    # 30s on one worker: a alone is over budget
+    assert scheduler.plan(channels, time_budget=30.0, now=NOW) == ["b"]
+    assert scheduler.plan(channels, time_budget=30.0, workers=2, max_channels=2, now=NOW) == ["a", "c"]
+    assert scheduler.plan(channels + ["new"], time_budget=DEFAULT_CRAWL_SECONDS, now=NOW) == ["new"]
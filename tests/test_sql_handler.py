@@ -0,0 +1,69 @@
+import pytest
+
+from db_backends import SQLiteBackend
+from sql_handler import SQLHandler
+
+PREFIX = "https://youtube.com/watch?v="
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_DATABASE", "")
+    handler = SQLHandler(backend=SQLiteBackend(str(tmp_path / "songs.db")))
+    yield handler
+    handler.close_connection()
+
+
+def test_bulk_enqueue_outcomes(server):
+    server.insert_row("songs", "video_id, title", ("vid_archived", "Archived"))
+    server.insert_row("archive_queue", "url, mode", (PREFIX + "vid_queued", 0))
+    video_ids = ["vid_archived", "vid_queued", "vid_new_1", "vid_new_2", "vid_new_1"]
+    assert server.bulk_enqueue(video_ids, PREFIX, chunk_size=2) == {
+        "vid_archived": "archived", "vid_queued": "queued", "vid_new_1": "enqueued", "vid_new_2": "enqueued"}
+    assert sorted(url for url, in server.execute_query("SELECT url FROM archive_queue")) == [
+        PREFIX + "vid_new_1", PREFIX + "vid_new_2", PREFIX + "vid_queued"]
+
+
+def test_invalid_identifiers_are_reported_like_failed_queries(server, capsys):
+    bad_name = "songs; DROP TABLE songs"
+    assert server.insert_row(bad_name, "video_id", ("vid",)) is False
+    assert server.insert_row("songs", bad_name, ("vid",)) is False
+    assert server.check_row_exists(bad_name, "video_id", "vid") is None
+    server.update_row("songs", bad_name, "vid", "title", "New title")
+    assert server.delete_row(bad_name, "video_id", ("vid",)) is False
+    assert server.get_random_row("songs; x") is None
+    assert server.get_random_row("songs", key_column=bad_name) is None
+    assert server.search_videos(bad_name, ["a"]) is None
+    assert server.search_videos("songs", ["a"], key_column=bad_name) is None
+    assert server.search_video_row(bad_name, ["a"]) is None
+    assert server.search_romanized(bad_name, ["a"]) is None
+    assert capsys.readouterr().out.count("Invalid SQL identifier") == 11
+    assert server.execute_query("SELECT COUNT(*) FROM songs") == [(0,)]
+
+
+def test_search_pages_follow_the_key(server):
+    for i in range(25):
+        server.insert_row("songs", "video_id, title", (f"vid{i:02d}", f"Cover {i} {'Live' if i % 2 else 'Studio'}"))
+    rows, count, cursor = server.search_videos("songs", ["cover", "LIVE"], limit=5)
+    assert count == 12 and cursor == rows[-1][0]
+    pages = [rows]
+    while cursor is not None:
+        rows, count, cursor = server.search_videos("songs", ["cover", "live"], limit=5, after=cursor, count=False)
+        assert count is None
+        pages.append(rows)
+    assert [len(page) for page in pages] == [5, 5, 2]
+    video_ids = [row[1] for page in pages for row in page]
+    assert video_ids == [f"vid{i:02d}" for i in range(1, 25, 2)]
+
+    # A last page that is exactly full has no next page either
+    rows, _, cursor = server.search_videos("songs", ["studio"], limit=13)
+    assert len(rows) == 13 and cursor is None
+    assert server.search_videos("songs", ["karaoke"]) == ([], 0, None)
+
+
+def test_search_count_can_be_capped(server):
+    for i in range(10):
+        server.insert_row("songs", "video_id, title", (f"vid{i:02d}", f"Cover {i}"))
+    assert server.search_videos("songs", ["cover"], limit=2, count_limit=4)[1] == 4
+    assert server.search_videos("songs", ["cover"], limit=2, count_limit=50)[1] == 10
+    assert server.search_videos("songs", ["cover 3"], count_limit=4)[1] == 1
@@ -0,0 +1,53 @@
+import pytest
+
+from source_parse import classify_music_titles, is_potentially_music_content
+from title_classifier import TitleClassifier
+
+# Upload titles in the forms channels use, with the verdict the classifier should give
+TITLES = [
+    ("【歌ってみた】KING / 星街すいせい(Cover)", True),
+    ("Covered this song for my birthday!", True),
+    ("I covered the whole album", True),
+    ("ＫＩＮＧ ／ 星街すいせい（ｃｏｖｅｒ）", True),
+    ("【ｵﾘｼﾞﾅﾙ曲】ヒバナ", True),
+    ("【オリジナルMV】ヒバナ / 宝鐘マリン", True),
+    # The legacy scan missed these: the terms weren't in its list
+    ("【翻唱】千本桜 - IRyS", True),
+    ("夜に駆ける 커버 by Mori Calliope", True),
+    ("Lemon 弾き語り【湊あくあ】", True),
+    ("アイドル (piano ver.) / さくらみこ", True),
+    # The legacy scan took these for music: its keywords only appear inside other words
+    ("Discovering Hololive for the first time", False),
+    ("【APEX】MVP取るまで終われない【湊あくあ】", False),
+    # Non-music terms outweigh a weak hint
+    ("【雑談】新曲の話とか【宝鐘マリン】", False),
+    ("【Minecraft】歌いながら建築【さくらみこ】", False),
+    ("【雑談】おはよう！", False),
+]
+
+
+@pytest.mark.parametrize("title, is_music", TITLES)
+def test_titles(title, is_music):
+    assert is_potentially_music_content(title)[0] is is_music
+
+
+def test_reasons():
+    assert is_potentially_music_content("【雑談】おはよう！") == (False, "Non-music keywords found")
+    assert is_potentially_music_content("Good morning") == (False, "No music keywords found")
+    assert classify_music_titles([title for title, _ in TITLES]) == [is_potentially_music_content(title) for title, _ in TITLES]
+
+
+def test_terms_are_escaped():
+    classifier = TitleClassifier({"]x": 1.0, "^y": 1.0, "\\z": 1.0, "-w": 1.0}, {})
+    for term in ("]x", "^y", "\\z", "-w"):
+        assert classifier.score(f"a {term} b").matched == (term,)
+
+
+def test_katakana_terms_match_either_kana():
+    classifier = TitleClassifier({"カバー": 1.0}, {})
+    assert classifier.score("かばー").is_music and classifier.score("ｶﾊﾞｰ").is_music
+
+
+def test_scores_are_shared_between_titles():
+    classifier = TitleClassifier()
+    assert classifier.score("Lemon (Cover)") is classifier.score("KING cover")
@@ -0,0 +1,187 @@
+from typing import NamedTuple
+import json
+import os
+import re
+import threading
+import unicodedata
+
+# Terms that mark a title as music. 1.0 is enough on its own, weaker hints need company
+DEFAULT_MUSIC_KEYWORDS = {
+    # English
+    "cover": 1.0, "covers": 1.0, "covered": 1.0, "covering": 1.0, "covered by": 1.0, "original": 1.0, "originals": 1.0,
+    "original song": 1.0, "mv": 1.0, "music video": 1.0,
+    "official": 1.0, "official video": 1.0, "lyric video": 1.0, "lyrics": 0.5, "remix": 1.0, "acoustic": 1.0,
+    "acapella": 1.0, "a cappella": 1.0, "piano ver": 1.0, "ver.": 0.5, "version": 0.5, "feat.": 0.5, "ft.": 0.5,
+    "song": 0.5, "sing": 0.5, "sang": 0.5, "singing": 0.5, "vocal": 0.5, "karaoke": 0.5, "3d live": 0.5,
+    "original mv": 1.0, "animated mv": 1.0, "self cover": 1.0, "duet": 0.5, "medley": 1.0, "mashup": 1.0,
+    # Japanese (matched after kana folding, so katakana and hiragana spellings are the same)
+    "歌ってみた": 1.0, "うたってみた": 1.0, "歌ってみました": 1.0, "歌いました": 1.0, "弾いてみた": 1.0, "弾き語り": 1.0,
+    "オリジナル曲": 1.0, "オリジナルソング": 1.0, "オリジナル": 0.5, "カバー": 1.0, "新曲": 1.0, "歌枠": 0.5, "歌": 0.5,
+    "ミュージックビデオ": 1.0, "アカペラ": 1.0, "歌詞": 0.5, "公式": 0.5, "ボカロ": 0.5, "メドレー": 1.0,
+    # Chinese and Korean
+    "翻唱": 1.0, "原创": 1.0, "原創": 1.0, "原创歌曲": 1.0, "커버": 1.0, "뮤직비디오": 1.0, "노래": 0.5, "자작곡": 1.0,
+    # Spanish and Portuguese
+    "canción": 0.5, "cancion": 0.5, "versión": 0.5, "música": 0.5,
+}
+
+# Terms that mark a title as something else (games, talk, reactions). They subtract from the score
+DEFAULT_NEGATIVE_KEYWORDS = {
+    "minecraft": 1.0, "apex": 1.0, "valorant": 1.0, "pokemon": 0.5, "gameplay": 1.0, "playthrough": 1.0,
+    "let's play": 1.0, "reaction": 1.0, "react": 0.5, "watchalong": 1.0, "zatsudan": 1.0, "asmr": 1.0,
+    "tutorial": 1.0, "unboxing": 1.0, "q&a": 0.5, "clip": 0.5, "highlights": 0.5, "vlog": 1.0,
+    "雑談": 1.0, "マイクラ": 1.0, "ゲーム": 0.5, "同時視聴": 1.0, "切り抜き": 1.0, "実況": 1.0, "料理": 0.5, "耐久": 0.5,
+}
+
+DEFAULT_THRESHOLD = 1.0
+
+# Distinct sets of matched terms kept per classifier. Titles reuse a handful of combinations
+SCORE_CACHE_SIZE = 4096
+
+# Folds katakana onto hiragana so either spelling matches
+_KANA_FOLD = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+
+
+def normalize_title(title: str) -> str:
+    """
+    Fold a title for matching: NFKC (full/half width), Unicode casefold and katakana to hiragana
+    :param title: The title
+    :return: The folded title
+    """
+    return unicodedata.normalize("NFKC", title).casefold().translate(_KANA_FOLD)
+
+
+def _char_variants(char: str) -> str:
+    # Hiragana in a term also matches its katakana, so titles don't need the (slow) kana translate
+    if "\u3041" <= char <= "\u3096":
+        return char + chr(ord(char) + 0x60)
+    return char
+
+
+def _char_pattern(char: str) -> str:
+    variants = _char_variants(char)
+    return re.escape(variants) if len(variants) == 1 else f"[{re.escape(variants)}]"
+
+
+def _trie_pattern(terms) -> str:
+    """
+    Build a regex matching any of the terms, with shared prefixes factored out ("cover", "covered by"
+    -> "cover(?:ed by)?"). Optional tails are greedy, so the longest term at a position wins
+    :param terms: The folded terms
+    :return: The regex source
+    """
+    trie = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node) -> str:
+        branches = [_char_pattern(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+class TitleScore(NamedTuple):
+    is_music: bool
+    score: float
+    matched: tuple[str, ...]
+    negatives: tuple[str, ...]
+
+
+class TitleClassifier:
+    def __init__(self, keywords: dict[str, float] = None, negatives: dict[str, float] = None, threshold: float = DEFAULT_THRESHOLD):
+        """
+        Scores titles against weighted music and non-music terms, compiled into one regex.
+        ASCII terms only match whole words; other terms match anywhere
+        :param keywords: A dict of music term to weight. Defaults to DEFAULT_MUSIC_KEYWORDS
+        :param negatives: A dict of non-music term to weight. Defaults to DEFAULT_NEGATIVE_KEYWORDS
+        :param threshold: The minimum score of a music title
+        """
+        keywords = DEFAULT_MUSIC_KEYWORDS if keywords is None else keywords
+        negatives = DEFAULT_NEGATIVE_KEYWORDS if negatives is None else negatives
+        self.threshold = threshold
+        # Folded term -> (weight, original term); negatives are stored with a negative weight
+        self.terms = {}
+        for term, weight in keywords.items():
+            self.terms[normalize_title(term)] = (float(weight), term)
+        for term, weight in negatives.items():
+            self.terms[normalize_title(term)] = (-float(weight), term)
+        self.pattern = self._compile(self.terms)
+        # Frozen set of matched texts -> TitleScore. Results are immutable, so they are shared
+        self._scores = {}
+
+    @staticmethod
+    def _compile(terms) -> re.Pattern:
+        word_terms = [term for term in terms if term.isascii()]
+        cjk_terms = [term for term in terms if not term.isascii()]
+        parts = []
+        if word_terms:
+            # Titles are casefolded, so only lowercase ASCII letters and digits can extend a word.
+            # Japanese text right next to a term ("オリジナルMV") doesn't stop it from matching
+            parts.append(r"(?<![a-z0-9])" + _trie_pattern(word_terms) + r"(?![a-z0-9])")
+        if cjk_terms:
+            parts.append(_trie_pattern(cjk_terms))
+        if not parts:
+            return re.compile(r"(?!)")
+        # Checking the first character up front lets the engine skip most positions without trying every branch
+        first = "".join(sorted({re.escape(char) for term in terms for char in _char_variants(term[0])}))
+        return re.compile(f"(?=[{first}])(?:" + "|".join(parts) + ")")
+
+    @classmethod
+    def from_file(cls, path: str) -> "TitleClassifier":
+        """
+        Load a classifier from a JSON file of the form {"keywords": {term: weight}, "negatives": {term: weight}, "threshold": 1.0}.
+        Missing sections use the defaults
+        :param path: The path of the JSON file
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        return cls(config.get("keywords"), config.get("negatives"), config.get("threshold", DEFAULT_THRESHOLD))
+
+    def _score_terms(self, found: frozenset[str]) -> TitleScore:
+        result = self._scores.get(found)
+        if result is None:
+            if len(self._scores) >= SCORE_CACHE_SIZE:
+                self._scores.clear()
+            result = self._scores[found] = self._sum_terms(found)
+        return result
+
+    def _sum_terms(self, found: frozenset[str]) -> TitleScore:
+        score = 0.0
+        matched = []
+        negatives = []
+        for text in found:
+            # Matches keep the title's kana, the terms are stored folded
+            weight, term = self.terms.get(text) or self.terms[text.translate(_KANA_FOLD)]
+            score += weight
+            (matched if weight > 0 else negatives).append(term)
+        return TitleScore(score >= self.threshold, score, tuple(sorted(matched)), tuple(sorted(negatives)))
+
+    def score(self, title: str) -> TitleScore:
+        """
+        Score a single title
+        :param title: The title
+        :return: Whether it is music, its score and the music and non-music terms it matched
+        """
+        return self._score_terms(frozenset(self.pattern.findall(unicodedata.normalize("NFKC", title).casefold())))
+
+
+_shared_classifier = None
+_shared_classifier_lock = threading.Lock()
+
+
+def get_shared_classifier() -> TitleClassifier:
+    """
+    Get the process wide classifier. The MUSIC_KEYWORDS_FILE env variable can point to a JSON term list
+    """
+    global _shared_classifier
+    with _shared_classifier_lock:
+        if _shared_classifier is None:
+            path = os.getenv("MUSIC_KEYWORDS_FILE")
+            _shared_classifier = TitleClassifier.from_file(path) if path else TitleClassifier()
+        return _shared_classifier
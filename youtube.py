@@ -1,70 +1,288 @@
-import channel_list_tools
-from site_scraper  import SiteScraper
-from source_parse import find_all_yt_videos_yt, parse_title_yt_video, find_all_videos_yt_playlist, is_potentially_music_content
+from site_scraper  import SiteScraper, ScraperPool
+from source_parse import find_all_yt_videos_yt, parse_title_yt_video, find_all_videos_yt_playlist, classify_music_titles
+from youtube_listing import YouTubeListingClient
+from crawl_state import CrawlState, ChannelProgress, iter_until_seen
+from rate_limit import get_rate_limiter
+from http_cache import get_shared_cache
+from checkpoint import CheckpointJournal
+from metrics import get_shared_metrics
+from collections import Counter
+import itertools
+import threading
+import time
 import yt_dlp
-import os
 
-def scrape_yt_playlist(playlist_url: str, scraper: SiteScraper) -> list[str, str]:
+# Elements that only exist once the video list has rendered
+CHANNEL_GRID_SELECTOR = "ytd-rich-grid-media"
+PLAYLIST_ITEM_SELECTOR = "ytd-playlist-video-renderer"
+
+# How many listed titles are classified per batch
+CLASSIFY_BATCH_SIZE = 50
+
+_listing_client = None
+_listing_client_lock = threading.Lock()
+
+# How each video duration was obtained: from_listing, watch_page, full_extraction or unavailable
+duration_lookups = Counter()
+_duration_lookups_lock = threading.Lock()
+
+def _batched(iterable, size: int):
+    """
+    Yield lists of up to size items, pulling from iterable only as each list is needed
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def scrape_yt_playlist(playlist_url: str, scraper: SiteScraper, known_ids=None) -> list[str, str]:
     """
     Scrapes a YouTube playlist for all videos
+    :param known_ids: Optional container of video IDs to skip (e.g. an ArchivedIdIndex)
     """
     if not playlist_url.startswith("https://www.youtube.com/playlist?list="):
         playlist_url = "https://www.youtube.com/playlist?list=" + playlist_url
-    playlist_page_raw_data = scraper.get_page_source(playlist_url)
-    return find_all_videos_yt_playlist(playlist_page_raw_data)
+    metrics = get_shared_metrics()
+    with metrics.timer("page_fetch"):
+        playlist_page_raw_data = scraper.get_page_source(playlist_url, ready_selector=PLAYLIST_ITEM_SELECTOR)
+    metrics.incr("pages_fetched")
+    with metrics.timer("parse"):
+        videos = find_all_videos_yt_playlist(playlist_page_raw_data, known_ids)
+    metrics.incr("videos_found", len(videos))
+    return videos
 
 
-def scrape_yt_channel_videos(channel_url: str, scraper: SiteScraper) -> tuple[str, str]:
+def scrape_yt_channel_videos(channel_url: str, scraper: SiteScraper, known_ids=None) -> tuple[str, str]:
     """
     Scrapes a YouTube channel for all videos and their titles
+    :param known_ids: Optional container of video IDs to skip (e.g. an ArchivedIdIndex)
     """
-    channel_video_raw_data = scraper.get_page_source(channel_url)
-    video_tuples = find_all_yt_videos_yt(channel_video_raw_data)
+    metrics = get_shared_metrics()
+    with metrics.timer("page_fetch"):
+        channel_video_raw_data = scraper.get_page_source(channel_url, ready_selector=CHANNEL_GRID_SELECTOR)
+    metrics.incr("pages_fetched")
+    with metrics.timer("parse"):
+        video_tuples = find_all_yt_videos_yt(channel_video_raw_data, known_ids)
+    metrics.incr("videos_found", len(video_tuples))
     return video_tuples
 
-def get_videos_in_playlist(playlist_url: str,  min_time: int = 65, max_time: int = 480, wait_time: int = 10):
-    chrome_driver_path = os.getenv("CHROME_DRIVER_PATH")
-    if chrome_driver_path is None:
-        chrome_driver_path = "/usr/bin/chromedriver"
-    scraper = SiteScraper(chrome_driver_path=chrome_driver_path, wait_time=wait_time)
-    return scrape_yt_playlist(playlist_url, scraper)
+def _list_with_fallback(http_listing, browser_listing, label: str, known_ids=None):
+    """
+    Yield from the HTTP listing, switching to the browser when the HTTP backend fails or the page
+    lists no videos at all. A page whose videos are all known is a normal result, so both listings
+    are read unfiltered and known_ids is applied here. Videos already yielded before a failure are
+    not repeated
+    :param known_ids: Optional container of video IDs to leave out
+    """
+    listed = set()
+    try:
+        for video_id, title, duration in http_listing():
+            listed.add(video_id)
+            if known_ids is None or video_id not in known_ids:
+                yield video_id, title, duration
+        if listed:
+            return
+        print(f"[YouTube Parse] HTTP listing found no videos for {label}. Falling back to the browser")
+    except Exception as e:
+        print(f"[YouTube Parse] HTTP listing failed for {label}: {e}. Falling back to the browser")
+    for video_id, title, duration in browser_listing():
+        if video_id not in listed and (known_ids is None or video_id not in known_ids):
+            yield video_id, title, duration
+
+
+def _list_with_browser(scrape, url: str, pool: ScraperPool, wait_time: int, known_ids=None):
+    own_pool = pool is None
+    if own_pool:
+        pool = ScraperPool(wait_time=wait_time)
+    try:
+        with pool.acquire() as scraper:
+            videos = scrape(url, scraper, known_ids)
+    finally:
+        if own_pool:
+            pool.close()
+    for video_id, title, duration in videos:
+        yield video_id, title, duration
 
-def get_content_youtube_channel(channel_id: str, min_time: int = 65, max_time: int = 480, wait_time: int = 5) -> tuple[list[str], list[tuple[str, str]]]:
+
+def get_listing_client() -> YouTubeListingClient:
+    """
+    Get the process wide HTTP listing client, creating it on first use
+    """
+    global _listing_client
+    with _listing_client_lock:
+        if _listing_client is None:
+            _listing_client = YouTubeListingClient()
+        return _listing_client
+
+
+def list_channel_videos(channel_id: str, backend: str = "browser", pool: ScraperPool = None, wait_time: int = 5, known_ids=None):
+    """
+    Lazily list a channel's uploads
+    :param channel_id: The UC... channel ID
+    :param backend: "http" to read the embedded JSON (falling back to the browser) or "browser"
+    :param pool: A shared pool of browsers. A single browser is started (and closed) when needed and None
+    :param wait_time: The maximum time to wait for the page to render in the browser
+    :param known_ids: Optional container of video IDs to leave out
+    :return: A generator of (video ID, title, duration in seconds or None) tuples
+    """
+    url = "https://www.youtube.com/channel/"+channel_id+"/videos"
+    if backend == "http":
+        return _list_with_fallback(lambda: get_listing_client().iter_channel_videos(channel_id),
+                                   lambda: _list_with_browser(scrape_yt_channel_videos, url, pool, wait_time), channel_id, known_ids)
+    return _list_with_browser(scrape_yt_channel_videos, url, pool, wait_time, known_ids)
+
+
+def list_playlist_videos(playlist_url: str, backend: str = "browser", pool: ScraperPool = None, wait_time: int = 10, known_ids=None):
+    """
+    Lazily list a playlist's items
+    :param playlist_url: The playlist ID or URL
+    :param backend: "http" to read the embedded JSON (falling back to the browser) or "browser"
+    :param pool: A shared pool of browsers. A single browser is started (and closed) when needed and None
+    :param wait_time: The maximum time to wait for the page to render in the browser
+    :param known_ids: Optional container of video IDs to leave out
+    :return: A generator of (video ID, title, duration in seconds or None) tuples
+    """
+    if backend == "http":
+        return _list_with_fallback(lambda: get_listing_client().iter_playlist_videos(playlist_url),
+                                   lambda: _list_with_browser(scrape_yt_playlist, playlist_url, pool, wait_time), playlist_url, known_ids)
+    return _list_with_browser(scrape_yt_playlist, playlist_url, pool, wait_time, known_ids)
+
+
+def _count_duration_lookup(source: str):
+    with _duration_lookups_lock:
+        duration_lookups[source] += 1
+    get_shared_metrics().incr(f"duration_{source}")
+
+
+def resolve_video_duration(video_id: str, listed_duration: int = None, ytdl: yt_dlp.YoutubeDL = None) -> int:
+    """
+    Get a video's duration as cheaply as possible. The duration shown in the listing is used when
+    there is one. Otherwise the watch page's embedded player response is read over HTTP, and
+    yt_dlp is only run when that fails too
+    :param video_id: The video ID
+    :param listed_duration: The duration from the channel or playlist listing, if any
+    :param ytdl: The yt_dlp instance to use for the full extraction
+    :return: The duration in seconds, or None if the video has none
+    """
+    if listed_duration:
+        _count_duration_lookup("from_listing")
+        return listed_duration
+    try:
+        duration = get_listing_client().get_video_duration(video_id)
+    except Exception:
+        duration = None
+    if duration:
+        _count_duration_lookup("watch_page")
+        return duration
+    cache = get_shared_cache()
+    cached = cache.get_value("yt_dlp", video_id) if cache.enabled else None
+    if cached is not None:
+        _count_duration_lookup("cached_extraction")
+        duration = cached["duration"]
+    else:
+        if ytdl is None:
+            ytdl = yt_dlp.YoutubeDL({"quiet": True})
+        # process=False skips format selection, which we don't need to read the duration
+        with get_rate_limiter().guard("www.youtube.com"):
+            video_info = ytdl.extract_info(video_id, download=False, process=False)
+        _count_duration_lookup("full_extraction")
+        duration = video_info.get('duration')
+        if cache.enabled:
+            cache.put_value("yt_dlp", video_id, {"duration": duration})
+    if duration is None:
+        _count_duration_lookup("unavailable")
+    return duration
+
+
+def get_videos_in_playlist(playlist_url: str,  min_time: int = 65, max_time: int = 480, wait_time: int = 10, known_ids=None, pool: ScraperPool = None,
+                           backend: str = "browser") -> list[tuple[str, str, int]]:
+    """
+    :param pool: A shared pool of browsers. A single browser is started (and closed) when None
+    :param backend: The listing backend, "http" or "browser"
+    :return: A list of (video ID, title, duration in seconds or None) tuples
+    """
+    return list(list_playlist_videos(playlist_url, backend, pool, wait_time, known_ids))
+
+def get_content_youtube_channel(channel_id: str, min_time: int = 65, max_time: int = 480, wait_time: int = 5, known_ids=None, pool: ScraperPool = None,
+                                backend: str = "browser", state: CrawlState = None, full_rescan: bool = False,
+                                progress: ChannelProgress = None, journal: CheckpointJournal = None) -> tuple[list[str], list[tuple[str, str]]]:
+    """
+    :param pool: A shared pool of browsers. A single browser is started (and closed) when None
+    :param backend: The listing backend, "http" or "browser"
+    :param state: Per-channel high-water marks. When given, listing stops at the first video processed by an earlier run
+    :param full_rescan: Ignore the high-water marks (they are still updated)
+    :param progress: Receives what the crawl found. The marks in state are not moved here: the caller
+                     commits progress to state once the valid videos are enqueued
+    :param journal: Optional checkpoint journal. Videos it has a verdict for are not judged again, and
+                    every new verdict is journaled as soon as it is made
+    """
     if not channel_id.startswith("UC") or not len(channel_id) == 24:
         print("[Error] Invalid Channel ID provided " + channel_id)
         return
-    chrome_driver_path = os.getenv("CHROME_DRIVER_PATH")
-    if chrome_driver_path is None:
-        chrome_driver_path = "/usr/bin/chromedriver"
-    scraper = SiteScraper(chrome_driver_path=chrome_driver_path, wait_time=wait_time)
+    started = time.monotonic()
     succeeded = []
     failed = []
-    ytdl = yt_dlp.YoutubeDL()
-    video_data = scrape_yt_channel_videos("https://www.youtube.com/channel/"+channel_id+"/videos", scraper)
-    for video_id, title in video_data:
-        music_flag = is_potentially_music_content(title)
-        if music_flag[0]: # Check if the video is music content
+    ytdl = yt_dlp.YoutubeDL({"quiet": True})
+    # The high-water marks are usually archived already, so the listing is only filtered after them
+    video_data = list_channel_videos(channel_id, backend, pool, wait_time)
+    if state is not None:
+        if progress is None:
+            progress = ChannelProgress(channel_id)
+        seen_ids, processed_at = state.get_high_water(channel_id)
+        if not full_rescan:
+            progress.seen_ids, progress.since = seen_ids, processed_at
+        video_data = iter_until_seen(video_data, progress)
+    if known_ids is not None:
+        video_data = (video for video in video_data if video[0] not in known_ids)
+    def judge(video_id: str, title: str, valid: bool, reason: str):
+        if valid:
+            print(f"[YouTube Parse] Video {video_id} is valid")
+            succeeded.append((video_id, title))
+        else:
+            print(f"[YouTube Parse] Video {video_id} is not valid: {reason}")
+            failed.append((video_id, reason))
+        if journal is not None:
+            journal.record_verdicts({video_id: (valid, reason)})
+
+    # Titles are classified a listing batch at a time, so the listing stays lazy
+    for batch in _batched(video_data, CLASSIFY_BATCH_SIZE):
+        if journal is not None:
+            # Verdicts from an interrupted run are reused
+            for video_id, title, _ in batch:
+                if video_id in journal.verdicts:
+                    valid, reason = journal.verdicts[video_id]
+                    if valid:
+                        succeeded.append((video_id, title))
+                    else:
+                        failed.append((video_id, reason))
+            batch = [video for video in batch if video[0] not in journal.verdicts]
+        music_flags = classify_music_titles([title for _, title, _ in batch])
+        for (video_id, title, listed_duration), music_flag in zip(batch, music_flags):
+            if not music_flag[0]: # Check if the video is music content
+                judge(video_id, title, False, "Not music content")
+                continue
             # Stage 2. Check length of video
             try:
-                video_info = ytdl.extract_info(video_id, download=False)
+                with get_shared_metrics().timer("duration_lookup"):
+                    duration = resolve_video_duration(video_id, listed_duration, ytdl)
             except Exception:
+                # Not journaled, so a resumed run tries again
                 print(f"[YouTube Parse] Unable to get video info for {video_id}. Skipping...")
                 failed.append((video_id, "Unable to get video info"))
+                if progress is not None:
+                    progress.retry_ids.add(video_id)
                 continue
-            if video_info.get('duration') is not None:
-                duration = video_info.get('duration')
-                if duration > min_time and duration < max_time:
-                    print(f"[YouTube Parse] Video {video_id} is valid")
-                    succeeded.append((video_id, title))
-                else:
-                    print(f"[YouTube Parse] Video {video_id} is not valid: Duration not within specified range")
-                    failed.append((video_id, "Duration not within specified range"))
+            if duration is None:
+                judge(video_id, title, False, "No duration found")
+            elif duration > min_time and duration < max_time:
+                judge(video_id, title, True, "Success")
             else:
-                print(f"[YouTube Parse] Video {video_id} is not valid: No duration found")
-                failed.append((video_id, "No duration found"))
-            succeeded.append((video_id, title))
-        else:
-            print(f"[YouTube Parse] Video {video_id} is not valid: Not music content")
-            failed.append((video_id, "Not music content"))
-    scraper.close()
+                judge(video_id, title, False, "Duration not within specified range")
+    if progress is not None:
+        if progress.since is not None:
+            print(f"[YouTube Parse] {len(progress.new_ids)} new videos on {channel_id} since {time.strftime('%Y-%m-%d %H:%M', time.localtime(progress.since))}")
+        progress.valid = len(succeeded)
+        progress.duration = time.monotonic() - started
     return succeeded, failed
@@ -0,0 +1,123 @@
+from source_parse import extract_yt_initial_data, extract_yt_config, iter_yt_listing_videos, find_yt_continuation_token, find_yt_length_seconds
+from metrics import get_shared_metrics
+import os
+import rate_limit
+import requests
+
+YOUTUBE_BASE_URL = os.getenv("YOUTUBE_BASE_URL") or "https://www.youtube.com"
+
+# Skip the EU consent interstitial, which has no listing data
+CONSENT_COOKIES = {"CONSENT": "YES+cb", "SOCS": "CAI"}
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0 Safari/537.36",
+    "Accept-Language": "en-US,en;q=0.9"
+}
+
+
+class ListingError(Exception):
+    """Raised when a page does not contain the embedded listing data"""
+
+
+class YouTubeListingClient:
+    def __init__(self, session: requests.Session = None, base_url: str = YOUTUBE_BASE_URL, timeout: int = 30, max_pages: int = 1000):
+        """
+        Lists channel uploads and playlist items over plain HTTP, without a browser. The first
+        batch is read from the ytInitialData JSON embedded in the page, the rest is loaded by
+        following continuation tokens through the InnerTube browse endpoint
+        :param session: An optional session to reuse pooled connections
+        :param base_url: The YouTube origin
+        :param timeout: The timeout of a single request in seconds
+        :param max_pages: The maximum number of continuation requests per listing
+        """
+        self.session = session if session is not None else requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS)
+        for name, value in CONSENT_COOKIES.items():
+            self.session.cookies.set(name, value)
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_pages = max_pages
+
+    def _browse(self, config: dict, token: str) -> dict:
+        context = config.get("INNERTUBE_CONTEXT") or {
+            "client": {"clientName": "WEB", "clientVersion": config.get("INNERTUBE_CLIENT_VERSION", "2.20241201.00.00")}
+        }
+        headers = {
+            "X-YouTube-Client-Name": str(config.get("INNERTUBE_CONTEXT_CLIENT_NAME", 1)),
+            "X-YouTube-Client-Version": context.get("client", {}).get("clientVersion", "")
+        }
+        params = {"prettyPrint": "false"}
+        if config.get("INNERTUBE_API_KEY"):
+            params["key"] = config["INNERTUBE_API_KEY"]
+        with get_shared_metrics().timer("page_fetch"):
+            response = rate_limit.request("POST", f"{self.base_url}/youtubei/v1/browse", session=self.session, cache="youtube_listing", idempotent=True,
+                                          params=params, headers=headers,
+                                          json={"context": context, "continuation": token}, timeout=self.timeout)
+            response.raise_for_status()
+        get_shared_metrics().incr("pages_fetched")
+        with get_shared_metrics().timer("parse"):
+            return response.json()
+
+    def iter_listing(self, url: str, known_ids=None):
+        """
+        Lazily yield every video of a listing page, loading further batches only as they are consumed
+        :param url: The channel videos tab or playlist URL
+        :param known_ids: Optional container of video IDs to leave out
+        :return: A generator of (video ID, title, duration in seconds or None) tuples
+        """
+        metrics = get_shared_metrics()
+        with metrics.timer("page_fetch"):
+            response = rate_limit.request("GET", url, session=self.session, cache="youtube_listing", timeout=self.timeout)
+            response.raise_for_status()
+        metrics.incr("pages_fetched")
+        with metrics.timer("parse"):
+            data = extract_yt_initial_data(response.text)
+            config = extract_yt_config(response.text) if data is not None else {}
+        if data is None:
+            raise ListingError(f"No ytInitialData found in {url}")
+        seen = set()
+        pages = 0
+        while data is not None:
+            with metrics.timer("parse"):
+                batch = list(iter_yt_listing_videos(data, known_ids))
+            metrics.incr("videos_found", len(batch))
+            for video_id, title, duration in batch:
+                if video_id not in seen:
+                    seen.add(video_id)
+                    yield video_id, title, duration
+            token = find_yt_continuation_token(data)
+            if token is None or pages >= self.max_pages:
+                return
+            pages += 1
+            data = self._browse(config, token)
+
+    def iter_channel_videos(self, channel_id: str, known_ids=None):
+        """
+        Lazily yield every upload of a channel, newest first
+        :param channel_id: The UC... channel ID
+        :param known_ids: Optional container of video IDs to leave out
+        :return: A generator of (video ID, title, duration in seconds or None) tuples
+        """
+        return self.iter_listing(f"{self.base_url}/channel/{channel_id}/videos", known_ids)
+
+    def iter_playlist_videos(self, playlist_id: str, known_ids=None):
+        """
+        Lazily yield every item of a playlist in playlist order
+        :param playlist_id: The playlist ID or a full playlist URL
+        :param known_ids: Optional container of video IDs to leave out
+        :return: A generator of (video ID, title, duration in seconds or None) tuples
+        """
+        if "list=" in playlist_id:
+            playlist_id = playlist_id.split("list=")[1].split("&")[0]
+        return self.iter_listing(f"{self.base_url}/playlist?list={playlist_id}", known_ids)
+
+    def get_video_duration(self, video_id: str) -> int:
+        """
+        Read a video's duration from the player response embedded in its watch page
+        :param video_id: The video ID
+        :return: The duration in seconds, or None if the page has none
+        """
+        response = rate_limit.request("GET", f"{self.base_url}/watch", session=self.session, cache="youtube_watch", params={"v": video_id},
+                                      timeout=self.timeout)
+        response.raise_for_status()
+        return find_yt_length_seconds(response.text)